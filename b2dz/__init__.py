@@ -1,6 +1,16 @@
 # -*- coding: utf-8 -*-
 """
+Backblaze B2 uploads for Dropzone.
+
+``B2Dropzone`` and everything that needs b2sdk is imported on first use, so
+that ``action.py`` only pays for what the clicked or dragged path needs.
 """
 
-from .b2api import B2Dropzone
 from .dzfuncs import clicked, dragged
+
+
+def __getattr__(name):
+    if name == "B2Dropzone":
+        from .b2api import B2Dropzone
+        return B2Dropzone
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
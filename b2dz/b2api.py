@@ -1,18 +1,32 @@
 # -*- coding: utf-8 -*-
+import json
 import logging
-import multiprocessing as mp
 import os
 import sys
 import time
-import traceback
 
 import dropzone as dz
-from b2sdk.sync.sync import Synchronizer
-from b2sdk.v2 import B2Api
-from b2sdk.v2 import parse_sync_folder
+from b2sdk.v2 import CompareVersionMode, UploadSourceStream, \
+    parse_sync_folder
+from . import dzconfig
 from .b2dz_account_info import DropzoneB2AccountInfo
-from .dzfolder import DropzoneFolder
-from .dzprogress import DropzoneSyncReport
+from .dzapi import DropzoneB2Api
+from .dzauth import SharedAuthorization
+from .dzconfig import AUTH_FILENAME, HASH_MEMO_FILENAME, \
+    RESUME_JOURNAL_FILENAME, THROTTLE_SETTINGS_FILENAME, \
+    UPLOAD_INDEX_FILENAME, ConfigDialog, load_config
+from .dzconcurrency import ConcurrencyController
+from .dzfolder import DropzoneFolder, ScandirFolder
+from .dzhash import FileHasher, HashAhead
+from .dzindex import BlindB2Folder, IndexedB2Folder, UploadIndex
+from .dzplanner import MEGABYTE, PartPlanner
+from .dzprogress import DropzoneProgressListener, DropzoneSyncReport
+from .dzresume import ResumeJournal
+from .dzschedule import DEFAULT_ORDER, TransferScheduler
+from .dzsupport import support_path
+from .dzsync import DropzoneSynchronizer
+from .dztelemetry import DropTelemetry
+from .dzthrottle import KILOBYTE, RateSchedule, UploadThrottle
 
 
 logger = logging.getLogger(__name__)
@@ -20,61 +34,49 @@ logger.setLevel(logging.DEBUG)
 logging.basicConfig(level=logging.INFO)
 
 
+TELEMETRY_FILENAME = "telemetry.jsonl"
+"""Where every drop appends a record of how it went"""
+
+UPLOAD_WORKERS = 16
+"""Size of the thread pool that uploads files and large file parts"""
+
+
 class B2Dropzone(object):
-    _config_dialog = """
-    *.title = Backblaze B2 Options
-    application_key_id.type = textfield
-    application_key_id.label = Application Key ID:
-    application_key_id.mandatory = 1
-    application_key_id.default = %(application_key_id)s
-    application_key.type = password
-    application_key.label = Application Key:
-    application_key.default = %(application_key)s
-    application_key.mandatory = 1
-    bucket_name.type = textfield
-    bucket_name.label = Bucket Name
-    bucket_name.default = %(bucket_name)s
-    prefix.type = textfield
-    prefix.label = Path Prefix
-    prefix.default = %(prefix)s
-    custom_download_url.type = textfield
-    custom_download_url.label = Custom URL (i.e. Cloudflare domain)
-    custom_download_url.default = %(custom_download_url)s
-    
-    saved.type = defaultbutton
-    saved.label = Save
-    cancelled.type = cancelbutton
-    clear_cache.type = button
-    clear_cache.label = Clear Cache
-    """
-    """Definition of the configuration menu using Pashua"""
+    COMPARE_VERSION_MODES = {
+        "modtime": CompareVersionMode.MODTIME,
+        "size": CompareVersionMode.SIZE,
+        "none": CompareVersionMode.NONE,
+        "blind": CompareVersionMode.NONE,  # nothing to compare with
+    }
+    """How a profile's ``compare`` setting tells sync that a file changed"""
 
     def __init__(self):
         logger.debug("Current environ:\n\t%s", os.environ)
         logger.debug("Key modifier: %s", self.key_modifier)
-        self.config = DropzoneB2AccountInfo()
-        try:
-            self.config.load_config()
-            print(self.config)
-        except Exception as ex:
-            logger.error(traceback.format_exc())
-            dz.alert("Configuration Corrupt", "%s" % " ".join(ex.args))
-            self.config = DropzoneB2AccountInfo()  # fresh new config
-            self.config.save_config()
-        if not self.config.is_valid or self.clicked:
-            accepted = self.show_config()
-            if accepted is False:
+        self.config = load_config(DropzoneB2AccountInfo)
+        self.upload_index = UploadIndex(support_path(UPLOAD_INDEX_FILENAME))
+        self.hasher = FileHasher(support_path(HASH_MEMO_FILENAME))
+        self.resume_journal = ResumeJournal(
+            support_path(RESUME_JOURNAL_FILENAME))
+        self.shared_auth = SharedAuthorization(support_path(AUTH_FILENAME))
+        self.finish_message = None
+        # a click shows the dialog before this module is even imported
+        if not self.config.is_valid:
+            dialog = ConfigDialog(self.config, caches=[
+                self.upload_index, self.hasher, self.resume_journal,
+                self.shared_auth])
+            if not dialog.show():
                 dz.fail("Configuration was cancelled.")
                 return  # the config screen was cancelled
+            self.config = dialog.config
 
-        self.api = B2Api(self.config)
-        if not self.config.allowed or not self.config.auth_token:
-            logger.info("Need to reauthorize!")
-            self.api.authorize_account("production",
-                                       self.config.application_key_id,
-                                       self.config.application_key)
-        else:
-            logger.debug("No need to reauthorize.")
+        self.api = DropzoneB2Api(self.config, upload_index=self.upload_index,
+                                 hasher=self.hasher,
+                                 throttle=self.make_throttle(),
+                                 resume_journal=self.resume_journal,
+                                 compressor=self.make_compressor(),
+                                 max_upload_workers=UPLOAD_WORKERS)
+        self.ensure_authorized()
 
         if self.config.bucket_name is None:
             bucket = self.show_bucket_select()
@@ -83,6 +85,36 @@ class B2Dropzone(object):
                 return
             self.config.bucket_name = bucket.name
 
+    def ensure_authorized(self):
+        """
+        Authorize if the saved token is missing or about to expire, unless
+        another b2dz process just did and we can use its token.
+        """
+        if not self.config.needs_authorization:
+            logger.debug("No need to reauthorize.")
+            return
+        with self.shared_auth.locked():
+            # whoever held the lock before us may have authorized already
+            auth_data = self.shared_auth.load()
+            if auth_data and self.config.import_auth_data(auth_data) and \
+                    not self.config.needs_authorization:
+                logger.info("Using the authorization of another drop")
+                return
+            logger.info("Need to reauthorize!")
+            self.api.authorize_account("production",
+                                       self.config.application_key_id,
+                                       self.config.application_key)
+            self.shared_auth.save(self.config.export_auth_data())
+
+    def close(self):
+        """
+        Close the local databases. Only needed by a process that outlives
+        this object, like the background uploader.
+        """
+        self.upload_index.close()
+        self.hasher.close()
+        self.resume_journal.close()
+
     @property
     def b2_dest_path(self):
         """
@@ -164,9 +196,7 @@ class B2Dropzone(object):
         :rtype: str
         """
         filename = os.path.basename(filepath).strip("/")
-        prefix = self.config.effective_prefix.strip("/")
-        filename = prefix + "/" + filename
-        filename = filename.lstrip("/")
+        filename = self._b2_file_name(filename)
         url = self.config.effective_download_url + filename
         return url
 
@@ -196,43 +226,86 @@ class B2Dropzone(object):
         bucket_name = result["b"]
         return bucket_map[bucket_name]
 
-    def show_config(self):
-        """
-        Prompts the user to modify the configuration.
-        """
-        config = self.config
-        while True:
-            config_dict = {
-                "application_key_id": config.application_key_id,
-                "application_key": config.application_key,
-                "bucket_name": config.bucket_name,
-                "prefix": config.prefix,
-                "custom_download_url": config.custom_download_url,
-            }
-            # replace None values with empty strings
-            config_dict = {k: "" if v is None else v for k, v in config_dict.items()}
-            dialog_box = self._config_dialog % config_dict
-            # while True:
-            results = dz.pashua(dialog_box)
-            logger.debug(results)
-            if results.get("clear_cache") == "1":
-                config.clear_cache()
-                continue
-            elif results["cancelled"] == "1" or results["saved"] != "1":
-                logger.debug("Cancelled!")
-                return False
-
-            try:
-                config = DropzoneB2AccountInfo(**results)
-            except Exception as ex:
-                dz.alert("Invalid Configuration", " ".join(ex.args))
-                continue
-
-            if config.is_valid:
-                config.save_config()
-                self.config = config
-                return True
-            # if config isn't valid, we show the dialog box again
+    @property
+    def profile(self):
+        """
+        The transfer profile picked by the key held while dropping.
+
+        :rtype: b2dz.dzprofiles.TransferProfile|None
+        """
+        return self.config.profile_for(self.key_modifier)
+
+    def make_throttle(self, profile=None):
+        """
+        The upload bandwidth limit from the configuration. It also follows
+        limits saved by other b2dz processes while it runs. A profile's limit
+        replaces both for the drop.
+
+        :type profile: b2dz.dzprofiles.TransferProfile|None
+        :rtype: UploadThrottle
+        """
+        if profile is not None and profile.rate_limit:
+            return UploadThrottle(profile.rate_limit * KILOBYTE)
+        rate_limit = self.config.rate_limit
+        return UploadThrottle(
+            rate_limit * KILOBYTE if rate_limit else None,
+            RateSchedule.parse(self.config.rate_schedule),
+            settings_path=support_path(THROTTLE_SETTINGS_FILENAME),
+        )
+
+    def make_compressor(self, profile=None):
+        """
+        :type profile: b2dz.dzprofiles.TransferProfile|None
+        :return: a compressor for the configured encoding or None if
+                 compression is off
+        :rtype: b2dz.dzcompress.Compressor|None
+        """
+        encoding = self.config.compress
+        if profile is not None and profile.compress:
+            encoding = profile.compress
+        if encoding is None or encoding == "none":
+            return None
+        # only imported by drops that compress
+        from .dzcompress import Compressor
+        return Compressor(encoding)
+
+    def make_async_engine(self):
+        """
+        :return: an engine for small files if the user picked asyncio and
+                 aiohttp is installed, otherwise None
+        :rtype: b2dz.dzasync.AsyncUploadEngine|None
+        """
+        if self.config.engine != "asyncio":
+            return None
+        # importing it imports aiohttp, which no other drop needs
+        from .dzasync import AsyncUploadEngine, aiohttp
+        if aiohttp is None:
+            logger.warning("aiohttp is not installed, uploading small files "
+                           "with threads instead")
+            return None
+        return AsyncUploadEngine(self.api)
+
+    def make_part_planner(self, profile=None):
+        """
+        A part planner for this drop using the user's part settings and the
+        throughput measured during earlier drops.
+
+        :type profile: b2dz.dzprofiles.TransferProfile|None
+        :rtype: PartPlanner
+        """
+        part_size = self.config.part_size
+        part_streams = self.config.part_streams
+        if profile is not None:
+            part_size = profile.part_size or part_size
+            part_streams = profile.part_streams or part_streams
+        return PartPlanner(
+            self.config.get_recommended_part_size(),
+            self.config.get_absolute_minimum_part_size(),
+            UPLOAD_WORKERS,
+            throughput=self.config.throughput,
+            part_size=part_size * MEGABYTE if part_size else None,
+            part_streams=part_streams,
+        )
 
     def upload_files(self):
         """
@@ -244,9 +317,93 @@ class B2Dropzone(object):
         :rtype: str|bool
         """
         dz.begin("Uploading files...")
-        sync = Synchronizer(max_workers=mp.cpu_count())
+        self.finish_message = None
+        self.ensure_authorized()  # the daemon may have kept it for hours
+        self.api.cancel_expired_uploads()
+        profile = self.profile
+        if profile is not None:
+            logger.info("Uploading with the profile %s", profile)
+        self.api.part_planner = planner = self.make_part_planner(profile)
+        # the daemon keeps its API between drops with different profiles
+        self.api.throttle = self.make_throttle(profile)
+        self.api.compressor = self.make_compressor(profile)
+        workers = self.config.workers
+        order = self.config.order
+        compare = None
+        if profile is not None:
+            workers = profile.workers or workers
+            order = profile.order or order
+            compare = profile.compare
+        blind = compare == "blind" or self.config.prefix_is_unique
+        self.api.telemetry = telemetry = DropTelemetry(
+            items=len(self.items),
+            modifier=self.key_modifier,
+            profile=profile.name if profile is not None else None,
+            pack=bool(profile is not None and profile.pack),
+            workers=workers,
+            part_size=planner.fixed_part_size,
+            part_streams=planner.fixed_part_streams,
+            rate_limit=self.api.throttle.rate,
+            compress=self.api.compressor and self.api.compressor.encoding,
+            compare=compare or "modtime",
+            blind=blind,
+            order=order,
+            engine=self.config.engine,
+        )
+
+        def count_retry(bucket_id):
+            telemetry.retry()
+
+        self.config.upload_error_listeners.append(count_retry)
+        error = None
+        try:
+            if profile is not None and profile.pack:
+                return self.upload_packed()
+            return self.upload_synced(planner, workers, compare, blind,
+                                      telemetry, order)
+        except BaseException as ex:
+            error = ex
+            raise
+        finally:
+            self.config.upload_error_listeners.remove(count_retry)
+            self.api.telemetry = None
+            telemetry.finish(error)
+            telemetry.write(support_path(TELEMETRY_FILENAME))
+
+    def upload_synced(self, planner, workers, compare, blind, telemetry=None,
+                      order=DEFAULT_ORDER):
+        """
+        Sync the dropped folders and files to their places in B2.
+
+        :param planner: the drop's part planner
+        :type planner: PartPlanner
+        :param workers: files at once, None to adapt
+        :type workers: int|None
+        :param compare: a profile's ``compare`` setting
+        :type compare: str|None
+        :param blind: upload without listing the destination
+        :type blind: bool
+        :param telemetry: the drop's numbers
+        :type telemetry: b2dz.dztelemetry.DropTelemetry|None
+        :param order: which files go first, one of
+                      ``b2dz.dzschedule.ORDERS``
+        :type order: str
+        :return: if only a single file was uploaded, a URL, otherwise False
+        :rtype: str|bool
+        """
+        controller = ConcurrencyController(maximum=UPLOAD_WORKERS,
+                                           fixed=workers)
+        scheduler = TransferScheduler(order, planner.large_file_size,
+                                      workers=lambda: controller.limit)
+        sync = DropzoneSynchronizer(
+            max_workers=controller.maximum, controller=controller,
+            scheduler=scheduler, async_engine=self.make_async_engine(),
+            hash_ahead=HashAhead(self.hasher),
+            compare_version_mode=self.COMPARE_VERSION_MODES[
+                compare or "modtime"])
         folders = [
-            (parse_sync_folder(f, self.api), self._dest_subpath(f))
+            (parse_sync_folder(f, self.api, local_folder_class=ScandirFolder),
+             self._dest_subpath(f))
             for f in self.items if os.path.isdir(f)
         ]
         """:type: list[tuple[b2sdk.sync.folder.AbstractFolder,str]]"""
@@ -257,17 +414,110 @@ class B2Dropzone(object):
         if files:
             folders.append((DropzoneFolder(files), self.b2_dest_path))
         logger.debug(folders)
-        for folder, dest_path in folders:
-            logger.debug("%s, %s", folder, dest_path)
-            dest_folder = parse_sync_folder(dest_path, self.api)
-            with DropzoneSyncReport(sys.stdout, False) as reporter:
+        b2_folder_class = IndexedB2Folder
+        if blind:
+            # nothing can be there yet, or the user doesn't want to know
+            logger.info("Uploading without listing %s", self.b2_dest_path)
+            b2_folder_class = BlindB2Folder
+        folder_pairs = [
+            (folder, parse_sync_folder(dest_path, self.api,
+                                       b2_folder_class=b2_folder_class))
+            for folder, dest_path in folders
+        ]
+
+        def back_off(bucket_id):
+            controller.back_off()
+
+        self.config.upload_error_listeners.append(back_off)
+        try:
+            # the controller learns the throughput while files are uploading
+            with DropzoneSyncReport(sys.stdout, False,
+                                    sources=len(folder_pairs),
+                                    telemetry=telemetry,
+                                    bytes_listener=controller.record) \
+                    as reporter:
                 millis = int(round(time.time() * 1000))
-                sync.sync_folders(folder, dest_folder, millis, reporter)
+                sync.sync_many(folder_pairs, millis, reporter)
+        finally:
+            self.config.upload_error_listeners.remove(back_off)
+        self.finish_message = reporter.estimator.summary()
+        throughput = planner.measured_throughput()
+        if throughput:
+            logger.info("Uploads ran at about %d bytes per second", throughput)
+            self.config.throughput = throughput
+            self.config.save_config()
+        logger.info("Hashed %d bytes, %.0f%% of hashes were remembered",
+                    self.hasher.bytes_hashed, self.hasher.hit_rate * 100)
+        compressor = self.api.compressor
+        if compressor is not None and compressor.bytes_in:
+            logger.info("Compressed %d bytes to %d with %s",
+                        compressor.bytes_in, compressor.bytes_out,
+                        compressor.encoding)
         if len(folders) == 1 and len(files) == 1:
             return self.get_url(files[0])
         else:
             return False
 
+    def upload_packed(self):
+        """
+        Upload everything that was dropped as one tar archive, plus an index
+        of where each file is in it.
+
+        :return: the URL of the archive
+        :rtype: str
+        """
+        dz.begin("Packing files...")
+        # tarfile and the archive code are only needed by packed drops
+        from .dzpack import INDEX_SUFFIX, TarPlan
+        plan = TarPlan.from_items(self.items)
+        telemetry = self.api.telemetry
+        if telemetry is not None:
+            telemetry.end_phase("scan")
+        if len(self.items) == 1:
+            archive_name = os.path.basename(self.items[0].rstrip(os.sep))
+        else:
+            archive_name = dzconfig.ACTION_START.strftime(
+                "b2dz-%Y%m%d-%H%M%S")
+        archive_name += ".tar"
+        file_name = self._b2_file_name(archive_name)
+        bucket = self.api.get_bucket_by_name(self.config.bucket_name)
+
+        dz.begin("Uploading %d files as %s..." % (len(plan.members),
+                                                  archive_name))
+        upload_source = UploadSourceStream(plan.open, stream_length=plan.size)
+        file_info = {}
+        compressor = self.api.compressor
+        if compressor is not None:
+            upload_source = compressor.stream_upload_source(
+                plan.open, plan.size, archive_name)
+            file_info["b2-content-encoding"] = compressor.encoding
+        listener = DropzoneProgressListener()
+        bucket.upload(upload_source, file_name, file_info=file_info,
+                      content_type="application/x-tar",
+                      progress_listener=listener)
+        listener.estimator.update(upload_source.get_content_length())
+        self.finish_message = listener.estimator.summary()
+        if telemetry is not None:
+            telemetry.end_phase("transfer")
+        compressed = upload_source if compressor is not None else None
+        index = json.dumps(plan.index(file_name, compressed),
+                           separators=(",", ":"))
+        bucket.upload_bytes(index.encode("utf-8"), file_name + INDEX_SUFFIX,
+                            content_type="application/json")
+        logger.info("Packed %d files into %s (%d bytes)", len(plan.members),
+                    file_name, plan.size)
+        return self.get_url(archive_name)
+
+    def _b2_file_name(self, filename):
+        """
+        :param filename: a file name without any folders
+        :type filename: str
+        :return: the name the file gets in B2 under the configured prefix
+        :rtype: str
+        """
+        prefix = self.config.effective_prefix.strip("/")
+        return (prefix + "/" + filename).lstrip("/")
+
     def _dest_subpath(self, filepath):
         """
         Returns an adjusted B2 destination path to include the name of the
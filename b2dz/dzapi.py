@@ -0,0 +1,590 @@
+# -*- coding: utf-8 -*-
+"""
+b2sdk ``B2Api`` and ``Bucket`` subclasses that let b2dz keep track of what it
+uploads, avoid uploading bytes that are already in the bucket and avoid
+hashing files it has hashed before. Large files are split into parts and
+sent in parallel as planned by ``b2dz.dzplanner.PartPlanner``, and pick up
+where they left off if an earlier drop was interrupted.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from b2sdk.stream.wrapper import StreamWrapper
+from b2sdk.transfer.emerge.emerger import Emerger
+from b2sdk.transfer.emerge.planner.part_definition import \
+    UploadEmergePartDefinition
+from b2sdk.transfer.emerge.planner.planner import EmergePlanner
+from b2sdk.transfer.outbound.upload_manager import UploadManager
+from b2sdk.v2 import AbstractUploadSource, AuthInfoCache, B2Api, \
+    B2HttpApiConfig, Bucket, BucketFactory, UploadSourceLocalFile, WriteIntent
+from b2sdk.v2.exception import B2Error
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.poolmanager import PoolKey
+from .dzhash import HashedUploadEmergePartDefinition, HashedUploadSource
+from .dzschedule import large_lane_size
+from .dztelemetry import TelemetryHttpCallback
+
+
+logger = logging.getLogger(__name__)
+
+
+AUTO_CONTENT_TYPE = "b2/x-auto"
+"""Let B2 pick the content type from the file name"""
+
+
+class DropzoneBucket(Bucket):
+    """
+    A Bucket that records every file it creates in the API's upload index and
+    makes a server-side copy instead of uploading when the index already
+    knows a file with the same SHA1.
+    """
+
+    DEDUP_MIN_SIZE = 1024 * 1024
+    """Files smaller than this are cheaper to upload than to hash first"""
+
+    MAX_SIMPLE_COPY_SIZE = 5 * 1000 * 1000 * 1000
+    """Larger files have to be copied part by part"""
+
+    def upload(self, upload_source, file_name, content_type=None,
+               file_info=None, min_part_size=None, progress_listener=None,
+               encryption=None, file_retention=None, legal_hold=None):
+        started = time.monotonic()
+        part_size = None
+        upload_source = self._hashed_source(upload_source)
+        file_version = self._copy_duplicate(upload_source, file_name,
+                                            content_type, file_info,
+                                            progress_listener, encryption)
+        copied = file_version is not None
+        if file_version is None:
+            upload_source, file_info = self._compressed(upload_source,
+                                                        file_info)
+            with self._planned_parts(upload_source) as (part_size, streams), \
+                    self.api.services.upload_manager.part_streams(streams):
+                part_size = min_part_size or part_size
+                file_info = self._large_file_info(upload_source, file_info,
+                                                  part_size)
+                file_version = self._upload_resumable(
+                    upload_source, file_name, content_type, file_info,
+                    part_size, progress_listener, encryption, file_retention,
+                    legal_hold)
+        self._record(file_version)
+        telemetry = self.api.telemetry
+        if telemetry is not None:
+            if part_size is not None and file_version.size <= part_size:
+                part_size = None  # it went up in one piece
+            telemetry.file_done(file_version.file_name, file_version.size,
+                                time.monotonic() - started, part_size, copied)
+        return file_version
+
+    def _upload_resumable(self, upload_source, file_name, content_type,
+                          file_info, part_size, progress_listener, encryption,
+                          file_retention, legal_hold):
+        """
+        Upload a local file, carrying on with an unfinished large file from
+        an earlier drop if the resume journal knows one.
+        """
+        journal = self.api.resume_journal
+        if part_size is None:
+            part_size = self.api.account_info.get_recommended_part_size()
+        if journal is None or \
+                not isinstance(upload_source, HashedUploadSource) or \
+                upload_source.get_content_length() <= part_size:
+            return super(DropzoneBucket, self).upload(
+                upload_source, file_name, content_type=content_type,
+                file_info=file_info, min_part_size=part_size,
+                progress_listener=progress_listener, encryption=encryption,
+                file_retention=file_retention, legal_hold=legal_hold)
+
+        local_path = upload_source.local_path
+        large_file_id = None
+        resume = self._find_resumable(journal, file_name, local_path)
+        if resume is not None:
+            # the parts have to line up with the ones already sent
+            large_file_id, part_size = resume
+
+        def started(file_id):
+            self.api.cancel_large_files(journal.start(
+                self.id_, file_name, local_path, part_size, file_id))
+
+        try:
+            with self.api.services.upload_manager.journaling(started):
+                file_version = self.create_file(
+                    [WriteIntent(upload_source)], file_name,
+                    content_type=content_type, file_info=file_info,
+                    progress_listener=progress_listener,
+                    recommended_upload_part_size=part_size,
+                    continue_large_file_id=large_file_id,
+                    encryption=encryption, file_retention=file_retention,
+                    legal_hold=legal_hold)
+        except ValueError:
+            if large_file_id is None:
+                raise
+            # b2sdk refuses to resume a file whose file info has changed
+            logger.warning("Could not resume %s, starting over", file_name,
+                           exc_info=True)
+            self.api.cancel_large_files(journal.abandon(self.id_, file_name))
+            return self._upload_resumable(
+                upload_source, file_name, content_type, file_info, part_size,
+                progress_listener, encryption, file_retention, legal_hold)
+        journal.finish(self.id_, file_name)
+        return file_version
+
+    def _find_resumable(self, journal, file_name, local_path):
+        """
+        :return: the ID and part size of an unfinished large file that an
+                 earlier drop of ``local_path`` started and B2 still has
+        :rtype: tuple[str, int]|None
+        """
+        resume = journal.find(self.id_, file_name, local_path)
+        if resume is None:
+            return None
+        large_file_id = resume[0]
+        unfinished = self.api.services.large_file.get_unfinished_large_file(
+            self.id_, large_file_id, prefix=file_name)
+        if unfinished is None:
+            logger.info("%s was cancelled or finished elsewhere", file_name)
+            journal.finish(self.id_, file_name)
+            return None
+        logger.info("Resuming %s from an earlier drop", file_name)
+        return resume
+
+    def copy(self, file_id, new_file_name, *args, **kwargs):
+        file_version = super(DropzoneBucket, self).copy(
+            file_id, new_file_name, *args, **kwargs)
+        self._record(file_version)
+        return file_version
+
+    def may_have_duplicate(self, size):
+        """
+        Whether uploading a local file of ``size`` bytes should start by
+        hashing it to look for a copy already in the bucket. The upload index
+        is asked for files of that size first, so files nothing could match
+        are never read just to be hashed.
+
+        :type size: int
+        :rtype: bool
+        """
+        index = self.api.upload_index
+        return index is not None and size >= self.DEDUP_MIN_SIZE and \
+            index.has_size(self.id_, size)
+
+    def _copy_duplicate(self, upload_source, file_name, content_type,
+                        file_info, progress_listener, encryption):
+        """
+        If a file with the same contents as ``upload_source`` was already
+        uploaded to this bucket, copy it to ``file_name`` server-side.
+
+        :return: the new file or None if it still has to be uploaded
+        :rtype: b2sdk.v2.FileVersion|None
+        """
+        index = self.api.upload_index
+        if not isinstance(upload_source, HashedUploadSource):
+            return None
+        size = upload_source.get_content_length()
+        if not self.may_have_duplicate(size):
+            return None  # no need to read the file to know there's no match
+
+        sha1 = upload_source.get_content_sha1()
+        existing = index.find_by_sha1(self.id_, sha1, size)
+        if existing is None:
+            return None
+
+        existing_id, existing_name = existing
+        logger.info("%s has the same contents as %s, copying instead of "
+                    "uploading", file_name, existing_name)
+        try:
+            file_version = super(DropzoneBucket, self).copy(
+                existing_id, file_name,
+                content_type=content_type or AUTO_CONTENT_TYPE,
+                file_info=file_info or {},
+                length=size if size > self.MAX_SIMPLE_COPY_SIZE else None,
+                destination_encryption=encryption)
+        except B2Error:
+            logger.warning("Could not copy %s, uploading it instead",
+                           existing_name, exc_info=True)
+            index.forget(self.id_, existing_name)
+            return None
+
+        if progress_listener is not None:
+            with progress_listener:
+                progress_listener.set_total_bytes(size)
+                progress_listener.bytes_completed(size)
+        return file_version
+
+    def _compressed(self, upload_source, file_info):
+        """
+        Swap a local file upload source for a compressed one if the API has
+        a compressor and the file is worth compressing.
+
+        :return: the upload source and file info to upload with
+        :rtype: tuple
+        """
+        compressor = self.api.compressor
+        if compressor is None or \
+                not isinstance(upload_source, UploadSourceLocalFile):
+            return upload_source, file_info
+        size = upload_source.get_content_length()
+        if not compressor.is_worth_it(upload_source.local_path, size):
+            return upload_source, file_info
+        compressed = compressor.upload_source(upload_source.local_path)
+        if compressed.get_content_length() >= size:
+            return upload_source, file_info
+        logger.debug("Compressed %s from %d to %d bytes",
+                     upload_source.local_path, size,
+                     compressed.get_content_length())
+        file_info = dict(file_info or {})
+        # B2 hands this back as the Content-Encoding header
+        file_info["b2-content-encoding"] = compressor.encoding
+        return compressed, file_info
+
+    def _hashed_source(self, upload_source):
+        """
+        Swap a plain local file upload source for one that uses our hasher.
+        """
+        hasher = self.api.hasher
+        if hasher is None or type(upload_source) is not UploadSourceLocalFile:
+            return upload_source
+        return HashedUploadSource(upload_source.local_path, hasher,
+                                  upload_source.content_sha1)
+
+    @contextmanager
+    def _planned_parts(self, upload_source):
+        """
+        Ask the API's part planner how to split up ``upload_source``.
+
+        :return: a context manager giving (part size or None, parallel parts)
+        """
+        planner = self.api.part_planner
+        if planner is None:
+            yield None, None
+            return
+        with planner.uploading(upload_source.get_content_length()) as plan:
+            logger.debug("Planned %s as parts of %s bytes, %s at a time",
+                         upload_source, *plan)
+            yield plan
+
+    def _large_file_info(self, upload_source, file_info, part_size=None):
+        """
+        B2 can't work out the SHA1 of a large file on its own, so add it to
+        the file info if we already know it.
+        """
+        if not isinstance(upload_source, HashedUploadSource):
+            return file_info
+        if part_size is None:
+            part_size = self.api.account_info.get_recommended_part_size()
+        if upload_source.get_content_length() <= part_size:
+            return file_info
+        if not upload_source.is_sha1_known():
+            return file_info
+        file_info = dict(file_info or {})
+        file_info["large_file_sha1"] = upload_source.content_sha1
+        return file_info
+
+    def _record(self, file_version):
+        index = self.api.upload_index
+        if index is None:
+            return
+        try:
+            index.record(file_version)
+        except Exception:
+            # the upload itself worked, a broken index only costs us a listing
+            logger.exception("Could not record %s in the upload index",
+                             file_version.file_name)
+
+
+class DropzoneBucketFactory(BucketFactory):
+    BUCKET_CLASS = staticmethod(DropzoneBucket)
+
+
+class DropzoneEmergePlanner(EmergePlanner):
+    """
+    Plans large file parts whose SHA1s come from the upload source's hasher.
+    """
+
+    def _get_upload_part(self, upload_buffer):
+        emerge_part = super(DropzoneEmergePlanner, self)._get_upload_part(
+            upload_buffer)
+        definition = emerge_part.part_definition
+        if type(definition) is UploadEmergePartDefinition and \
+                isinstance(definition.upload_source, HashedUploadSource):
+            emerge_part.part_definition = HashedUploadEmergePartDefinition(
+                definition.upload_source, definition.relative_offset,
+                definition.length)
+        return emerge_part
+
+
+class ThrottledStream(StreamWrapper):
+    """
+    A stream whose reads are paid for from a
+    ``b2dz.dzthrottle.UploadThrottle``.
+    """
+
+    def __init__(self, stream, throttle):
+        super(ThrottledStream, self).__init__(stream)
+        self.throttle = throttle
+
+    def read(self, size=None):
+        data = super(ThrottledStream, self).read(size)
+        self.throttle.consume(len(data))
+        return data
+
+    def close(self):
+        super(ThrottledStream, self).close()
+        self.stream.close()
+
+
+class ThrottledUploadSource(AbstractUploadSource):
+    """
+    Wraps any upload source so the streams it opens are throttled.
+    """
+
+    def __init__(self, upload_source, throttle):
+        """
+        :type upload_source: b2sdk.v2.AbstractUploadSource
+        :type throttle: b2dz.dzthrottle.UploadThrottle
+        """
+        self.upload_source = upload_source
+        self.throttle = throttle
+
+    def __repr__(self):
+        return "<%s %r>" % (self.__class__.__name__, self.upload_source)
+
+    def get_content_length(self):
+        return self.upload_source.get_content_length()
+
+    def get_content_sha1(self):
+        return self.upload_source.get_content_sha1()
+
+    def is_sha1_known(self):
+        return self.upload_source.is_sha1_known()
+
+    def open(self):
+        return ThrottledStream(self.upload_source.open(), self.throttle)
+
+
+class DropzoneUploadManager(UploadManager):
+    """
+    An UploadManager that can limit how many parts of one large file are
+    being uploaded at the same time, so one huge file doesn't take every
+    upload thread from the other files in a drop, and that sends everything
+    it uploads through the API's bandwidth throttle.
+
+    Parts of large files only ever hold ``large_lane_size`` of the upload
+    threads, the rest are kept for files that go up in one piece.
+    """
+
+    def __init__(self, services, max_upload_workers=10):
+        super(DropzoneUploadManager, self).__init__(services,
+                                                    max_upload_workers)
+        self._local = threading.local()
+        self._part_lane = threading.BoundedSemaphore(
+            large_lane_size(max_upload_workers))
+
+    @contextmanager
+    def journaling(self, started):
+        """
+        Report the ID of the large file that uploads from this thread go
+        into, once it is known.
+
+        :param started: called with the large file ID when its first part
+                        is sent
+        :type started: callable
+        """
+        self._local.started = started
+        self._local.started_file_ids = set()
+        try:
+            yield
+        finally:
+            self._local.started = None
+
+    @contextmanager
+    def part_streams(self, streams):
+        """
+        Limit the parts uploaded at once for files uploaded from this thread.
+
+        :param streams: most parts of one file in flight, None for no limit
+        :type streams: int|None
+        """
+        if not streams:
+            yield
+            return
+        self._local.semaphore = threading.BoundedSemaphore(streams)
+        try:
+            yield
+        finally:
+            self._local.semaphore = None
+
+    def upload_part(self, bucket_id, file_id, part_upload_source, part_number,
+                    large_file_upload_state, finished_parts=None,
+                    encryption=None):
+        # b2sdk schedules every part from the thread that called upload()
+        started = getattr(self._local, "started", None)
+        if started is not None and \
+                file_id not in self._local.started_file_ids:
+            self._local.started_file_ids.add(file_id)
+            started(file_id)
+        semaphores = [getattr(self._local, "semaphore", None),
+                      self._part_lane]
+        semaphores = [sem for sem in semaphores if sem is not None]
+        for semaphore in semaphores:
+            semaphore.acquire()
+
+        def release(_=None):
+            for semaphore in reversed(semaphores):
+                semaphore.release()
+
+        try:
+            future = super(DropzoneUploadManager, self).upload_part(
+                bucket_id, file_id, part_upload_source, part_number,
+                large_file_upload_state, finished_parts, encryption)
+        except Exception:
+            release()
+            raise
+        future.add_done_callback(release)
+        return future
+
+    def _upload_part(self, bucket_id, file_id, part_upload_source,
+                     part_number, large_file_upload_state, finished_parts,
+                     encryption):
+        finished_part = (finished_parts or {}).get(part_number)
+        if finished_part is not None and (
+                not part_upload_source.is_sha1_known() or
+                finished_part.content_sha1 !=
+                part_upload_source.get_content_sha1()):
+            # B2 has a part with this number, but not this part
+            logger.info("Part %d of %s doesn't match, sending it again",
+                        part_number, file_id)
+            finished_parts = None
+        return super(DropzoneUploadManager, self)._upload_part(
+            bucket_id, file_id, self._throttled(part_upload_source),
+            part_number, large_file_upload_state, finished_parts, encryption)
+
+    def _upload_small_file(self, bucket_id, upload_source, *args):
+        return super(DropzoneUploadManager, self)._upload_small_file(
+            bucket_id, self._throttled(upload_source), *args)
+
+    def _throttled(self, upload_source):
+        throttle = self.services.api.throttle
+        if throttle is None:
+            return upload_source
+        return ThrottledUploadSource(upload_source, throttle)
+
+
+class DropzoneEmerger(Emerger):
+    def get_emerge_planner(self, recommended_upload_part_size=None):
+        return DropzoneEmergePlanner.from_account_info(
+            self.services.session.account_info,
+            recommended_upload_part_size=recommended_upload_part_size,
+        )
+
+
+class LargeBlockHTTPAdapter(HTTPAdapter):
+    """
+    Sends request bodies in blocks of ``BLOCK_SIZE`` instead of the 16 KB
+    urllib3 reads at a time. Large file parts are views of a memory mapping
+    (see ``b2dz.dzmmap.MappedRange``), so a bigger block costs no copying
+    and saves a trip through every stream wrapper b2sdk puts around a part.
+    """
+
+    BLOCK_SIZE = 256 * 1024
+    """Bytes read from a request body at a time"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        # urllib3 1.x can't take a block size
+        if "key_blocksize" in PoolKey._fields:
+            kwargs.setdefault("blocksize", self.BLOCK_SIZE)
+        super(LargeBlockHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+
+
+def large_block_session():
+    """
+    :return: a session that sends request bodies with ``LargeBlockHTTPAdapter``
+    :rtype: requests.Session
+    """
+    session = requests.Session()
+    adapter = LargeBlockHTTPAdapter()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class DropzoneB2Api(B2Api):
+    """
+    A B2Api that hands out ``DropzoneBucket`` objects.
+    """
+
+    BUCKET_CLASS = staticmethod(DropzoneBucket)
+    BUCKET_FACTORY_CLASS = staticmethod(DropzoneBucketFactory)
+
+    def __init__(self, account_info, upload_index=None, hasher=None,
+                 part_planner=None, throttle=None, resume_journal=None,
+                 compressor=None, telemetry=None, max_upload_workers=10,
+                 **kwargs):
+        """
+        :param account_info: where authorization data is kept
+        :type account_info: b2dz.b2dz_account_info.DropzoneB2AccountInfo
+        :param upload_index: where uploaded files are recorded
+        :type upload_index: b2dz.dzindex.UploadIndex|None
+        :param hasher: used to hash local files before uploading them
+        :type hasher: b2dz.dzhash.FileHasher|None
+        :param part_planner: chooses part sizes and parallel parts per file
+        :type part_planner: b2dz.dzplanner.PartPlanner|None
+        :param throttle: a bandwidth limit shared by every upload thread
+        :type throttle: b2dz.dzthrottle.UploadThrottle|None
+        :param resume_journal: remembers unfinished large file uploads
+        :type resume_journal: b2dz.dzresume.ResumeJournal|None
+        :param compressor: compresses uploads that are worth compressing
+        :type compressor: b2dz.dzcompress.Compressor|None
+        :param telemetry: collects the numbers of the drop in progress
+        :type telemetry: b2dz.dztelemetry.DropTelemetry|None
+        :param max_upload_workers: size of the upload thread pool
+        :type max_upload_workers: int
+        """
+        # b2sdk only caches bucket IDs in the account info it creates itself
+        kwargs.setdefault("cache", AuthInfoCache(account_info))
+        kwargs.setdefault("api_config", B2HttpApiConfig(
+            http_session_factory=large_block_session))
+        super(DropzoneB2Api, self).__init__(
+            account_info, max_upload_workers=max_upload_workers, **kwargs)
+        self.upload_index = upload_index
+        self.hasher = hasher
+        self.part_planner = part_planner
+        self.throttle = throttle
+        self.resume_journal = resume_journal
+        self.compressor = compressor
+        self.telemetry = telemetry
+        b2_http = getattr(self.session.raw_api, "b2_http", None)
+        if b2_http is not None:  # the simulator doesn't speak HTTP
+            b2_http.add_callback(TelemetryHttpCallback(self))
+        self.services.upload_manager = DropzoneUploadManager(
+            self.services, max_upload_workers=max_upload_workers)
+        self.services.emerger = DropzoneEmerger(self.services)
+
+    def cancel_large_files(self, file_ids):
+        """
+        Cancel unfinished large files that will never be resumed, so B2
+        doesn't keep (and bill for) their parts.
+
+        :param file_ids: IDs of the large files
+        :type file_ids: list[str]
+        """
+        for file_id in file_ids:
+            try:
+                self.cancel_large_file(file_id)
+            except B2Error:
+                # most likely it was cancelled or finished elsewhere
+                logger.warning("Could not cancel unfinished large file %s",
+                               file_id, exc_info=True)
+            else:
+                logger.info("Cancelled unfinished large file %s", file_id)
+
+    def cancel_expired_uploads(self):
+        """
+        Cancel the unfinished large files the resume journal has given up
+        on resuming.
+        """
+        if self.resume_journal is not None:
+            self.cancel_large_files(self.resume_journal.expire())
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+An optional upload engine for small files built on asyncio and aiohttp.
+Instead of a thread blocking on ``requests`` for every file in flight, one
+event loop thread keeps hundreds of uploads going over a single pool of
+connections, talking to the B2 upload endpoints directly.
+
+Large files, files that will be compressed and anything that isn't a plain
+upload still go through b2sdk's transfer threads.
+"""
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+
+from b2sdk.exception import B2ConnectionError, B2Error, B2RequestTimeout, \
+    InvalidUploadSource, TooManyRequests, Unauthorized, interpret_b2_error
+from b2sdk.raw_api import API_VERSION
+from b2sdk.sync.action import B2UploadAction
+from b2sdk.sync.report import SyncFileReporter
+from b2sdk.utils import b2_url_encode
+from b2sdk.version import USER_AGENT
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncUploadEngine(object):
+    """
+    Uploads the small files of a sync from an event loop running on a thread
+    of its own. ``submit`` can be called from any thread while the engine
+    runs, ``close`` waits for everything submitted to finish.
+
+    Finished files are recorded in the API's upload index and telemetry and
+    reported to the sync reporter like b2sdk's own upload actions, failed
+    ones are retried with a fresh upload URL like b2sdk does.
+    """
+
+    MAX_SIZE = 1024 * 1024
+    """
+    Bigger files go through the transfer threads. This is also the size
+    below which files are never hashed ahead of time to find duplicates.
+    """
+
+    CONCURRENCY = 64
+    """Uploads in flight at the same time"""
+
+    CHUNK_SIZE = 64 * 1024
+    """Bytes read from disk at a time"""
+
+    MAX_ATTEMPTS = 5
+    """Tries per file before it counts as failed"""
+
+    TIMEOUT = 120
+    """Seconds an upload may go without any progress"""
+
+    def __init__(self, api, concurrency=CONCURRENCY):
+        """
+        :type api: b2dz.dzapi.DropzoneB2Api
+        :param concurrency: uploads in flight at the same time
+        :type concurrency: int
+        """
+        if aiohttp is None:
+            raise RuntimeError("aiohttp is not installed")
+        self.api = api
+        self.concurrency = concurrency
+        self.failures = 0
+        self._loop = None
+        self._queue = None
+        self._thread = None
+        self._started = threading.Event()
+
+    def __repr__(self):
+        return "<%s concurrency=%d>" % (self.__class__.__name__,
+                                        self.concurrency)
+
+    def accepts(self, action, bucket):
+        """
+        :type action: b2sdk.sync.action.AbstractAction
+        :type bucket: b2sdk.v2.Bucket
+        :return: True if the engine can do the action
+        :rtype: bool
+        """
+        if not isinstance(action, B2UploadAction) or \
+                action.size > self.MAX_SIZE:
+            return False
+        encryption = action.encryption_settings_provider.get_setting_for_upload(
+            bucket=bucket, b2_file_name=action.b2_file_name,
+            file_info={}, length=action.size)
+        if encryption is not None:
+            return False
+        compressor = self.api.compressor
+        return compressor is None or \
+            not compressor.is_worth_it(action.local_full_path, action.size)
+
+    def start(self):
+        """
+        Start the event loop thread.
+        """
+        self._thread = threading.Thread(target=self._run,
+                                        name="b2dz-async-uploads",
+                                        daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def submit(self, action, bucket, reporter):
+        """
+        :type action: b2sdk.sync.action.B2UploadAction
+        :type bucket: b2sdk.v2.Bucket
+        :type reporter: b2dz.dzprogress.DropzoneSyncReport|None
+        """
+        self._loop.call_soon_threadsafe(self._queue.put_nowait,
+                                        (action, bucket, reporter))
+
+    def close(self):
+        """
+        Wait for every submitted upload to finish and stop the loop thread.
+
+        :return: how many uploads failed
+        :rtype: int
+        """
+        for _ in range(self.concurrency):
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, None)
+        self._thread.join()
+        return self.failures
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._main())
+        finally:
+            self._loop.close()
+
+    async def _main(self):
+        self._queue = asyncio.Queue()
+        self._started.set()
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        timeout = aiohttp.ClientTimeout(sock_read=self.TIMEOUT,
+                                        sock_connect=self.TIMEOUT)
+        async with aiohttp.ClientSession(
+                connector=connector, timeout=timeout,
+                headers={"User-Agent": USER_AGENT}) as session:
+            await asyncio.gather(*(self._worker(session)
+                                   for _ in range(self.concurrency)))
+
+    async def _worker(self, session):
+        while True:
+            job = await self._queue.get()
+            if job is None:
+                return
+            action, bucket, reporter = job
+            try:
+                await self._upload(session, action, bucket, reporter)
+            except Exception as ex:
+                self.failures += 1  # only ever changed on the loop thread
+                logger.error("an exception occurred in a sync action",
+                             exc_info=True)
+                if reporter is not None:
+                    reporter.error("%s: %r %s" % (action, ex, ex))
+
+    async def _upload(self, session, action, bucket, reporter):
+        started = time.monotonic()
+        progress = SyncFileReporter(reporter) if reporter is not None \
+            else None
+        try:
+            if progress is not None:
+                progress.set_total_bytes(action.size)
+            response = await self._upload_with_retries(session, action,
+                                                       bucket, progress)
+        finally:
+            if progress is not None:
+                progress.close()
+        file_version = self.api.file_version_factory.from_api_response(
+            response)
+        bucket._record(file_version)
+        telemetry = self.api.telemetry
+        if telemetry is not None:
+            telemetry.file_done(file_version.file_name, file_version.size,
+                                time.monotonic() - started)
+        if reporter is not None:
+            action.do_report(bucket, reporter)
+
+    async def _upload_with_retries(self, session, action, bucket, progress):
+        account_info = self.api.account_info
+        for attempt in range(1, self.MAX_ATTEMPTS + 1):
+            try:
+                upload_url, token = await self._upload_url(session,
+                                                           bucket.id_)
+            except Unauthorized:
+                if attempt == self.MAX_ATTEMPTS:
+                    raise
+                # the account token expired, b2sdk's session renews it
+                await self._loop.run_in_executor(
+                    None, self.api.session.authorize_automatically)
+                continue
+            except B2Error as ex:
+                # the same errors b2sdk's HTTP layer retries API calls on
+                if not ex.should_retry_http() or \
+                        attempt == self.MAX_ATTEMPTS:
+                    raise
+                logger.info("Could not get an upload URL for %s, trying "
+                            "again: %s", action.b2_file_name, ex)
+                await self._back_off(attempt, ex)
+                continue
+            try:
+                response = await self._post_file(session, upload_url, token,
+                                                 action, progress)
+            except B2Error as ex:
+                if not (ex.should_retry_upload() or ex.should_retry_http()) \
+                        or attempt == self.MAX_ATTEMPTS:
+                    raise
+                logger.info("Upload of %s failed, trying again: %s",
+                            action.b2_file_name, ex)
+                account_info.clear_bucket_upload_data(bucket.id_)
+                await self._back_off(attempt, ex)
+                continue
+            account_info.put_bucket_upload_url(bucket.id_, upload_url, token)
+            return response
+
+    @staticmethod
+    async def _back_off(attempt, error):
+        """
+        Wait before the next attempt, as long as B2 asked for or longer
+        after every failed one.
+
+        :type attempt: int
+        :type error: b2sdk.exception.B2Error
+        """
+        delay = getattr(error, "retry_after_seconds", None)
+        await asyncio.sleep(float(delay) if delay else
+                            min(2 ** attempt * 0.1, 8))
+
+    async def _upload_url(self, session, bucket_id):
+        """
+        :return: an upload URL and its token, from the account info's pool
+                 that b2sdk's uploads share if there is one
+        :rtype: tuple[str,str]
+        """
+        account_info = self.api.account_info
+        upload_url, token = account_info.take_bucket_upload_url(bucket_id)
+        if upload_url is not None:
+            return upload_url, token
+        url = "%s/b2api/%s/b2_get_upload_url" % (account_info.get_api_url(),
+                                                 API_VERSION)
+        headers = {"Authorization": account_info.get_account_auth_token()}
+        response = await self._request(session, url, headers,
+                                       json={"bucketId": bucket_id})
+        return response["uploadUrl"], response["authorizationToken"]
+
+    async def _post_file(self, session, upload_url, token, action, progress):
+        headers = {
+            "Authorization": token,
+            "Content-Type": "b2/x-auto",
+            # the SHA1 is sent after the file so it is only read once
+            "Content-Length": str(action.size + 40),
+            "X-Bz-Content-Sha1": "hex_digits_at_end",
+            "X-Bz-File-Name": b2_url_encode(action.b2_file_name),
+            "X-Bz-Info-src_last_modified_millis": str(action.mod_time_millis),
+        }
+        return await self._request(session, upload_url, headers,
+                                   data=self._body(action, progress))
+
+    async def _request(self, session, url, headers, **kwargs):
+        """
+        :return: the decoded JSON response
+        :rtype: dict
+        :raises B2Error: for error responses and broken connections
+        """
+        try:
+            async with session.post(url, headers=headers, **kwargs) as response:
+                body = await response.json(content_type=None)
+                status = response.status
+                response_headers = response.headers
+        except asyncio.TimeoutError:
+            raise B2RequestTimeout("Timed out talking to %s" % url)
+        except (aiohttp.ClientError, ValueError) as ex:
+            raise B2ConnectionError(str(ex))
+        if status == 200:
+            return body
+        telemetry = self.api.telemetry
+        if telemetry is not None:
+            telemetry.http_error(status)
+        body = body if isinstance(body, dict) else {}
+        error = interpret_b2_error(status, body.get("code"),
+                                   body.get("message"),
+                                   {k.lower(): v for k, v
+                                    in response_headers.items()})
+        if isinstance(error, TooManyRequests):
+            logger.info("B2 is asking us to slow down")
+        raise error
+
+    async def _body(self, action, progress):
+        """
+        The file's bytes followed by their SHA1. The files are small and
+        read in chunks from the loop thread, which beats handing every read
+        to a thread.
+        """
+        throttle = self.api.throttle
+        sha1 = hashlib.sha1()
+        sent = 0
+        with open(action.local_full_path, "rb") as f:
+            while sent < action.size:
+                chunk = f.read(min(self.CHUNK_SIZE, action.size - sent))
+                if not chunk:
+                    raise InvalidUploadSource("%s got shorter while it was "
+                                              "being uploaded"
+                                              % action.local_full_path)
+                if throttle is not None and throttle.rate:
+                    await self._loop.run_in_executor(None, throttle.consume,
+                                                     len(chunk))
+                sha1.update(chunk)
+                sent += len(chunk)
+                yield chunk
+                if progress is not None:
+                    progress.bytes_completed(sent)
+        yield sha1.hexdigest().encode("ascii")
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Authorization data shared by every b2dz process. Values saved with
+``dz.save_value`` only reach the drops started after the saving drop ends,
+so two drops made at the same moment would both authorize and overwrite
+each other's token. A file in the support folder, guarded by a lock, lets
+them share one authorization instead.
+"""
+import fcntl
+import json
+import logging
+import os
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+
+class SharedAuthorization(object):
+    """
+    A JSON file holding the latest authorization, next to a lock file that
+    is held while a process checks it and authorizes.
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: path to the authorization file
+        :type filename: str
+        """
+        self.filename = filename
+        self.lock_filename = filename + ".lock"
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.filename)
+
+    @contextmanager
+    def locked(self):
+        """
+        Hold the lock for the duration of the ``with`` block, waiting for
+        any other process holding it first.
+        """
+        fd = os.open(self.lock_filename, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)  # releases the lock as well
+
+    def load(self):
+        """
+        :return: what was last saved or None if nothing usable was
+        :rtype: dict|None
+        """
+        try:
+            with open(self.filename) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logger.warning("Ignoring unreadable %s", self.filename,
+                           exc_info=True)
+            return None
+
+    def save(self, auth_data):
+        """
+        :param auth_data: ``DropzoneB2AccountInfo.export_auth_data()``
+        :type auth_data: dict
+        """
+        temp_filename = self.filename + ".tmp"
+        fd = os.open(temp_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                     0o600)  # it holds an auth token
+        with os.fdopen(fd, "w") as f:
+            json.dump(auth_data, f)
+        os.replace(temp_filename, self.filename)
+
+    def clear(self):
+        try:
+            os.unlink(self.filename)
+        except FileNotFoundError:
+            pass
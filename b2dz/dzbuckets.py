@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+The account's bucket names and IDs, cached between drops so b2sdk doesn't
+have to list buckets to find the one we upload to.
+"""
+import time
+
+
+class BucketIndex(object):
+    """
+    Maps bucket names to IDs and IDs to names. Every entry expires ``ttl``
+    seconds after B2 last confirmed it. An expired entry is a miss, so b2sdk
+    asks B2 about that one bucket again and saves the answer.
+    """
+
+    TTL = 24 * 60 * 60
+    """Seconds a bucket name and ID are trusted without asking B2"""
+
+    def __init__(self, ttl=TTL, clock=time.time):
+        """
+        :param ttl: seconds an entry stays valid after it was added
+        :type ttl: int|float
+        :param clock: returns the current time in seconds since the epoch
+        :type clock: callable
+        """
+        self.ttl = ttl
+        self._clock = clock
+        self._ids = {}  # name -> (ID, expiry time)
+        self._names = {}  # ID -> name
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, dict(self.items()))
+
+    def __len__(self):
+        return len(self.items())
+
+    def __contains__(self, name):
+        return self.get_id(name) is not None
+
+    @classmethod
+    def from_json(cls, value, **kwargs):
+        """
+        :param value: what ``to_json`` returned, or a plain ``{name: id}``
+                      mapping as saved by older versions
+        :type value: dict|None
+        :rtype: BucketIndex
+        """
+        index = cls(**kwargs)
+        for name, entry in (value or {}).items():
+            if isinstance(entry, str):
+                index.add(name, entry)
+            else:
+                bucket_id, expires = entry
+                index._set(name, bucket_id, expires)
+        return index
+
+    def to_json(self):
+        """
+        :return: the entries that haven't expired, as
+                 ``{name: [id, expiry time]}``
+        :rtype: dict[str, list]
+        """
+        now = self._clock()
+        return {name: [bucket_id, int(expires)]
+                for name, (bucket_id, expires) in sorted(self._ids.items())
+                if expires > now}
+
+    def items(self):
+        """
+        :return: (name, ID) of every entry that hasn't expired
+        :rtype: list[tuple[str, str]]
+        """
+        now = self._clock()
+        return [(name, bucket_id)
+                for name, (bucket_id, expires) in self._ids.items()
+                if expires > now]
+
+    def get_id(self, name):
+        """
+        :rtype: str|None
+        """
+        entry = self._ids.get(name)
+        if entry is None or entry[1] <= self._clock():
+            return None
+        return entry[0]
+
+    def get_name(self, bucket_id):
+        """
+        :rtype: str|None
+        """
+        name = self._names.get(bucket_id)
+        if name is None:
+            return None
+        return name if self.get_id(name) == bucket_id else None
+
+    def add(self, name, bucket_id):
+        """
+        Remember a bucket B2 just told us about.
+        """
+        self._set(name, bucket_id, self._clock() + self.ttl)
+
+    def remove(self, name):
+        """
+        :return: False if there was no such bucket
+        :rtype: bool
+        """
+        entry = self._ids.pop(name, None)
+        if entry is None:
+            return False
+        if self._names.get(entry[0]) == name:
+            del self._names[entry[0]]
+        return True
+
+    def refresh(self, name_id_iterable):
+        """
+        Bring the index in line with a full listing of the account's
+        buckets. Listed buckets are renewed, the others are dropped.
+
+        :param name_id_iterable: (name, ID) of every bucket in the account
+        """
+        listed = dict(name_id_iterable)
+        for name in [n for n in self._ids if n not in listed]:
+            self.remove(name)
+        for name, bucket_id in listed.items():
+            self.add(name, bucket_id)
+
+    def _set(self, name, bucket_id, expires):
+        old_id = self._ids.get(name, (None, None))[0]
+        if old_id != bucket_id:
+            self.remove(name)
+            # IDs are unique, whatever had this ID before is gone
+            old_name = self._names.get(bucket_id)
+            if old_name is not None:
+                self.remove(old_name)
+        self._ids[name] = (bucket_id, expires)
+        self._names[bucket_id] = name
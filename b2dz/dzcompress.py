@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in compression of uploads. Files that look compressible are sent gzip
+(or zstd) encoded and stored with a ``b2-content-encoding`` file info, which
+B2 returns as the ``Content-Encoding`` header, so the download URL still
+gives browsers the original file.
+
+Files are compressed in independent chunks on a thread pool. A gzip file is
+one deflate stream made of sync-flushed chunks (what pigz does), a zstd file
+is one frame per chunk. Either way any chunk can be compressed again on its
+own, so the compressed stream can be seeked in (for retries and large file
+parts) without ever holding a whole file in memory or on disk.
+"""
+import functools
+import hashlib
+import io
+import logging
+import os
+import struct
+import threading
+import zlib
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from b2sdk.v2 import AbstractUploadSource
+from .dzprofiles import ENCODINGS
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+logger = logging.getLogger(__name__)
+
+
+_GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+"""No file name, no mtime (so the output only depends on the input)"""
+
+
+class Compressor(object):
+    """
+    Decides which files are worth compressing and compresses them.
+
+    This class is thread safe. One compression thread pool is shared by
+    every upload.
+    """
+
+    CHUNK_SIZE = 4 * 1024 * 1024
+    """Bytes of a file compressed as one independent piece"""
+
+    SAMPLE_SIZE = 256 * 1024
+    """How much of a file's start is compressed to judge the whole file"""
+
+    MIN_SIZE = 8 * 1024
+    """Smaller files aren't worth the trouble"""
+
+    MAX_RATIO = 0.85
+    """A sample has to shrink at least this much for a file to qualify"""
+
+    READ_AHEAD = 4
+    """Chunks compressed ahead of what a stream has been read up to"""
+
+    CACHED_CHUNKS = 16
+    """Compressed chunks of a file kept for the other part streams"""
+
+    GZIP_LEVEL = 6
+    ZSTD_LEVEL = 3
+
+    def __init__(self, encoding="gzip", workers=None):
+        """
+        :param encoding: "gzip" or "zstd"; zstd falls back to gzip if the
+                         ``zstandard`` package is not installed
+        :type encoding: str
+        :param workers: compression threads, default one per CPU
+        :type workers: int|None
+        """
+        if encoding not in ENCODINGS:
+            raise ValueError("Unknown compression '%s'." % encoding)
+        if encoding == "zstd" and zstandard is None:
+            logger.warning("zstandard is not installed, using gzip instead")
+            encoding = "gzip"
+        self.encoding = encoding
+        self.workers = workers or os.cpu_count() or 2
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.encoding)
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.workers, thread_name_prefix="compress")
+            return self._executor
+
+    def is_worth_it(self, local_path, size):
+        """
+        Compress the start of a file quickly to see whether the whole file
+        is worth compressing.
+
+        :type local_path: str
+        :type size: int
+        :rtype: bool
+        """
+        if size < self.MIN_SIZE:
+            return False
+        with open(local_path, "rb") as f:
+            sample = f.read(self.SAMPLE_SIZE)
+        return len(zlib.compress(sample, 1)) <= len(sample) * self.MAX_RATIO
+
+    def upload_source(self, local_path):
+        """
+        Compress a file once to learn the compressed size and SHA1 that B2
+        needs up front. The bytes are thrown away and produced again,
+        identically, while uploading.
+
+        :type local_path: str
+        :rtype: CompressedUploadSource
+        """
+        return self.stream_upload_source(
+            functools.partial(open, local_path, "rb"),
+            os.path.getsize(local_path), local_path)
+
+    def stream_upload_source(self, opener, size, name):
+        """
+        Like ``upload_source`` for anything that can be read more than once,
+        like a packed archive.
+
+        :param opener: returns a new seekable binary stream of the content
+        :type opener: callable
+        :param size: the length of the content
+        :type size: int
+        :param name: what to call the content in logs and errors
+        :type name: str
+        :rtype: CompressedUploadSource
+        """
+        chunks = [(offset, min(self.CHUNK_SIZE, size - offset))
+                  for offset in range(0, size, self.CHUNK_SIZE)] or [(0, 0)]
+        header, trailer = b"", b""
+        if self.encoding == "gzip":
+            header = _GZIP_HEADER
+        sha1 = hashlib.sha1(header)
+        crc = 0
+        lengths = []
+        for data, compressed in self.compress_chunks(opener, name, chunks):
+            crc = zlib.crc32(data, crc)
+            sha1.update(compressed)
+            lengths.append(len(compressed))
+        if self.encoding == "gzip":
+            trailer = struct.pack("<II", crc, size & 0xffffffff)
+            sha1.update(trailer)
+        with self._lock:
+            self.bytes_in += size
+            self.bytes_out += len(header) + sum(lengths) + len(trailer)
+        return CompressedUploadSource(self, opener, name, chunks, lengths,
+                                      header, trailer, sha1.hexdigest())
+
+    def compress_chunks(self, opener, name, chunks, window=None):
+        """
+        Compress ``chunks`` of a file on the thread pool, keeping at most
+        ``window`` of them in memory.
+
+        :param opener: returns a new seekable binary stream of the file
+        :type opener: callable
+        :param name: the file's name for errors
+        :type name: str
+        :param chunks: (offset, length) of each chunk
+        :type chunks: list[tuple[int, int]]
+        :return: (chunk data, compressed chunk) for every chunk, in order
+        """
+        window = window or self.workers * 2
+        last = len(chunks) - 1
+        pending = deque()
+        for index, (offset, length) in enumerate(chunks):
+            pending.append(self.executor.submit(
+                self._read_and_compress, opener, name, offset, length,
+                index == last))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def compress_chunk(self, data, last):
+        """
+        :param data: one chunk of a file
+        :type data: bytes
+        :param last: True for the file's last chunk
+        :type last: bool
+        :rtype: bytes
+        """
+        if self.encoding == "zstd":
+            # every chunk is a frame, a stream of frames is valid zstd
+            compressor = zstandard.ZstdCompressor(level=self.ZSTD_LEVEL)
+            return compressor.compress(data)
+        compressor = zlib.compressobj(self.GZIP_LEVEL, zlib.DEFLATED,
+                                      -zlib.MAX_WBITS)
+        flush = zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+        return compressor.compress(data) + compressor.flush(flush)
+
+    def _read_and_compress(self, opener, name, offset, length, last):
+        with opener() as f:
+            f.seek(offset)
+            data = f.read(length)
+        if len(data) != length:
+            raise ValueError("%s changed while it was being compressed"
+                             % name)
+        return data, self.compress_chunk(data, last)
+
+    def _compress(self, opener, name, offset, length, last):
+        # the streams keep only what they send, not what it was made of
+        return self._read_and_compress(opener, name, offset, length, last)[1]
+
+
+class CompressedUploadSource(AbstractUploadSource):
+    """
+    The compressed contents of a local file as planned by
+    ``Compressor.upload_source``.
+    """
+
+    def __init__(self, compressor, opener, name, chunks, lengths, header,
+                 trailer, content_sha1):
+        self.compressor = compressor
+        self.opener = opener
+        self.name = name
+        self.chunks = chunks
+        self.content_sha1 = content_sha1
+        # where header, chunks and trailer start in the compressed stream
+        self.segments = [header] + lengths + [trailer]
+        self.offsets = []
+        position = 0
+        for segment in self.segments:
+            self.offsets.append(position)
+            position += segment if isinstance(segment, int) else len(segment)
+        self.content_length = position
+        self._lock = threading.Lock()
+        self._chunks = OrderedDict()  # chunk index -> future of its bytes
+
+    def __repr__(self):
+        return "<%s %s %s, %d bytes>" % (
+            self.__class__.__name__, self.compressor.encoding, self.name,
+            self.content_length)
+
+    def get_content_length(self):
+        return self.content_length
+
+    def get_content_sha1(self):
+        return self.content_sha1
+
+    def is_sha1_known(self):
+        return True
+
+    def open(self):
+        # b2sdk expects reads to be short only at the end of the stream
+        return io.BufferedReader(CompressedStream(self),
+                                 self.compressor.CHUNK_SIZE)
+
+    def chunk_index(self):
+        """
+        Where the independently compressed chunks are, so a range of the
+        original content can be read by fetching and decompressing only the
+        chunks that cover it.
+
+        :return: [offset, length, compressed offset, compressed length] of
+                 every chunk
+        :rtype: list[list[int]]
+        """
+        return [[offset, length, self.offsets[i + 1], self.segments[i + 1]]
+                for i, (offset, length) in enumerate(self.chunks)]
+
+    def chunk(self, index):
+        """
+        :param index: the chunk's index in ``chunks``
+        :type index: int
+        :return: a future of the compressed chunk, started if it wasn't
+        :rtype: concurrent.futures.Future
+        """
+        compressor = self.compressor
+        with self._lock:
+            future = self._chunks.get(index)
+            if future is not None:
+                self._chunks.move_to_end(index)
+                return future
+            # large file parts rarely line up with chunks, the streams of
+            # neighbouring parts share the chunk between them
+            offset, length = self.chunks[index]
+            future = compressor.executor.submit(
+                compressor._compress, self.opener, self.name, offset, length,
+                index == len(self.chunks) - 1)
+            self._chunks[index] = future
+            while len(self._chunks) > compressor.CACHED_CHUNKS:
+                self._chunks.popitem(last=False)
+            return future
+
+
+class CompressedStream(io.RawIOBase):
+    """
+    Reads a ``CompressedUploadSource``, compressing the chunks just ahead of
+    the read position on the compressor's thread pool.
+    """
+
+    def __init__(self, source):
+        """
+        :type source: CompressedUploadSource
+        """
+        super(CompressedStream, self).__init__()
+        self.source = source
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.source.content_length
+        if offset < 0:
+            raise ValueError("negative seek position %d" % offset)
+        self._position = offset
+        return offset
+
+    def readinto(self, buffer):
+        source = self.source
+        if self._position >= source.content_length or not len(buffer):
+            return 0
+        index = bisect_right(source.offsets, self._position) - 1
+        segment = source.segments[index]
+        if isinstance(segment, int):
+            data = self._chunk(index - 1)  # segment 0 is the header
+        else:
+            data = segment
+        skip = self._position - source.offsets[index]
+        count = min(len(buffer), len(data) - skip)
+        buffer[:count] = data[skip:skip + count]
+        self._position += count
+        return count
+
+    def _chunk(self, index):
+        source = self.source
+        future = source.chunk(index)
+        ahead = min(index + source.compressor.READ_AHEAD, len(source.chunks))
+        for next_index in range(index + 1, ahead):
+            source.chunk(next_index)
+        data = future.result()
+        if len(data) != source.segments[index + 1]:
+            raise ValueError("%s changed while it was being uploaded"
+                             % source.name)
+        return data
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Decides how many files are transferred at the same time by watching the
+throughput the transfers actually get, instead of counting CPU cores.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+
+class ConcurrencyController(object):
+    """
+    An additive increase/multiplicative decrease (AIMD) limit on concurrent
+    transfers. It starts small and adds a worker every ``SAMPLE_INTERVAL``
+    while the aggregate bytes per second keeps rising, and halves the number
+    of workers when B2 pushes back (503/429 responses or timeouts).
+
+    The clock can be replaced, which lets the controller be driven by a
+    simulated bandwidth-limited backend.
+
+    This class is thread safe.
+    """
+
+    SAMPLE_INTERVAL = 2.0
+    """Seconds of transfers that each throughput sample covers"""
+
+    MIN_GAIN = 0.05
+    """How much throughput has to rise for another worker to be worth it"""
+
+    def __init__(self, initial=2, minimum=1, maximum=16, fixed=None,
+                 clock=time.monotonic):
+        """
+        :param initial: how many transfers to start with
+        :type initial: int
+        :param minimum: never back off below this many transfers
+        :type minimum: int
+        :param maximum: never ramp up above this many transfers
+        :type maximum: int
+        :param fixed: a number of transfers chosen by the user, turns off
+                      adapting altogether
+        :type fixed: int|None
+        :param clock: returns the current time in seconds
+        :type clock: callable
+        """
+        if fixed:
+            initial = minimum = maximum = fixed
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(initial, maximum))
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._active = 0
+        self._saturated = False
+        self._window_bytes = 0
+        self._window_start = clock()
+        self._previous_rate = 0.0
+        self._last_back_off = None
+
+    @property
+    def active(self):
+        """
+        :return: how many transfers are running right now
+        :rtype: int
+        """
+        return self._active
+
+    @contextmanager
+    def slot(self):
+        """
+        Wait until another transfer is allowed and hold on to its slot for
+        the duration of the ``with`` block.
+        """
+        with self._cond:
+            while self._active >= self.limit:
+                self._saturated = True
+                self._cond.wait()
+            self._active += 1
+            if self._active >= self.limit:
+                self._saturated = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify()
+
+    def record(self, byte_count):
+        """
+        Count bytes that were transferred and ramp up if it is time to.
+
+        :type byte_count: int
+        """
+        with self._cond:
+            self._window_bytes += byte_count
+            now = self._clock()
+            elapsed = now - self._window_start
+            if elapsed < self.SAMPLE_INTERVAL:
+                return
+            rate = self._window_bytes / elapsed
+            # only a window that used every slot says anything about
+            # whether more slots would help
+            if self._saturated and self.limit < self.maximum and \
+                    rate > self._previous_rate * (1 + self.MIN_GAIN):
+                self.limit += 1
+                logger.debug("%.0f bytes/s, raising concurrency to %d",
+                             rate, self.limit)
+                self._cond.notify_all()
+            self._previous_rate = rate
+            self._start_window(now)
+
+    def back_off(self):
+        """
+        B2 is overloaded or the connection is; halve the number of transfers.
+        A burst of errors from the transfers that were already running only
+        halves it once.
+        """
+        with self._cond:
+            now = self._clock()
+            if self._last_back_off is not None and \
+                    now - self._last_back_off < self.SAMPLE_INTERVAL:
+                return
+            self._last_back_off = now
+            self.limit = max(self.minimum, self.limit // 2)
+            logger.info("Backing off to %d concurrent transfers", self.limit)
+            self._previous_rate = 0.0
+            self._start_window(now)
+
+    def _start_window(self, now):
+        self._window_start = now
+        self._window_bytes = 0
+        self._saturated = self._active >= self.limit
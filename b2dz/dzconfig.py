@@ -0,0 +1,1059 @@
+# -*- coding: utf-8 -*-
+"""
+The action's settings, kept in Dropzone's value store, and the dialog that
+edits them. Nothing here imports b2sdk, so clicking the action shows the
+dialog without waiting for it.
+"""
+import base64
+import collections.abc
+import copy
+import json
+import logging
+import os
+import re
+import time
+import traceback
+import zlib
+from datetime import datetime
+
+try:
+    from urlparse import urlparse, urljoin
+except ImportError:
+    from urllib.parse import urlparse
+    from urllib.parse import urljoin
+
+import dropzone as dz
+from .dzauth import SharedAuthorization
+from .dzbuckets import BucketIndex
+from .dzprofiles import DEFAULT_MODIFIER_PROFILES, DEFAULT_PROFILES, \
+    ENCODINGS, MODIFIERS, TransferProfiles
+from .dzresume import ResumeJournal
+from .dzschedule import DEFAULT_ORDER, ORDERS
+from .dzsupport import support_path
+from .dzthrottle import KILOBYTE, RateSchedule, UploadThrottle
+
+
+logger = logging.getLogger(__name__)
+
+
+ACTION_START = datetime.now()
+"""Used for prefix percent placeholder formatting"""
+logger.debug("Action Start: %s", ACTION_START)
+
+_PER_SECOND_PLACEHOLDER = re.compile(r"%[cfrsSTX]")
+"""strftime placeholders that give a different prefix every second"""
+
+ENGINES = ("threads", "asyncio")
+"""Ways small files can be uploaded, "asyncio" needs aiohttp"""
+
+AUTH_FILENAME = "auth.json"
+"""Name of the authorization shared by b2dz processes in the support folder"""
+
+UPLOAD_INDEX_FILENAME = "upload_index.sqlite3"
+"""Name of the upload index database in the action's support folder"""
+
+HASH_MEMO_FILENAME = "hashes.sqlite3"
+"""Name of the file hash memo database in the action's support folder"""
+
+RESUME_JOURNAL_FILENAME = "resume.sqlite3"
+"""Name of the unfinished upload journal in the action's support folder"""
+
+THROTTLE_SETTINGS_FILENAME = "throttle.json"
+"""Where saved upload limits are published to transfers already running"""
+
+
+class DropzoneConfig(object):
+    """
+    The action's settings and the authorization b2sdk saved, persisted in
+    Dropzone's value store.
+    """
+
+    ACCESS_KEY_KEY = "B2DZ_APPLICATION_KEY_ID"
+    ACCOUNT_ID_KEY = "B2DZ_ACCOUNT_ID"
+    ALLOWED_KEY = "B2DZ_ALLOWED_KEY"
+    API_URL_KEY = "B2DZ_API_URL"
+    AUTH_TIME_KEY = "B2DZ_AUTH_TIME"
+    AUTH_TOKEN_KEY = "B2DZ_AUTH_TOKEN"
+    BUCKETS_KEY = "B2DZ_BUCKETS"
+    BUCKET_NAME_KEY = "B2DZ_BUCKET_NAME"
+    COMPRESS_KEY = "B2DZ_COMPRESS"
+    CUSTOM_DOWNLOAD_URL_KEY = "B2DZ_CUSTOM_DOWNLOAD_URL"
+    DAEMON_KEY = "B2DZ_DAEMON"
+    DOWNLOAD_URL_KEY = "B2DZ_DOWNLOAD_URL"
+    ENGINE_KEY = "B2DZ_ENGINE"
+    MIN_PART_SIZE_KEY = "B2DZ_MIN_PART_SIZE"
+    MODIFIER_PROFILE_KEY = "B2DZ_%s_PROFILE"
+    ORDER_KEY = "B2DZ_ORDER"
+    PART_SIZE_KEY = "B2DZ_PART_SIZE"
+    PART_STREAMS_KEY = "B2DZ_PART_STREAMS"
+    PREFIX_KEY = "B2DZ_PREFIX_PATH"
+    PROFILES_KEY = "B2DZ_PROFILES"
+    RATE_LIMIT_KEY = "B2DZ_RATE_LIMIT"
+    RATE_SCHEDULE_KEY = "B2DZ_RATE_SCHEDULE"
+    REALM_KEY = "B2DZ_REALM_KEY"
+    RECOMMENDED_PART_SIZE_KEY = "B2DZ_RECOMMENDED_PART_SIZE"
+    S3_API_URL_KEY = "B2DZ_S3_API_URL"
+    SECRET_KEY_KEY = "B2DZ_APPLICATION_KEY"
+    THROUGHPUT_KEY = "B2DZ_THROUGHPUT"
+    WORKERS_KEY = "B2DZ_WORKERS"
+
+    TOKEN_LIFETIME = 24 * 60 * 60
+    """Seconds an authorization token is valid for"""
+
+    REFRESH_MARGIN = 60 * 60
+    """Authorize again when a token is this close to expiring"""
+
+    _AUTH_FIELDS = (
+        "account_id", "auth_token", "api_url", "download_url",
+        "recommended_part_size", "absolute_minimum_part_size", "realm",
+        "s3_api_url", "allowed", "application_key_id", "auth_time",
+    )
+    """What ``export_auth_data`` returns, everything but the secret key"""
+
+    def __init__(self, application_key_id=None, application_key=None,
+                 bucket_name=None, prefix=None, custom_download_url=None,
+                 part_size=None, part_streams=None, workers=None,
+                 rate_limit=None, rate_schedule=None, daemon=None,
+                 compress=None, profiles=None, command_profile=None,
+                 option_profile=None, control_profile=None,
+                 shift_profile=None, order=None, engine=None, **kwargs):
+        super(DropzoneConfig, self).__init__()
+
+        self._absolute_minimum_part_size = None
+        self._account_id = None
+        self._allowed = None
+        self._api_url = None
+        self._auth_time = None
+        self._auth_token = None
+        self._bucket_name = None
+        self._buckets = None
+        self._download_url = None
+        self._realm = None
+        self._recommended_part_size = None
+        self._s3_api_url = None
+        self._throughput = None
+        self._modifier_profiles = {}
+        # values staged by save_config until flush, None means remove
+        self._pending = {}
+        # key -> (the object last encoded, its encoding)
+        self._json_encoded = {}
+
+        self.application_key_id = application_key_id
+        self.application_key = application_key
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.custom_download_url = custom_download_url
+        self.part_size = part_size
+        self.part_streams = part_streams
+        self.workers = workers
+        self.rate_limit = rate_limit
+        self.rate_schedule = rate_schedule
+        self.daemon = daemon
+        self.engine = engine
+        self.compress = compress
+        self.order = order
+        self.profiles = profiles
+        self.set_modifier_profile("Command", command_profile)
+        self.set_modifier_profile("Option", option_profile)
+        self.set_modifier_profile("Control", control_profile)
+        self.set_modifier_profile("Shift", shift_profile)
+
+    def load_config(self):
+        self.absolute_minimum_part_size = self._load_value(self.MIN_PART_SIZE_KEY)
+        self.account_id = self._load_value(self.ACCOUNT_ID_KEY)
+        self.allowed = self._load_json_value(self.ALLOWED_KEY)
+        self.api_url = self._load_value(self.API_URL_KEY)
+        self.application_key = self._load_value(self.SECRET_KEY_KEY)
+        self.application_key_id = self._load_value(self.ACCESS_KEY_KEY)
+        self.auth_time = self._load_value(self.AUTH_TIME_KEY)
+        self.auth_token = self._load_value(self.AUTH_TOKEN_KEY)
+        self.bucket_name = self._load_value(self.BUCKET_NAME_KEY)
+        self.buckets = self._load_json_value(self.BUCKETS_KEY)
+        self.compress = self._load_value(self.COMPRESS_KEY)
+        self.custom_download_url = self._load_value(self.CUSTOM_DOWNLOAD_URL_KEY)
+        self.daemon = self._load_value(self.DAEMON_KEY)
+        self.download_url = self._load_value(self.DOWNLOAD_URL_KEY)
+        self.engine = self._load_value(self.ENGINE_KEY)
+        self.order = self._load_value(self.ORDER_KEY)
+        self.part_size = self._load_value(self.PART_SIZE_KEY)
+        self.part_streams = self._load_value(self.PART_STREAMS_KEY)
+        self.prefix = self._load_value(self.PREFIX_KEY)
+        self.profiles = self._load_value(self.PROFILES_KEY)
+        for modifier in MODIFIERS:
+            self.set_modifier_profile(modifier, self._load_value(
+                self.MODIFIER_PROFILE_KEY % modifier.upper()))
+        self.rate_limit = self._load_value(self.RATE_LIMIT_KEY)
+        self.rate_schedule = self._load_value(self.RATE_SCHEDULE_KEY)
+        self.realm = self._load_value(self.REALM_KEY)
+        self.recommended_part_size = self._load_value(self.RECOMMENDED_PART_SIZE_KEY)
+        self.s3_api_url = self._load_value(self.S3_API_URL_KEY)
+        self.throughput = self._load_value(self.THROUGHPUT_KEY)
+        self.workers = self._load_value(self.WORKERS_KEY)
+
+    def save_config(self):
+        """
+        Stage every value that differs from what Dropzone has saved. Nothing
+        is sent to Dropzone until ``flush`` is called.
+        """
+        self._save_value(self.MIN_PART_SIZE_KEY, self.absolute_minimum_part_size)
+        self._save_value(self.ACCOUNT_ID_KEY, self.account_id)
+        self._save_json_value(self.ALLOWED_KEY, self.allowed)
+        self._save_value(self.API_URL_KEY, self.api_url)
+        self._save_value(self.SECRET_KEY_KEY, self.application_key)
+        self._save_value(self.ACCESS_KEY_KEY, self.application_key_id)
+        self._save_value(self.AUTH_TIME_KEY, self.auth_time)
+        self._save_value(self.AUTH_TOKEN_KEY, self.auth_token)
+        self._save_value(self.BUCKET_NAME_KEY, self.bucket_name)
+        self._save_json_value(self.BUCKETS_KEY, self.buckets.to_json())
+        self._save_value(self.COMPRESS_KEY, self.compress)
+        self._save_value(self.CUSTOM_DOWNLOAD_URL_KEY, self.custom_download_url)
+        self._save_value(self.DAEMON_KEY, "1" if self.daemon else None)
+        self._save_value(self.DOWNLOAD_URL_KEY, self.download_url)
+        self._save_value(self.ENGINE_KEY, self.engine)
+        self._save_value(self.ORDER_KEY, self.order)
+        self._save_value(self.PART_SIZE_KEY, self.part_size)
+        self._save_value(self.PART_STREAMS_KEY, self.part_streams)
+        self._save_value(self.PREFIX_KEY, self.prefix)
+        self._save_value(self.PROFILES_KEY, self.profiles)
+        for modifier in MODIFIERS:
+            self._save_value(self.MODIFIER_PROFILE_KEY % modifier.upper(),
+                             self._modifier_profiles.get(modifier))
+        self._save_value(self.RATE_LIMIT_KEY, self.rate_limit)
+        self._save_value(self.RATE_SCHEDULE_KEY, self.rate_schedule)
+        self._save_value(self.REALM_KEY, self.realm)
+        self._save_value(self.RECOMMENDED_PART_SIZE_KEY, self.recommended_part_size)
+        self._save_value(self.S3_API_URL_KEY, self.s3_api_url)
+        self._save_value(self.THROUGHPUT_KEY, self.throughput)
+        self._save_value(self.WORKERS_KEY, self.workers)
+
+    def flush(self):
+        """
+        Send the values staged by ``save_config`` to Dropzone, one call for
+        each key that actually changed. Meant to be called once at the end of
+        an action run.
+
+        :return: how many values were saved or removed
+        :rtype: int
+        """
+        pending, self._pending = self._pending, {}
+        for key, value in sorted(pending.items()):
+            if value is None:
+                dz.remove_value(key)
+                os.environ.pop(key, None)
+            else:
+                dz.save_value(key, value)
+                os.environ[key] = value
+        if pending:
+            logger.debug("Saved %d changed values: %s", len(pending),
+                         ", ".join(sorted(pending)))
+        return len(pending)
+
+    @staticmethod
+    def _load_value(key):
+        value = os.environ.get(key)
+        logger.debug("_load_value: Key '%s' was:\n%s", key, value)
+        # try:
+        #     value = value.replace("\\:", ":").replace('\\"', '"')
+        # except AttributeError:
+        #     pass
+        return value
+
+    def _load_json_value(self, key):
+        encoded = self._load_value(key)
+        if not encoded:
+            return None
+        value = base64.b64decode(encoded)
+        value = zlib.decompress(value).decode("utf-8")
+        value = json.loads(value)
+        self._json_encoded[key] = (copy.deepcopy(value), encoded)
+        return value
+
+    def _save_value(self, key, value):
+        # Dropzone passes its saved values to us as environment variables
+        # and flush keeps them in step, so os.environ is what Dropzone has
+        if value is None or value == "":  # We still want to allow False or 0
+            value = None
+        else:
+            value = str(value)
+            # value = value.replace(":", "\\:").replace('"', '\\"')
+        if value == os.environ.get(key):
+            self._pending.pop(key, None)
+        else:
+            self._pending[key] = value
+
+    def _save_json_value(self, key, value):
+        if value is not None:
+            previous, encoded = self._json_encoded.get(key, (None, None))
+            if value != previous:
+                encoded = json.dumps(value, separators=(",", ":"))
+                encoded = zlib.compress(encoded.encode("utf-8"))
+                encoded = base64.b64encode(encoded).decode("utf-8")
+                # a copy, the caller may keep changing its object
+                self._json_encoded[key] = (copy.deepcopy(value), encoded)
+            value = encoded
+        self._save_value(key, value)
+
+    @property
+    def absolute_minimum_part_size(self):
+        return self._absolute_minimum_part_size
+
+    @absolute_minimum_part_size.setter
+    def absolute_minimum_part_size(self, value):
+        if value is not None:
+            value = int(value)
+        self._absolute_minimum_part_size = value
+
+    @property
+    def account_id(self):
+        return self._account_id
+
+    @account_id.setter
+    def account_id(self, value):
+        self._account_id = value
+
+    @property
+    def application_key(self):
+        return self._application_key
+
+    @application_key.setter
+    def application_key(self, value):
+        self._application_key = value
+
+    @property
+    def allowed(self):
+        """
+        :rtype: dict
+        """
+        return self._allowed
+
+    @allowed.setter
+    def allowed(self, value):
+        """
+        :type value: dict
+        """
+        self._allowed = value
+
+    @property
+    def application_key_id(self):
+        return self._application_key_id
+
+    @application_key_id.setter
+    def application_key_id(self, value):
+        self._application_key_id = value
+
+    @property
+    def auth_time(self):
+        """
+        When the auth token was issued, in seconds since the epoch.
+
+        :rtype: int|None
+        """
+        return self._auth_time
+
+    @auth_time.setter
+    def auth_time(self, value):
+        if value is not None:
+            value = int(value)
+        self._auth_time = value
+
+    @property
+    def needs_authorization(self):
+        """
+        True if there is no auth token or it expires soon. Tokens saved
+        before their age was tracked are assumed to be expiring.
+
+        :rtype: bool
+        """
+        if not self.allowed or not self.auth_token or not self.auth_time:
+            return True
+        age = time.time() - self.auth_time
+        return age > self.TOKEN_LIFETIME - self.REFRESH_MARGIN
+
+    @property
+    def auth_token(self):
+        return self._auth_token
+
+    @auth_token.setter
+    def auth_token(self, value):
+        self._auth_token = value
+
+    @property
+    def api_url(self):
+        return self._api_url
+
+    @api_url.setter
+    def api_url(self, value):
+        self._api_url = value
+
+    @property
+    def bucket_name(self):
+        # if this application key is limited to only one bucket,
+        # then that's the bucket name we should be returning
+        if self.restricted_bucket:
+            return self.restricted_bucket
+        return self._bucket_name
+
+    @bucket_name.setter
+    def bucket_name(self, value):
+        if self.restricted_bucket:
+            if not value:
+                value = self.restricted_bucket
+            elif self.restricted_bucket != value:
+                raise ValueError("This application key is restricted to '%s' "
+                                 "and cannot be set to '%s'" %
+                                 (self.restricted_bucket, value))
+
+        self._bucket_name = value
+
+    @property
+    def buckets(self):
+        """
+        The names and IDs of the buckets accessible to the account that were
+        seen recently.
+
+        :rtype: BucketIndex
+        """
+        if self._buckets is None:
+            self._buckets = BucketIndex()
+        return self._buckets
+
+    @buckets.setter
+    def buckets(self, value):
+        """
+        :param value: an index, or a mapping as saved in ``BUCKETS_KEY``
+        :type value: BucketIndex|dict|None
+        """
+        if value is None or isinstance(value, BucketIndex):
+            self._buckets = value
+            return
+        if not isinstance(value, collections.abc.Mapping):
+            raise ValueError("`buckets` should be a dictionary. Not a '%s'."
+                             % type(value).__name__)
+        self._buckets = BucketIndex.from_json(value)
+
+    @property
+    def compress(self):
+        """
+        The content encoding to compress compressible files with, "gzip" or
+        "zstd", or None to upload everything as it is.
+
+        :rtype: str|None
+        """
+        return self._compress
+
+    @compress.setter
+    def compress(self, value):
+        # the Pashua popup gives us "None" for no compression
+        if not value or value == "None":
+            value = None
+        elif value not in ENCODINGS:
+            raise ValueError("Compression should be one of %s."
+                             % ", ".join(ENCODINGS))
+        self._compress = value
+
+    @property
+    def custom_download_url(self):
+        """
+        Custom download URL prefix if the user specified one. Otherwise
+        returns the B2 "friendly URL" for files in the configured bucket.
+
+        :return: the start of the URL for downloading a file from B2
+        :rtype: str
+        """
+        return self._custom_download_url
+
+    @custom_download_url.setter
+    def custom_download_url(self, value):
+        if not value:
+            self._custom_download_url = None
+            return
+        parsed = urlparse(value)
+        if not parsed.scheme and not parsed.netloc:
+            raise ValueError("Invalid custom URL.")
+        value = value.rstrip("/") + "/"
+        self._custom_download_url = value
+
+    @property
+    def daemon(self):
+        """
+        True if drops should be handed to a long-lived background uploader.
+
+        :rtype: bool
+        """
+        return self._daemon
+
+    @daemon.setter
+    def daemon(self, value):
+        # Pashua checkboxes give us "1" or "0"
+        self._daemon = value in (True, "1")
+
+    @property
+    def download_url(self):
+        """
+        A download URL that is set by the ``authorize_account`` API call.
+        Usually looks similar to ``https://f001.backblazeb2.com``.
+
+        :rtype: str
+        """
+        return self._download_url
+
+    @download_url.setter
+    def download_url(self, value):
+        self._download_url = value
+
+    @property
+    def effective_download_url(self):
+        """
+        The custom URL provided by the user. If the user did not provide a
+        custom URL, then we use the one provided by Backblaze B2.
+        :rtype: str|None
+        """
+        if self.custom_download_url:
+            return self.custom_download_url
+        if not self.download_url:
+            return None
+        urlparts = (self.download_url, "file", self.bucket_name)
+        urlparts = [p.strip("/") for p in urlparts]
+        # returns <download_url>/file/<bucket-name>/
+        return "/".join(urlparts) + "/"
+
+    @property
+    def engine(self):
+        """
+        How small files are uploaded, one of ``ENGINES``.
+
+        :rtype: str
+        """
+        return self._engine
+
+    @engine.setter
+    def engine(self, value):
+        if not value:
+            value = ENGINES[0]
+        elif value not in ENGINES:
+            raise ValueError("The upload engine should be one of %s."
+                             % ", ".join(ENGINES))
+        self._engine = value
+
+    @property
+    def order(self):
+        """
+        Which files of a drop are uploaded first, one of
+        ``b2dz.dzschedule.ORDERS``.
+
+        :rtype: str
+        """
+        return self._order
+
+    @order.setter
+    def order(self, value):
+        if not value:
+            value = DEFAULT_ORDER
+        elif value not in ORDERS:
+            raise ValueError("The upload order should be one of %s."
+                             % ", ".join(ORDERS))
+        self._order = value
+
+    @property
+    def part_size(self):
+        """
+        The large file part size in megabytes chosen by the user or None to
+        let the part planner pick one for every file.
+
+        :rtype: int|None
+        """
+        return self._part_size
+
+    @part_size.setter
+    def part_size(self, value):
+        self._part_size = self._positive_int_or_none(value, "Part size")
+
+    @property
+    def part_streams(self):
+        """
+        How many parts of one large file to upload at the same time, or None
+        to let the part planner decide.
+
+        :rtype: int|None
+        """
+        return self._part_streams
+
+    @part_streams.setter
+    def part_streams(self, value):
+        self._part_streams = self._positive_int_or_none(value,
+                                                        "Parallel parts")
+
+    @property
+    def prefix(self):
+        return self._prefix
+
+    @prefix.setter
+    def prefix(self, value):
+        try:
+            value = value.strip("/")
+        except AttributeError:
+            pass
+        if not value:
+            value = "/"
+        else:
+            value = "/" + value + "/"
+        self._prefix = value
+
+    @property
+    def effective_prefix(self):
+        prefix = ACTION_START.strftime(self.prefix)
+        return prefix
+
+    @property
+    def prefix_is_unique(self):
+        """
+        True if the prefix has a placeholder that changes every second, like
+        ``%Y/%m/%d/%H%M%S``, so every drop goes to a folder of its own that
+        can't have anything in it yet.
+
+        :rtype: bool
+        """
+        # %% is a literal percent sign, not the start of a placeholder
+        prefix = (self.prefix or "").replace("%%", "")
+        return _PER_SECOND_PLACEHOLDER.search(prefix) is not None
+
+    @property
+    def profiles(self):
+        """
+        The user's transfer profiles, i.e.
+        ``background: workers=2 rate_limit=500``, or None for the defaults.
+
+        :rtype: str|None
+        """
+        return self._profiles
+
+    @profiles.setter
+    def profiles(self, value):
+        # normalized, and raises ValueError if it doesn't make sense
+        value = str(TransferProfiles.parse(value)) or None
+        self._profiles = None if value == DEFAULT_PROFILES else value
+
+    @property
+    def transfer_profiles(self):
+        """
+        :rtype: b2dz.dzprofiles.TransferProfiles
+        """
+        return TransferProfiles.parse(self.profiles or DEFAULT_PROFILES)
+
+    def get_modifier_profile(self, modifier):
+        """
+        :param modifier: one of ``MODIFIERS`` or None
+        :type modifier: str|None
+        :return: the name of the profile picked by holding ``modifier``, or
+                 None if it doesn't pick one
+        :rtype: str|None
+        """
+        name = self._modifier_profiles.get(modifier)
+        if name is None:
+            return DEFAULT_MODIFIER_PROFILES.get(modifier)
+        # the Pashua popup gives us "None" for no profile
+        return None if name == "None" else name
+
+    def set_modifier_profile(self, modifier, name):
+        """
+        :param modifier: one of ``MODIFIERS``
+        :type modifier: str
+        :param name: a profile name, "None" for no profile or None for the
+                     default profile
+        :type name: str|None
+        """
+        if name == DEFAULT_MODIFIER_PROFILES.get(modifier) or name == "":
+            name = None
+        self._modifier_profiles[modifier] = name
+
+    def profile_for(self, modifier):
+        """
+        :param modifier: the modifier key held during the drop, if any
+        :type modifier: str|None
+        :return: the profile to upload with or None to use the configuration
+                 as it is
+        :rtype: b2dz.dzprofiles.TransferProfile|None
+        """
+        name = self.get_modifier_profile(modifier)
+        if name is None:
+            return None
+        profile = self.transfer_profiles.get(name)
+        if profile is None:
+            logger.warning("%s picks the profile '%s' which doesn't exist",
+                           modifier, name)
+        return profile
+
+    @property
+    def rate_limit(self):
+        """
+        Most KB/s that uploads may use, or None for no limit.
+
+        :rtype: int|None
+        """
+        return self._rate_limit
+
+    @rate_limit.setter
+    def rate_limit(self, value):
+        self._rate_limit = self._positive_int_or_none(value, "Upload limit")
+
+    @property
+    def rate_schedule(self):
+        """
+        Upload limits for certain times of the day, i.e.
+        ``09:00-17:00=500`` to allow 500 KB/s during office hours.
+
+        :rtype: str|None
+        """
+        return self._rate_schedule
+
+    @rate_schedule.setter
+    def rate_schedule(self, value):
+        # normalized, and raises ValueError if it doesn't make sense
+        self._rate_schedule = str(RateSchedule.parse(value)) or None
+
+    @property
+    def realm(self):
+        return self._realm
+
+    @realm.setter
+    def realm(self, value):
+        self._realm = value
+
+    @property
+    def recommended_part_size(self):
+        return self._recommended_part_size
+
+    @recommended_part_size.setter
+    def recommended_part_size(self, value):
+        if value is not None:
+            value = int(value)
+        self._recommended_part_size = value
+
+    @property
+    def restricted_bucket(self):
+        """
+        This is the name of the bucket that this application key is restricted
+        to. If this application key has permission to access any bucket in the
+        account, returns None.
+
+        :return: the name of the bucket this application key is restricted to
+                 or None if it can access any bucket
+        :rtype: str|None
+        """
+        try:
+            return self.allowed["bucketName"]
+        except (KeyError, TypeError):
+            # self.allowed was probably None
+            return None
+
+    @property
+    def s3_api_url(self):
+        return self._s3_api_url
+
+    @s3_api_url.setter
+    def s3_api_url(self, value):
+        self._s3_api_url = value
+
+    @property
+    def throughput(self):
+        """
+        Upload speed in bytes per second measured during earlier drops.
+
+        :rtype: int|None
+        """
+        return self._throughput
+
+    @throughput.setter
+    def throughput(self, value):
+        if value is not None:
+            value = int(value)
+        self._throughput = value
+
+    @property
+    def workers(self):
+        """
+        How many files to transfer at the same time, or None to adapt to the
+        throughput the transfers are getting.
+
+        :rtype: int|None
+        """
+        return self._workers
+
+    @workers.setter
+    def workers(self, value):
+        self._workers = self._positive_int_or_none(value, "Files at once")
+
+    @staticmethod
+    def _positive_int_or_none(value, name):
+        if value is None or value == "":
+            return None
+        try:
+            value = int(value)
+        except ValueError:
+            raise ValueError("%s should be a whole number." % name)
+        if value < 1:
+            raise ValueError("%s should be at least 1." % name)
+        return value
+
+    def clear_cache(self):
+        """
+        Clear just the fields that are set by b2sdk and not usually by the
+        user directly.
+        """
+        self.account_id = None
+        self.allowed = None
+        self.api_url = None
+        self.auth_time = None
+        self.auth_token = None
+        self.buckets = None
+        self.download_url = None
+        self.recommended_part_size = None
+        self.absolute_minimum_part_size = None
+        self.realm = None
+        self.s3_api_url = None
+        self.throughput = None
+
+    def _clear(self):
+        self.application_key_id = None
+        self.application_key = None
+
+    @property
+    def is_valid(self):
+        return bool(self.application_key_id and self.application_key)
+
+    def export_auth_data(self):
+        """
+        :return: the current authorization, for another process to reuse
+                 with ``import_auth_data``
+        :rtype: dict
+        """
+        return {name: getattr(self, name) for name in self._AUTH_FIELDS}
+
+    def import_auth_data(self, auth_data):
+        """
+        Take over an authorization made by another process.
+
+        :param auth_data: what ``export_auth_data`` returned there
+        :type auth_data: dict
+        :return: False if it was made with another application key
+        :rtype: bool
+        """
+        if auth_data.get("application_key_id") != self.application_key_id:
+            return False
+        for name in self._AUTH_FIELDS:
+            setattr(self, name, auth_data.get(name))
+        self.save_config()
+        return True
+
+
+def load_config(config_class=DropzoneConfig):
+    """
+    The settings Dropzone has saved, or fresh ones if they can't be read.
+
+    :param config_class: ``DropzoneConfig`` or a subclass of it
+    :type config_class: type
+    :rtype: DropzoneConfig
+    """
+    config = config_class()
+    try:
+        config.load_config()
+        print(config)
+    except Exception as ex:
+        logger.error(traceback.format_exc())
+        dz.alert("Configuration Corrupt", "%s" % " ".join(ex.args))
+        config = config_class()  # fresh new config
+        config.save_config()
+    return config
+
+
+class ConfigDialog(object):
+    """
+    The configuration menu, shown when the action is clicked or has no
+    application key yet.
+    """
+
+    DIALOG = """
+    *.title = Backblaze B2 Options
+    application_key_id.type = textfield
+    application_key_id.label = Application Key ID:
+    application_key_id.mandatory = 1
+    application_key_id.default = %(application_key_id)s
+    application_key.type = password
+    application_key.label = Application Key:
+    application_key.default = %(application_key)s
+    application_key.mandatory = 1
+    bucket_name.type = textfield
+    bucket_name.label = Bucket Name
+    bucket_name.default = %(bucket_name)s
+    prefix.type = textfield
+    prefix.label = Path Prefix
+    prefix.default = %(prefix)s
+    custom_download_url.type = textfield
+    custom_download_url.label = Custom URL (i.e. Cloudflare domain)
+    custom_download_url.default = %(custom_download_url)s
+    part_size.type = textfield
+    part_size.label = Large file part size in MB (blank for automatic)
+    part_size.default = %(part_size)s
+    part_streams.type = textfield
+    part_streams.label = Parallel parts per file (blank for automatic)
+    part_streams.default = %(part_streams)s
+    workers.type = textfield
+    workers.label = Files at once (blank for automatic)
+    workers.default = %(workers)s
+    rate_limit.type = textfield
+    rate_limit.label = Upload limit in KB/s (blank for no limit)
+    rate_limit.default = %(rate_limit)s
+    rate_schedule.type = textfield
+    rate_schedule.label = Limits by time of day (i.e. 09:00-17:00=500)
+    rate_schedule.default = %(rate_schedule)s
+    compress.type = popup
+    compress.label = Compress text-like files
+    compress.option = None
+    compress.option = gzip
+    compress.option = zstd
+    compress.default = %(compress)s
+    order.type = popup
+    order.label = Upload first
+    order.option = smallest
+    order.option = largest
+    order.option = dropped
+    order.default = %(order)s
+    engine.type = popup
+    engine.label = Upload small files with
+    engine.option = threads
+    engine.option = asyncio
+    engine.default = %(engine)s
+    daemon.type = checkbox
+    daemon.label = Keep a background uploader running for faster drops
+    daemon.default = %(daemon)s
+    profiles.type = textfield
+    profiles.label = Transfer profiles (i.e. background: workers=2 rate_limit=500)
+    profiles.default = %(profiles)s
+    %(profile_popups)s
+    
+    saved.type = defaultbutton
+    saved.label = Save
+    cancelled.type = cancelbutton
+    clear_cache.type = button
+    clear_cache.label = Clear Cache
+    """
+    """Definition of the configuration menu using Pashua"""
+
+    def __init__(self, config, caches=None):
+        """
+        :param config: the settings to start from
+        :type config: DropzoneConfig
+        :param caches: the open local caches that Clear Cache empties, or
+                       None to open them from the support folder
+        :type caches: list|None
+        """
+        self.config = config
+        self.caches = caches
+
+    def show(self):
+        """
+        Prompts the user to modify the configuration. The new settings are
+        staged in ``config``, ready to be flushed.
+
+        :return: False if the user cancelled
+        :rtype: bool
+        """
+        config = self.config
+        while True:
+            config_dict = {
+                "application_key_id": config.application_key_id,
+                "application_key": config.application_key,
+                "bucket_name": config.bucket_name,
+                "prefix": config.prefix,
+                "custom_download_url": config.custom_download_url,
+                "part_size": config.part_size,
+                "part_streams": config.part_streams,
+                "workers": config.workers,
+                "rate_limit": config.rate_limit,
+                "rate_schedule": config.rate_schedule,
+                "daemon": "1" if config.daemon else "0",
+                "compress": config.compress or "None",
+                "order": config.order,
+                "engine": config.engine,
+                "profiles": str(config.transfer_profiles),
+                "profile_popups": self._profile_popups(config),
+            }
+            # replace None values with empty strings
+            config_dict = {k: "" if v is None else v for k, v in config_dict.items()}
+            dialog_box = self.DIALOG % config_dict
+            results = dz.pashua(dialog_box)
+            logger.debug(results)
+            if results.get("clear_cache") == "1":
+                config.clear_cache()
+                self.clear_caches()
+                continue
+            elif results["cancelled"] == "1" or results["saved"] != "1":
+                logger.debug("Cancelled!")
+                return False
+
+            try:
+                config = type(self.config)(**results)
+            except Exception as ex:
+                dz.alert("Invalid Configuration", " ".join(ex.args))
+                continue
+
+            if config.is_valid:
+                config.save_config()
+                self.config = config
+                self.publish_throttle_settings()
+                return True
+            # if config isn't valid, we show the dialog box again
+
+    def clear_caches(self):
+        """
+        Empty the upload index, the hash memo, the resume journal and the
+        shared authorization.
+        """
+        if self.caches is not None:
+            for cache in self.caches:
+                cache.clear()
+            return
+        # only imported for this button, the upload index and the hash memo
+        # live next to the code that needs b2sdk
+        from .dzhash import FileHasher
+        from .dzindex import UploadIndex
+        for cache in (UploadIndex(support_path(UPLOAD_INDEX_FILENAME)),
+                      FileHasher(support_path(HASH_MEMO_FILENAME)),
+                      ResumeJournal(support_path(RESUME_JOURNAL_FILENAME))):
+            try:
+                cache.clear()
+            finally:
+                cache.close()
+        SharedAuthorization(support_path(AUTH_FILENAME)).clear()
+
+    def publish_throttle_settings(self):
+        """
+        Hand the configured upload limits to any transfer that is running.
+        """
+        rate_limit = self.config.rate_limit
+        try:
+            UploadThrottle.save_settings(
+                support_path(THROTTLE_SETTINGS_FILENAME),
+                rate_limit * KILOBYTE if rate_limit else None,
+                RateSchedule.parse(self.config.rate_schedule))
+        except OSError:
+            logger.warning("Could not publish the new upload limits",
+                           exc_info=True)
+
+    @staticmethod
+    def _profile_popups(config):
+        """
+        :return: Pashua popups picking the profile of every modifier key
+        :rtype: str
+        """
+        names = ["None"] + [p.name for p in config.transfer_profiles]
+        lines = []
+        for modifier in MODIFIERS:
+            key = "%s_profile" % modifier.lower()
+            lines.append("%s.type = popup" % key)
+            lines.append("%s.label = Holding %s uses the profile"
+                         % (key, modifier))
+            lines.extend("%s.option = %s" % (key, name) for name in names)
+            lines.append("%s.default = %s" % (
+                key, config.get_modifier_profile(modifier) or "None"))
+        return "\n    ".join(lines)
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+An optional long-lived uploader. Starting a new Python process for every drop
+means importing b2sdk, loading the configuration and opening new HTTPS
+connections before a single byte is sent. The daemon keeps an authorized
+``B2Dropzone`` (with its warm connection pools and bucket cache) around and
+``dragged`` only hands it the dropped paths over a Unix socket.
+
+While the daemon works on a drop, every ``dz.*`` call it makes is sent back
+to the action process that asked for the drop, which makes the real call, so
+progress shows up in Dropzone as usual.
+
+This module only imports b2sdk (through ``b2dz.b2api``) inside the daemon.
+"""
+import errno
+import fcntl
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+from datetime import datetime
+
+from .dzsupport import support_path
+
+
+logger = logging.getLogger(__name__)
+
+
+SOCKET_FILENAME = "b2dz.sock"
+"""Name of the daemon's socket in the action's support folder"""
+
+LOG_FILENAME = "daemon.log"
+"""Name of the daemon's log file in the action's support folder"""
+
+ENABLED_KEY = "B2DZ_DAEMON"
+"""Same as ``DropzoneConfig.DAEMON_KEY``, without importing the settings"""
+
+IDLE_TIMEOUT = 15 * 60
+"""Seconds without a drop after which the daemon exits"""
+
+FORWARDED_CALLS = (
+    "add_dropbar", "alert", "begin", "determinate", "error", "fail",
+    "finish", "inputbox", "pashua", "percent", "read_clipboard",
+    "remove_value", "save_value", "temp_folder", "text", "url",
+)
+"""The ``dz`` functions the daemon passes on to the action process"""
+
+RETURNING_CALLS = ("inputbox", "pashua", "read_clipboard", "temp_folder")
+"""The ``dz`` functions whose return value the daemon has to wait for"""
+
+_BOOTSTRAP = """\
+import sys, types
+sys.path.insert(0, %r)
+try:
+    import dropzone
+except ImportError:
+    # the daemon makes every dz call through the action process anyway
+    sys.modules["dropzone"] = types.ModuleType("dropzone")
+from b2dz.dzdaemon import main
+main()
+"""
+"""Runs the daemon, making sure ``import dropzone`` works in it first"""
+
+
+class DaemonUnavailable(Exception):
+    """
+    There is no daemon to talk to, the drop should be done in-process.
+    """
+
+
+class DaemonError(Exception):
+    """
+    The daemon took the drop but couldn't finish it.
+    """
+
+
+def is_enabled():
+    """
+    :return: True if the user turned on the background uploader
+    :rtype: bool
+    """
+    return os.environ.get(ENABLED_KEY) == "1"
+
+
+def socket_path():
+    """
+    :rtype: str
+    """
+    return support_path(SOCKET_FILENAME)
+
+
+def start_daemon():
+    """
+    Start a daemon in the background for the drops that come after this one.
+    """
+    import subprocess  # only needed when no daemon is running
+    package_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(support_path(LOG_FILENAME), "ab") as log:
+        subprocess.Popen(
+            [sys.executable, "-c", _BOOTSTRAP % package_parent],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+            start_new_session=True, close_fds=True,
+        )
+    logger.info("Started the background uploader")
+
+
+class DaemonClient(object):
+    """
+    Sends one drop to the daemon and makes the ``dz`` calls it sends back.
+    """
+
+    CONNECT_TIMEOUT = 1
+    """Seconds to wait for the daemon to accept the connection"""
+
+    def __init__(self, dz, path=None):
+        """
+        :param dz: the real Dropzone API module
+        :param path: the daemon's socket, default ``socket_path()``
+        :type path: str|None
+        """
+        self.dz = dz
+        self.path = path or socket_path()
+        self.finish_message = None
+
+    def upload(self, items, key_modifier=None):
+        """
+        :param items: the paths that were dropped
+        :type items: list[str]
+        :param key_modifier: the key that was held during the drop
+        :type key_modifier: str|None
+        :return: what ``B2Dropzone.upload_files`` returned in the daemon
+        :rtype: str|bool
+        :raises DaemonUnavailable: if no daemon is listening
+        :raises DaemonError: if the daemon failed to upload the files
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.CONNECT_TIMEOUT)
+            sock.connect(self.path)
+        except OSError as ex:
+            sock.close()
+            raise DaemonUnavailable(str(ex))
+        sock.settimeout(None)  # a drop may wait behind another one
+
+        with sock, sock.makefile("rwb") as stream:
+            _send(stream, {
+                "items": list(items),
+                "key_modifier": key_modifier,
+                # saved values reach the action as environment variables
+                "environ": {k: v for k, v in os.environ.items()
+                            if k.startswith("B2DZ_")},
+            })
+            while True:
+                message = _receive(stream)
+                if message is None:
+                    raise DaemonError("The background uploader stopped "
+                                      "unexpectedly.")
+                if "call" in message:
+                    if message["call"] not in FORWARDED_CALLS:
+                        raise DaemonError("The background uploader made an "
+                                          "unknown call %r." % message["call"])
+                    result = getattr(self.dz, message["call"])(
+                        *message["args"])
+                    if message["reply"]:
+                        _send(stream, {"result": result})
+                elif "error" in message:
+                    raise DaemonError(message["error"])
+                else:
+                    self.finish_message = message.get("message")
+                    return message["result"]
+
+
+class DropzoneDaemon(object):
+    """
+    Accepts drops on a Unix socket and uploads them, one at a time, with a
+    ``B2Dropzone`` that is kept between drops.
+    """
+
+    def __init__(self, path=None, idle_timeout=IDLE_TIMEOUT):
+        """
+        :param path: where to listen, default ``socket_path()``
+        :type path: str|None
+        :param idle_timeout: seconds without a drop before exiting
+        :type idle_timeout: int|float
+        """
+        self.path = path or socket_path()
+        self.idle_timeout = idle_timeout
+        self.b2dz = None
+        self._environ = None
+        self._stream = None
+        self._lock = threading.Lock()  # dz calls come from the sync threads
+
+    def install(self, dz):
+        """
+        Route the ``dz`` calls made by every b2dz module to whichever action
+        process the current drop came from.
+
+        :param dz: the ``dropzone`` module as imported by b2dz
+        """
+        for name in FORWARDED_CALLS:
+            setattr(dz, name, self._forwarder(name))
+
+    def _forwarder(self, name):
+        def forward(*args):
+            return self.call(name, args)
+        forward.__name__ = name
+        return forward
+
+    def call(self, name, args):
+        """
+        Make a ``dz`` call in the action process of the current drop.
+        """
+        reply = name in RETURNING_CALLS
+        with self._lock:
+            stream = self._stream
+            if stream is None:
+                logger.info("dz.%s%r outside of a drop", name, args)
+                return None
+            try:
+                _send(stream, {"call": name, "args": list(args),
+                               "reply": reply})
+                message = _receive(stream) if reply else {}
+            except OSError:
+                message = None
+            if message is None:
+                # keep uploading, there is just nobody to show progress to
+                logger.warning("The action went away during dz.%s", name)
+                self._stream = None
+                return None
+            return message.get("result")
+
+    def serve_forever(self):
+        """
+        Handle drops until none has come in for ``idle_timeout`` seconds.
+        """
+        server = self._listen()
+        if server is None:
+            logger.info("Another daemon is already running")
+            return
+        try:
+            server.settimeout(self.idle_timeout)
+            while True:
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    logger.info("No drops for %s seconds, exiting",
+                                self.idle_timeout)
+                    return
+                with conn:
+                    conn.settimeout(None)
+                    self.handle(conn)
+        finally:
+            # while it still listens no other daemon takes the path over
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            server.close()
+
+    def _listen(self):
+        """
+        Bind to ``path`` and listen, unless another daemon does already. The
+        lock keeps daemons that start at the same time from removing each
+        other's sockets.
+
+        :return: the listening socket or None
+        :rtype: socket.socket|None
+        """
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                try:
+                    server.bind(self.path)
+                except OSError as ex:
+                    if ex.errno != errno.EADDRINUSE:
+                        raise
+                    if self._is_listening():
+                        server.close()
+                        return None
+                    os.unlink(self.path)  # left by a daemon that crashed
+                    server.bind(self.path)
+            except OSError:
+                server.close()
+                raise
+            os.chmod(self.path, 0o600)
+            server.listen(8)
+            logger.info("Listening on %s", self.path)
+            return server
+        finally:
+            os.close(fd)  # releases the lock as well
+
+    def _is_listening(self):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+            return True
+        except OSError:
+            return False
+        finally:
+            probe.close()
+
+    def handle(self, conn):
+        """
+        Upload one drop.
+
+        :type conn: socket.socket
+        """
+        with conn.makefile("rwb") as stream:
+            request = _receive(stream)
+            if request is None:
+                return
+            self._stream = stream
+            try:
+                url = self._upload(request)
+                _send(stream, {"result": url,
+                               "message": self.b2dz.finish_message})
+            except Exception as ex:
+                logger.exception("Drop failed")
+                try:
+                    _send(stream, {"error": " ".join(
+                        str(arg) for arg in ex.args) or repr(ex)})
+                except OSError:
+                    pass  # the action is gone, nobody to tell
+            finally:
+                self._stream = None
+
+    def _upload(self, request):
+        # set things up the way a new action process would find them
+        environ = request["environ"]
+        for key in [k for k in os.environ if k.startswith("B2DZ_")]:
+            if key not in environ:
+                del os.environ[key]
+        os.environ.update(environ)
+        if request.get("key_modifier"):
+            os.environ["KEY_MODIFIERS"] = request["key_modifier"]
+        else:
+            os.environ.pop("KEY_MODIFIERS", None)
+        sys.argv = [sys.argv[0], "dragged"] + request["items"]
+
+        from . import dzconfig
+        from .b2api import B2Dropzone
+        dzconfig.ACTION_START = datetime.now()
+
+        # the settings were changed by clicking the action since last time
+        if self.b2dz is None or environ != self._environ:
+            if self.b2dz is not None:
+                self.b2dz.close()
+            logger.info("Loading the configuration")
+            self.b2dz = B2Dropzone()
+            if not hasattr(self.b2dz, "api"):
+                # B2Dropzone already told the user why
+                self.b2dz = None
+                raise DaemonError("b2dz is not configured.")
+        try:
+            return self.b2dz.upload_files()
+        finally:
+            self.b2dz.config.flush()
+            # whatever the drop saved went to Dropzone as well, so the next
+            # drop should bring the same values
+            self._environ = {k: v for k, v in os.environ.items()
+                             if k.startswith("B2DZ_")}
+
+
+def _send(stream, message):
+    stream.write(json.dumps(message).encode("utf-8") + b"\n")
+    stream.flush()
+
+
+def _receive(stream):
+    line = stream.readline()
+    if not line:
+        return None
+    return json.loads(line.decode("utf-8"))
+
+
+def main():
+    """
+    Entry point of the daemon process started by ``start_daemon``.
+    """
+    logging.basicConfig(level=logging.INFO)
+    daemon = DropzoneDaemon()
+    daemon.install(sys.modules["dropzone"])
+    try:
+        daemon.serve_forever()
+    except OSError:
+        logger.exception("The background uploader could not start")
@@ -1,16 +1,21 @@
 # -*- coding: utf-8 -*-
 """
-A virtual source folder that holds the files (not folders!) that were dropped
-on our action script's icon.
+Source folders for the sync: a virtual folder that holds the files (not
+folders!) that were dropped on our action script's icon, and a faster way to
+walk the folders that were dropped.
 """
 
+import logging
 import os.path
+from concurrent.futures import ThreadPoolExecutor
 
 from b2sdk.sync.exception import UnSyncableFilename
-from b2sdk.sync.folder import AbstractFolder
+from b2sdk.sync.folder import AbstractFolder, LocalFolder, join_b2_path
 from b2sdk.sync.path import LocalSyncPath
 from b2sdk.sync.scan_policies import DEFAULT_SCAN_MANAGER
-from b2sdk.utils import get_file_mtime
+
+
+logger = logging.getLogger(__name__)
 
 
 class DropzoneFolder(AbstractFolder):
@@ -20,7 +25,14 @@ class DropzoneFolder(AbstractFolder):
     destination folder.
     """
 
+    STAT_WORKERS = 16
+    """Files stat'ed at the same time, each stat may be a network round trip"""
+
     def __init__(self, file_list):
+        """
+        :param file_list: paths of the files that were dropped
+        :type file_list: list[str]
+        """
         file_map = {os.path.basename(f): f for f in file_list
                     if not os.path.isdir(f)}
         if len(file_map) != len(file_list):
@@ -31,14 +43,35 @@ class DropzoneFolder(AbstractFolder):
         self._file_map = file_map
 
     def all_files(self, reporter, policies_manager=DEFAULT_SCAN_MANAGER):
-        for filename, filepath in self._file_map.items():
+        # the sync needs the files sorted by name
+        names = sorted(self._file_map)
+        paths = [self._file_map[name] for name in names]
+        with ThreadPoolExecutor(self.STAT_WORKERS,
+                                thread_name_prefix="stat") as executor:
+            stats = list(executor.map(self._stat, paths))
+
+        syncpaths = []
+        for filename, filepath, stat in zip(names, paths, stats):
+            if stat is None:
+                if reporter is not None:
+                    reporter.local_access_error(filepath)
+                continue
             syncpath = LocalSyncPath(
                 absolute_path=filepath,
                 relative_path=filename,
-                mod_time=get_file_mtime(filepath),
-                size=os.path.getsize(filepath)
+                mod_time=int(stat.st_mtime * 1000),
+                size=stat.st_size
             )
-            yield syncpath
+            if not policies_manager.should_exclude_local_path(syncpath):
+                syncpaths.append(syncpath)
+        yield from syncpaths
+
+    @staticmethod
+    def _stat(path):
+        try:
+            return os.stat(path)
+        except OSError:
+            return None
 
     def ensure_non_empty(self):
         pass  # shouldn't even be possible
@@ -51,3 +84,105 @@ class DropzoneFolder(AbstractFolder):
             return self._file_map[file_name]
         except KeyError as ex:
             raise UnSyncableFilename from ex
+
+
+class ScandirFolder(LocalFolder):
+    """
+    A drop-in ``LocalFolder`` for big folder drops. b2sdk's version makes
+    about eight system calls per file and lists one directory at a time.
+    This one lists directories with ``os.scandir``, which knows which entries
+    are directories without asking, stats every file once, and lists the
+    subdirectories of the directory being walked in parallel while its
+    files are already being synced.
+
+    Files come out in the same order as from ``LocalFolder``, which is the
+    order the sync needs.
+    """
+
+    SCAN_WORKERS = 8
+    """Threads listing directories ahead of the sync"""
+
+    def all_files(self, reporter, policies_manager=DEFAULT_SCAN_MANAGER):
+        executor = ThreadPoolExecutor(self.SCAN_WORKERS,
+                                      thread_name_prefix="scandir")
+        try:
+            listing = self._scan(self.root, "", reporter, policies_manager)
+            yield from self._walk(listing, executor, reporter,
+                                  policies_manager)
+        finally:
+            executor.shutdown(wait=True)
+
+    def _walk(self, listing, executor, reporter, policies_manager):
+        # only the subdirectories of directories being walked are listed
+        # ahead, which keeps the number of listings held in memory small
+        subdirs = {
+            local_path: executor.submit(self._scan, local_path, relative_path,
+                                        reporter, policies_manager)
+            for _, local_path, relative_path, stat in listing if stat is None
+        }
+        try:
+            for _, local_path, relative_path, stat in listing:
+                if stat is None:
+                    yield from self._walk(subdirs.pop(local_path).result(),
+                                          executor, reporter,
+                                          policies_manager)
+                    continue
+                local_sync_path = LocalSyncPath(
+                    absolute_path=local_path,
+                    relative_path=relative_path,
+                    mod_time=int(stat.st_mtime * 1000),
+                    size=stat.st_size,
+                )
+                if policies_manager.should_exclude_local_path(
+                        local_sync_path):
+                    continue
+                yield local_sync_path
+        finally:
+            # the sync may stop early, don't keep listing for nobody
+            # (by hand, cancel_futures needs Python 3.9)
+            for future in subdirs.values():
+                future.cancel()
+
+    def _scan(self, local_dir, relative_dir_path, reporter, policies_manager):
+        """
+        List one directory, sorted the way b2sdk's ``LocalFolder`` sorts.
+
+        :return: (sort key, local path, relative path, stat result or None
+                 for directories) of every entry worth syncing
+        :rtype: list[tuple]
+        """
+        entries = []
+        with os.scandir(local_dir) as it:
+            for entry in it:
+                name = entry.name
+                local_path = entry.path
+                relative_path = join_b2_path(relative_dir_path, name)
+                try:
+                    is_dir = entry.is_dir()
+                    stat = None if is_dir else entry.stat()
+                except OSError:
+                    # a broken symlink, or it was deleted since the listing
+                    if reporter is not None:
+                        reporter.local_access_error(local_path)
+                    continue
+                if not os.access(local_path, os.R_OK):
+                    if reporter is not None:
+                        reporter.local_permission_error(local_path)
+                    continue
+                if policies_manager.exclude_all_symlinks and \
+                        entry.is_symlink():
+                    if reporter is not None:
+                        reporter.symlink_skipped(local_path)
+                    continue
+                if is_dir:
+                    if policies_manager.should_exclude_local_directory(
+                            relative_path):
+                        continue
+                    # directories sort as if their names end in "/"
+                    name += "/"
+                entries.append((name, local_path, relative_path, stat))
+        entries.sort(key=lambda e: e[0])
+        return entries
+
+    def __repr__(self):
+        return "ScandirFolder(%s)" % (self.root,)
@@ -2,21 +2,37 @@
 """
 Entry functions for Dropzone's two supported function calls:
 clicked and dragged.
+
+b2sdk and the modules that use it are only imported once they are needed. A
+drop handed to the background uploader never imports them at all.
 """
+import os
+import sys
+import time
 import traceback
-from datetime import datetime
 
-import arrow
 import dropzone as dz
-from .b2api import B2Dropzone
+from . import dzdaemon
 
 
 def clicked():
     """
     When a user clicks our action script icon, launch configuration menu.
+    b2sdk is only imported once the new settings were saved, to check the
+    application key and pick a bucket.
     """
     try:
-        B2Dropzone()
+        from .dzconfig import ConfigDialog, load_config
+        dialog = ConfigDialog(load_config())
+        accepted = dialog.show()
+        # Clear Cache changes the settings even if the dialog is cancelled
+        dialog.config.flush()
+        if not accepted:
+            dz.fail("Configuration was cancelled.")
+            return
+        from .b2api import B2Dropzone
+        b2dz = B2Dropzone()
+        b2dz.config.flush()
     except Exception as ex:
         print(traceback.format_exc())
         dz.fail(" ".join(ex.args))
@@ -30,12 +46,70 @@ def dragged():
     Backblaze B2.
     """
     try:
-        start = arrow.now()
-        b2dz = B2Dropzone()
-        url = b2dz.upload_files()
-        dz.finish("Upload completed. Took %s to complete." %
-                  start.humanize(only_distance=True))
+        start = time.time()
+        # show something right away, the imports below take a moment
+        dz.begin("Uploading files...")
+        uploaded = _upload_through_daemon()
+        if uploaded is None:
+            from .b2api import B2Dropzone
+            b2dz = B2Dropzone()
+            try:
+                url = b2dz.upload_files()
+            finally:
+                # everything this drop changed goes to Dropzone in one go
+                b2dz.config.flush()
+            message = b2dz.finish_message
+        else:
+            url, message = uploaded
+        dz.finish(message or "Upload completed. Took %s to complete." %
+                  humanize_duration(time.time() - start))
         dz.url(url)
     except Exception as ex:
         dz.fail(" ".join(ex.args))
         raise ex
+
+
+def _upload_through_daemon():
+    """
+    Hand the drop to the background uploader if the user turned it on,
+    starting one for the next drop if none is running.
+
+    :return: the result of the upload and the message to finish with, or
+             None if it has to be done here
+    :rtype: tuple[str|bool, str|None]|None
+    """
+    if not dzdaemon.is_enabled():
+        return None
+    client = dzdaemon.DaemonClient(dz)
+    try:
+        url = client.upload(sys.argv[2:], os.environ.get("KEY_MODIFIERS"))
+        return url, client.finish_message
+    except dzdaemon.DaemonUnavailable:
+        dzdaemon.start_daemon()
+        return None
+
+
+def humanize_duration(seconds):
+    """
+    Describe a duration the way a person would, i.e. "a minute" or
+    "3 hours".
+
+    :param seconds: how long something took
+    :type seconds: int|float
+    :rtype: str
+    """
+    if seconds < 10:
+        return "instantly"
+    if seconds < 45:
+        return "%d seconds" % seconds
+    if seconds < 90:
+        return "a minute"
+    if seconds < 45 * 60:
+        return "%d minutes" % max(2, round(seconds / 60))
+    if seconds < 90 * 60:
+        return "an hour"
+    if seconds < 22 * 60 * 60:
+        return "%d hours" % max(2, round(seconds / 3600))
+    if seconds < 36 * 60 * 60:
+        return "a day"
+    return "%d days" % max(2, round(seconds / 86400))
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+SHA1 hashing of local files with a persistent memo, so that a file (or a part
+of a large file) that hasn't changed since the last drop is never read just
+to hash it again.
+"""
+import hashlib
+import logging
+import os
+import queue
+import sqlite3
+import threading
+
+from b2sdk.transfer.emerge.planner.part_definition import \
+    UploadEmergePartDefinition
+from b2sdk.v2 import UploadSourceLocalFile
+from .dzmmap import MappedRange
+
+
+logger = logging.getLogger(__name__)
+
+
+class FileHasher(object):
+    """
+    Hashes files with big buffers (or mmap for big files) and remembers the
+    results keyed by (device, inode, size, mtime, offset, length). A range
+    that is already being hashed by one thread is waited for by the others
+    instead of being hashed again.
+
+    This class is thread safe.
+    """
+
+    BUFFER_SIZE = 8 * 1024 * 1024
+    """How much to hand to SHA1 at a time"""
+
+    MMAP_MIN_SIZE = 64 * 1024 * 1024
+    """Files at least this big are memory-mapped instead of read"""
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS hashes (
+        dev INTEGER NOT NULL,
+        inode INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        mod_time INTEGER NOT NULL,
+        offset INTEGER NOT NULL,
+        length INTEGER NOT NULL,
+        sha1 TEXT NOT NULL,
+        PRIMARY KEY (dev, inode, size, mod_time, offset, length)
+    );
+    """
+
+    def __init__(self, filename=":memory:"):
+        """
+        :param filename: path to the SQLite memo store (created if missing)
+        :type filename: str
+        """
+        self.filename = filename
+        self.hits = 0
+        self.misses = 0
+        self.bytes_hashed = 0
+        self._lock = threading.Lock()
+        self._hashing = {}  # key -> Event set when its hash is stored
+        self._conn = sqlite3.connect(filename, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self._SCHEMA)
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.filename)
+
+    @property
+    def hit_rate(self):
+        """
+        Fraction of hashes asked for that were answered from the memo.
+        ``cached_sha1`` only peeks, so it isn't counted.
+
+        :rtype: float
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM hashes")
+
+    def cached_sha1(self, local_path, offset=0, length=None):
+        """
+        The remembered SHA1 of a file (or range of it), without reading it.
+
+        :return: the hex SHA1 or None if it hasn't been hashed before
+        :rtype: str|None
+        """
+        return self._lookup(self._key(os.stat(local_path), offset, length),
+                            count=False)
+
+    def sha1_of_file(self, local_path):
+        """
+        :type local_path: str
+        :return: the hex SHA1 of the whole file
+        :rtype: str
+        """
+        return self.sha1_of_range(local_path, 0, None)
+
+    def sha1_of_range(self, local_path, offset, length):
+        """
+        :param local_path: the file to hash
+        :type local_path: str
+        :param offset: where in the file to start
+        :type offset: int
+        :param length: how many bytes to hash, None for the rest of the file
+        :type length: int|None
+        :return: the hex SHA1 of ``length`` bytes starting at ``offset``
+        :rtype: str
+        """
+        stat = os.stat(local_path)
+        key = self._key(stat, offset, length)
+        sha1 = self._lookup(key)
+        if sha1 is not None:
+            return sha1
+        with self._lock:
+            hashed = self._hashing.get(key)
+            if hashed is None:
+                self._hashing[key] = threading.Event()
+        if hashed is not None:
+            hashed.wait()
+            sha1 = self._lookup(key, count=False)  # counted as a miss above
+            if sha1 is not None:
+                return sha1
+            # the other thread failed, see for ourselves
+            return self.sha1_of_range(local_path, offset, length)
+        try:
+            sha1 = self._hash(local_path, stat.st_size, offset, key[5])
+            with self._lock:
+                self.bytes_hashed += key[5]
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO hashes VALUES "
+                    "(?, ?, ?, ?, ?, ?, ?)", key + (sha1,))
+        finally:
+            with self._lock:
+                self._hashing.pop(key).set()
+        return sha1
+
+    def _lookup(self, key, count=True):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sha1 FROM hashes WHERE dev = ? AND inode = ? "
+                "AND size = ? AND mod_time = ? AND offset = ? AND length = ?",
+                key).fetchone()
+            if count:
+                if row is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+            return None if row is None else row[0]
+
+    def _hash(self, local_path, file_size, offset, length):
+        digest = hashlib.sha1()
+        if length and file_size >= self.MMAP_MIN_SIZE:
+            with MappedRange(local_path, offset, length) as mapped:
+                while True:
+                    data = mapped.read(self.BUFFER_SIZE)
+                    if not data:
+                        break
+                    digest.update(data)
+            return digest.hexdigest()
+        with open(local_path, "rb") as f:
+            f.seek(offset)
+            buffer = bytearray(self.BUFFER_SIZE)
+            view = memoryview(buffer)
+            remaining = length
+            while remaining:
+                read = f.readinto(view[:min(remaining, self.BUFFER_SIZE)])
+                if not read:
+                    raise ValueError("%s is shorter than expected" %
+                                     local_path)
+                digest.update(view[:read])
+                remaining -= read
+        return digest.hexdigest()
+
+    @staticmethod
+    def _key(stat, offset, length):
+        if length is None:
+            length = stat.st_size - offset
+        return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns,
+                offset, length)
+
+
+class HashAhead(object):
+    """
+    Hashes files on background threads, in the order they are submitted, so
+    their hashes are memoized by the time their uploads ask for them. An
+    upload that gets to a file first waits for its hash instead of hashing
+    it twice.
+
+    The threads are daemons, ``close`` drops whatever hasn't started.
+    """
+
+    WORKERS = 2
+    """Files hashed at the same time"""
+
+    def __init__(self, hasher, workers=WORKERS):
+        """
+        :type hasher: FileHasher
+        :param workers: files hashed at the same time
+        :type workers: int
+        """
+        self.hasher = hasher
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._submitted = set()
+        self._threads = []
+        self._closed = False
+
+    def __repr__(self):
+        return "<%s submitted=%d>" % (self.__class__.__name__,
+                                      len(self._submitted))
+
+    def submit(self, local_path):
+        """
+        Hash a file, unless it was submitted before.
+
+        :type local_path: str
+        """
+        with self._lock:
+            if self._closed or local_path in self._submitted:
+                return
+            self._submitted.add(local_path)
+            self._queue.put(local_path)
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name="hash-ahead",
+                                          daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def close(self):
+        """
+        Forget the files that aren't being hashed yet and let the threads go.
+        """
+        with self._lock:
+            self._closed = True
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            for _ in self._threads:
+                self._queue.put(None)
+
+    def _run(self):
+        while True:
+            local_path = self._queue.get()
+            if local_path is None:
+                return
+            try:
+                self.hasher.sha1_of_file(local_path)
+            except Exception:
+                # the upload will run into it as well and report it
+                logger.debug("Could not hash %s ahead", local_path,
+                             exc_info=True)
+
+
+class HashedUploadSource(UploadSourceLocalFile):
+    """
+    A local file upload source that gets its SHA1 (and the SHA1s of its large
+    file parts) from a ``FileHasher``.
+    """
+
+    def __init__(self, local_path, hasher, content_sha1=None):
+        """
+        :type local_path: str
+        :type hasher: FileHasher
+        """
+        self.hasher = hasher
+        super(HashedUploadSource, self).__init__(local_path, content_sha1)
+
+    def get_content_sha1(self):
+        if self.content_sha1 is None:
+            self.content_sha1 = self.hasher.sha1_of_file(self.local_path)
+        return self.content_sha1
+
+    def is_sha1_known(self):
+        # If we have hashed this file before we can tell B2 up front,
+        # otherwise let b2sdk hash it while it is being sent.
+        if self.content_sha1 is None:
+            self.content_sha1 = self.hasher.cached_sha1(self.local_path)
+        return self.content_sha1 is not None
+
+
+class HashedUploadEmergePartDefinition(UploadEmergePartDefinition):
+    """
+    A large file part that looks its SHA1 up in the upload source's hasher
+    before reading the part to compute it, and that is sent from a memory
+    mapping of the file instead of being copied into buffers.
+    """
+
+    def get_sha1(self):
+        if self._sha1 is None:
+            self._sha1 = self.upload_source.hasher.sha1_of_range(
+                self.upload_source.local_path, self.relative_offset,
+                self.length)
+        return self._sha1
+
+    def _get_stream(self):
+        if not self.length:
+            # an empty file can't be mapped
+            return super(HashedUploadEmergePartDefinition, self)._get_stream()
+        # The SHA1 is always known up front, so nothing appends it to what
+        # is read and the views can go to the socket as they are.
+        return MappedRange(self.upload_source.local_path,
+                           self.relative_offset, self.length)
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+A local SQLite index of the files b2dz has uploaded (or seen while listing a
+bucket) so that repeated drops into the same place don't have to list the
+whole destination prefix again, and so that bytes already in B2 can be
+copied server-side instead of being uploaded again.
+"""
+import logging
+import sqlite3
+import threading
+import time
+
+from b2sdk.sync.folder import B2Folder, b2_parent_dir
+from b2sdk.sync.path import B2SyncPath
+from b2sdk.sync.scan_policies import DEFAULT_SCAN_MANAGER
+from b2sdk.v2 import SRC_LAST_MODIFIED_MILLIS
+
+
+logger = logging.getLogger(__name__)
+
+
+class UploadIndex(object):
+    """
+    Remembers the latest version of every B2 file that b2dz uploaded, along
+    with when each B2 folder was last listed in full.
+
+    This class is thread safe. Uploads are recorded from the sync threads.
+    """
+
+    MAX_AGE = 24 * 60 * 60
+    """Seconds that a full listing of a B2 folder is trusted for"""
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS files (
+        bucket_id TEXT NOT NULL,
+        file_name TEXT NOT NULL,
+        file_id TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mod_time INTEGER NOT NULL,
+        sha1 TEXT,
+        upload_timestamp INTEGER,
+        recorded_at REAL NOT NULL,
+        PRIMARY KEY (bucket_id, file_name)
+    );
+    CREATE INDEX IF NOT EXISTS files_by_sha1 ON files (sha1);
+    CREATE INDEX IF NOT EXISTS files_by_size ON files (bucket_id, size);
+    CREATE TABLE IF NOT EXISTS listings (
+        bucket_id TEXT NOT NULL,
+        folder_name TEXT NOT NULL,
+        listed_at REAL NOT NULL,
+        PRIMARY KEY (bucket_id, folder_name)
+    );
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: path to the SQLite database (created if missing)
+        :type filename: str
+        """
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(filename, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self._SCHEMA)
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.filename)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def clear(self):
+        """
+        Forget everything. The next drop into any folder will list it again.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM files")
+            self._conn.execute("DELETE FROM listings")
+
+    def record(self, file_version):
+        """
+        Remember a file that was just uploaded (or copied) to B2.
+
+        :type file_version: b2sdk.v2.FileVersion
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                self._row(file_version, time.time()))
+
+    def forget(self, bucket_id, file_name):
+        """
+        Remove a single file from the index, i.e. because it turned out to no
+        longer exist in B2.
+        """
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM files WHERE bucket_id = ? AND file_name = ?",
+                (bucket_id, file_name))
+
+    def replace_folder(self, bucket_id, folder_name, file_versions,
+                       listed_at=None):
+        """
+        Replace everything known about a B2 folder with the results of a full
+        listing of it and mark the folder as freshly listed. Files recorded
+        since the listing started are newer than what it saw and are kept.
+
+        :param bucket_id: the ID of the bucket that was listed
+        :type bucket_id: str
+        :param folder_name: the folder in the bucket that was listed
+                            (``""`` for the whole bucket)
+        :type folder_name: str
+        :param file_versions: the latest visible version of every file
+        :type file_versions: list[b2sdk.v2.FileVersion]
+        :param listed_at: when the listing started, default now
+        :type listed_at: float|None
+        """
+        if listed_at is None:
+            listed_at = time.time()
+        low, high = self._name_range(folder_name)
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "DELETE FROM files WHERE bucket_id = ? "
+                "AND file_name >= ? AND file_name < ? AND recorded_at < ?",
+                (bucket_id, low, high, listed_at))
+            # what is left was recorded after the listing started
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [self._row(fv, listed_at) for fv in file_versions])
+            self._conn.execute(
+                "INSERT OR REPLACE INTO listings VALUES (?, ?, ?)",
+                (bucket_id, folder_name, listed_at))
+
+    def is_fresh(self, bucket_id, folder_name, max_age=None):
+        """
+        True if ``folder_name`` (or a folder containing it) was listed in
+        full within the last ``max_age`` seconds.
+
+        :type bucket_id: str
+        :type folder_name: str
+        :param max_age: seconds a listing is good for, default ``MAX_AGE``
+        :type max_age: int|float|None
+        :rtype: bool
+        """
+        if max_age is None:
+            max_age = self.MAX_AGE
+        folders = [""]
+        parts = folder_name.split("/") if folder_name else []
+        for i in range(1, len(parts) + 1):
+            folders.append("/".join(parts[:i]))
+        query = ("SELECT 1 FROM listings WHERE bucket_id = ? AND listed_at >= ? "
+                 "AND folder_name IN (%s) LIMIT 1" %
+                 ", ".join("?" * len(folders)))
+        with self._lock:
+            row = self._conn.execute(
+                query, [bucket_id, time.time() - max_age] + folders).fetchone()
+        return row is not None
+
+    def files_under(self, bucket_id, folder_name):
+        """
+        Everything the index knows about inside a B2 folder, sorted the way
+        B2 sorts file names.
+
+        :return: tuples of (file_name, file_id, size, mod_time, sha1,
+                 upload_timestamp)
+        :rtype: list[tuple]
+        """
+        low, high = self._name_range(folder_name)
+        with self._lock:
+            return self._conn.execute(
+                "SELECT file_name, file_id, size, mod_time, sha1, "
+                "upload_timestamp FROM files WHERE bucket_id = ? "
+                "AND file_name >= ? AND file_name < ? ORDER BY file_name",
+                (bucket_id, low, high)).fetchall()
+
+    def has_size(self, bucket_id, size):
+        """
+        Whether the bucket has a file of exactly ``size`` bytes whose SHA1 is
+        known, which is cheap to find out before hashing anything.
+
+        :rtype: bool
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM files WHERE bucket_id = ? AND size = ? "
+                "AND sha1 IS NOT NULL LIMIT 1", (bucket_id, size)).fetchone()
+        return row is not None
+
+    def find_by_sha1(self, bucket_id, sha1, size):
+        """
+        Look for a file already in the bucket with exactly these contents.
+
+        :return: the (file_id, file_name) of a matching B2 file or None
+        :rtype: tuple[str, str]|None
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT file_id, file_name FROM files WHERE sha1 = ? "
+                "AND size = ? AND bucket_id = ? "
+                "ORDER BY upload_timestamp DESC LIMIT 1",
+                (sha1, size, bucket_id)).fetchone()
+
+    @staticmethod
+    def _name_range(folder_name):
+        """
+        The range of B2 file names that are inside ``folder_name``. SQLite
+        compares TEXT by its UTF-8 bytes which is the same order B2 uses.
+        Everything starting with "folder/" sorts before "folder0" because "0"
+        comes right after "/".
+        """
+        if not folder_name:
+            return "", "\U0010ffff"
+        return folder_name + "/", folder_name + "0"
+
+    @staticmethod
+    def _row(file_version, recorded_at):
+        file_info = file_version.file_info or {}
+        sha1 = file_version.content_sha1
+        if not sha1 or sha1 == "none":
+            # large files only have a SHA1 if the uploader provided one
+            sha1 = file_info.get("large_file_sha1")
+        if "b2-content-encoding" in file_info:
+            # the SHA1 of the compressed bytes, no local file will match it
+            sha1 = None
+        return (
+            file_version.bucket_id,
+            file_version.file_name,
+            file_version.id_,
+            file_version.size,
+            file_version.mod_time_millis,
+            sha1,
+            file_version.upload_timestamp,
+            recorded_at,
+        )
+
+
+class IndexedB2Folder(B2Folder):
+    """
+    A B2 destination folder that answers ``all_files`` from the local
+    ``UploadIndex`` instead of listing the bucket. A real listing only
+    happens when the index is stale for this folder or ``refresh`` is True,
+    and that listing is then saved back into the index.
+    """
+
+    def __init__(self, bucket_name, folder_name, api, refresh=False):
+        """
+        :param api: an API object with an ``upload_index``
+        :type api: b2dz.dzapi.DropzoneB2Api
+        :param refresh: always list the bucket, ignoring the index
+        :type refresh: bool
+        """
+        super(IndexedB2Folder, self).__init__(bucket_name, folder_name, api)
+        self.index = api.upload_index
+        self.refresh = refresh
+
+    def all_files(self, reporter, policies_manager=DEFAULT_SCAN_MANAGER):
+        if self.refresh or not self.index.is_fresh(self.bucket.id_,
+                                                   self.folder_name):
+            logger.debug("Listing %s, the upload index is stale", self)
+            return self._list_and_index(reporter, policies_manager)
+        logger.debug("Answering %s from the upload index", self)
+        return self._indexed_files(policies_manager)
+
+    def _list_and_index(self, reporter, policies_manager):
+        # uploads of this drop may be recorded while the listing is read
+        listed_at = time.time()
+        latest_versions = []
+        for sync_path in super(IndexedB2Folder, self).all_files(
+                reporter, policies_manager):
+            if sync_path.is_visible():
+                latest_versions.append(sync_path.selected_version)
+            yield sync_path
+        # only reached if the listing finished
+        self.index.replace_folder(self.bucket.id_, self.folder_name,
+                                  latest_versions, listed_at)
+
+    def _indexed_files(self, policies_manager):
+        factory = self.api.file_version_factory
+        account_id = self.api.account_info.get_account_id()
+        for row in self.index.files_under(self.bucket.id_, self.folder_name):
+            file_name, file_id, size, mod_time, sha1, upload_timestamp = row
+            relative_path = file_name[len(self.prefix):]
+            if policies_manager.should_exclude_b2_directory(
+                    b2_parent_dir(relative_path)):
+                continue
+            file_version = factory.from_api_response({
+                "accountId": account_id,
+                "bucketId": self.bucket.id_,
+                "action": "upload",
+                "fileId": file_id,
+                "fileName": file_name,
+                "size": size,
+                "contentSha1": sha1,
+                "uploadTimestamp": upload_timestamp,
+                "fileInfo": {SRC_LAST_MODIFIED_MILLIS: str(mod_time)},
+                # the index doesn't track these, b2sdk insists on them
+                "fileRetention": {"isClientAuthorizedToRead": False},
+                "legalHold": {"isClientAuthorizedToRead": False},
+            })
+            if policies_manager.should_exclude_b2_file_version(file_version,
+                                                                relative_path):
+                continue
+            yield B2SyncPath(relative_path=relative_path,
+                             selected_version=file_version,
+                             all_versions=[file_version])
+
+    def __str__(self):
+        return "IndexedB2Folder(%s, %s)" % (self.bucket_name, self.folder_name)
+
+
+class BlindB2Folder(IndexedB2Folder):
+    """
+    A B2 destination folder that is known to be empty, or that the user
+    chose not to compare with. It neither lists the bucket nor reads the
+    index, so sync starts uploading as soon as the first local file is
+    found.
+    """
+
+    def all_files(self, reporter, policies_manager=DEFAULT_SCAN_MANAGER):
+        logger.debug("Not listing %s, uploading blind", self)
+        return iter(())
+
+    def __str__(self):
+        return "BlindB2Folder(%s, %s)" % (self.bucket_name, self.folder_name)
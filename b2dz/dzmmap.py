@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Reads a range of a file through a memory mapping. Reads hand out
+memoryviews of the mapping instead of copying into new bytes objects, so
+large file parts are hashed and sent straight from the page cache.
+"""
+import io
+import logging
+import mmap
+
+
+logger = logging.getLogger(__name__)
+
+
+class MappedRange(io.RawIOBase):
+    """
+    A read-only, seekable stream of ``length`` bytes of a file starting at
+    ``offset``. ``read`` returns memoryviews that stay valid as long as they
+    are referenced, even after the stream is closed.
+
+    Pages behind the read position are given back to the OS a ``WINDOW``
+    at a time as reading moves on. However big the range, a reader keeps at
+    most a window and the last read of it resident, so many parts can be in
+    flight at once without the file ending up in our memory.
+    """
+
+    WINDOW = 256 * 1024
+    """Bytes read since pages were last given back before they are again"""
+
+    def __init__(self, local_path, offset, length):
+        """
+        :param local_path: the file to read
+        :type local_path: str
+        :param offset: where in the file the range starts
+        :type offset: int
+        :param length: bytes in the range, at least one
+        :type length: int
+        :raises ValueError: if the file is shorter than the range
+        """
+        super(MappedRange, self).__init__()
+        # mappings have to start on an allocation boundary
+        start = offset - offset % mmap.ALLOCATIONGRANULARITY
+        self._skip = offset - start
+        with open(local_path, "rb") as f:
+            self._mapped = mmap.mmap(f.fileno(), self._skip + length,
+                                     access=mmap.ACCESS_READ, offset=start)
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            self._mapped.madvise(mmap.MADV_SEQUENTIAL)
+        self._view = memoryview(self._mapped)[self._skip:]
+        self.length = length
+        self._position = 0
+        self._released = 0  # bytes at the start of the mapping given back
+
+    def __len__(self):
+        return self.length
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self._position
+        elif whence == io.SEEK_END:
+            pos += self.length
+        if pos < 0:
+            raise ValueError("negative seek position %d" % pos)
+        self._position = min(pos, self.length)
+        # pages before the new position may have to be given back again
+        self._released = min(self._released, self._page_start())
+        return self._position
+
+    def read(self, size=-1):
+        """
+        :param size: most bytes to read, -1 or None for the rest of the range
+        :type size: int|None
+        :return: a view of the mapping, empty at the end of the range
+        :rtype: memoryview
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        end = self.length
+        if size is not None and size >= 0:
+            end = min(end, self._position + size)
+        # what the last read returned has been used by now, but not this
+        self._release_behind()
+        data = self._view[self._position:end]
+        self._position = end
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self._view.release()
+        try:
+            self._mapped.close()
+        except BufferError:
+            # a reader still holds a view, the mapping goes with the last one
+            pass
+        super(MappedRange, self).close()
+
+    def _page_start(self):
+        """
+        :return: offset in the mapping of the page the read position is on
+        :rtype: int
+        """
+        offset = self._skip + self._position
+        return offset - offset % mmap.PAGESIZE
+
+    def _release_behind(self):
+        if not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        end = self._page_start()
+        if end - self._released >= self.WINDOW:
+            # the file is mapped read only, so the pages are just read from
+            # the page cache again if they're needed after all
+            self._mapped.madvise(mmap.MADV_DONTNEED, self._released,
+                                 end - self._released)
+            self._released = end
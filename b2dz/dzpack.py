@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Packing mode: everything that was dropped goes into one tar archive in B2
+instead of one object per file, which is much faster for thousands of tiny
+files. The archive is laid out from ``stat`` results alone and streamed
+straight from the original files, nothing is written to disk first.
+
+A JSON index of where every file's bytes are in the archive is uploaded next
+to it, so single files can still be fetched with an HTTP range request. A
+compressed archive's index also lists its independently compressed chunks,
+so a file can be read by fetching just the chunks around it.
+"""
+import io
+import logging
+import os
+import tarfile
+from bisect import bisect_right
+
+from .dzfolder import ScandirFolder
+
+
+logger = logging.getLogger(__name__)
+
+
+INDEX_SUFFIX = ".index.json"
+"""Added to the archive's name to name its index"""
+
+
+class TarPlan(object):
+    """
+    The byte layout of a tar archive of local files: a list of segments that
+    are either bytes (headers and padding) or a range of a local file.
+    """
+
+    FILE_MODE = 0o644
+    """Permissions given to files in the archive"""
+
+    READ_BUFFER_SIZE = 1024 * 1024
+    """Read buffer of the streams handed to b2sdk"""
+
+    def __init__(self):
+        self.segments = []  # (archive offset, bytes or None, path, length)
+        self.members = []
+        self.size = 0
+        self._finished = False
+
+    @classmethod
+    def from_items(cls, items):
+        """
+        Plan an archive of dropped files and folders. Files go in under their
+        own name and folders under theirs, like a folder drop would upload
+        them.
+
+        :param items: paths of the dropped files and folders
+        :type items: list[str]
+        :rtype: TarPlan
+        """
+        plan = cls()
+        for item in items:
+            item = item.rstrip(os.sep)
+            base = os.path.basename(item)
+            if os.path.isdir(item):
+                for path in ScandirFolder(item).all_files(None):
+                    plan.add(path.absolute_path,
+                             base + "/" + path.relative_path,
+                             path.size, path.mod_time // 1000)
+            else:
+                stat = os.stat(item)
+                plan.add(item, base, stat.st_size, int(stat.st_mtime))
+        plan.finish()
+        return plan
+
+    def add(self, local_path, name, size, mtime):
+        """
+        :param local_path: the file whose bytes go into the archive
+        :type local_path: str
+        :param name: the file's name in the archive
+        :type name: str
+        :param size: the file's size
+        :type size: int
+        :param mtime: the file's modification time in seconds
+        :type mtime: int
+        """
+        assert not self._finished
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = mtime
+        info.mode = self.FILE_MODE
+        # PAX only adds an extended header for long or non-ASCII names
+        self._add_bytes(info.tobuf(tarfile.PAX_FORMAT, "utf-8",
+                                   "surrogateescape"))
+        self.members.append({"name": name, "offset": self.size,
+                             "size": size, "mtime": mtime})
+        self.segments.append((self.size, None, local_path, size))
+        self.size += size
+        self._add_bytes(bytes(-size % tarfile.BLOCKSIZE))
+
+    def finish(self):
+        """
+        Add the end-of-archive marker, padded to a full record like
+        ``tarfile`` does.
+        """
+        self._add_bytes(bytes(2 * tarfile.BLOCKSIZE))
+        self._add_bytes(bytes(-self.size % tarfile.RECORDSIZE))
+        self._finished = True
+
+    def index(self, archive_name, compressed=None):
+        """
+        :param archive_name: the archive's file name in B2
+        :type archive_name: str
+        :param compressed: what was uploaded if the archive was compressed
+        :type compressed: b2dz.dzcompress.CompressedUploadSource|None
+        :return: where every file's bytes are in the archive
+        :rtype: dict
+        """
+        index = {
+            "archive": archive_name,
+            "format": "tar",
+            "size": self.size,
+            "files": self.members,
+        }
+        if compressed is not None:
+            index["encoding"] = compressed.compressor.encoding
+            index["chunks"] = compressed.chunk_index()
+        return index
+
+    def open(self):
+        """
+        :return: a new seekable stream of the archive's bytes
+        :rtype: io.BufferedReader
+        """
+        assert self._finished
+        # b2sdk expects reads to be short only at the end of the stream,
+        # TarStream's are short at the end of every segment
+        return io.BufferedReader(TarStream(self), self.READ_BUFFER_SIZE)
+
+    def _add_bytes(self, data):
+        if data:
+            self.segments.append((self.size, data, None, len(data)))
+            self.size += len(data)
+
+
+class TarStream(io.RawIOBase):
+    """
+    Reads a ``TarPlan`` as one archive, opening the files it is made of as
+    it gets to them. b2sdk seeks in it to upload large file parts and to
+    retry.
+    """
+
+    def __init__(self, plan):
+        """
+        :type plan: TarPlan
+        """
+        super(TarStream, self).__init__()
+        self.plan = plan
+        self._offsets = [segment[0] for segment in plan.segments]
+        self._position = 0
+        self._file = None
+        self._file_path = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.plan.size
+        if offset < 0:
+            raise ValueError("negative seek position %d" % offset)
+        self._position = offset
+        return offset
+
+    def readinto(self, buffer):
+        if self._position >= self.plan.size or not len(buffer):
+            return 0
+        index = bisect_right(self._offsets, self._position) - 1
+        start, data, local_path, length = self.plan.segments[index]
+        skip = self._position - start
+        count = min(len(buffer), length - skip)
+        if data is not None:
+            buffer[:count] = data[skip:skip + count]
+        else:
+            f = self._open(local_path)
+            f.seek(skip)
+            read = f.readinto(memoryview(buffer)[:count])
+            if read < count:
+                raise ValueError("%s got shorter while it was being packed"
+                                 % local_path)
+        self._position += count
+        return count
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        super(TarStream, self).close()
+
+    def _open(self, local_path):
+        if self._file_path != local_path:
+            if self._file is not None:
+                self._file.close()
+            self._file = open(local_path, "rb")
+            self._file_path = local_path
+        return self._file
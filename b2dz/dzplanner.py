@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Chooses how big the parts of a large file should be and how many of those
+parts should be uploaded at the same time.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+
+MEGABYTE = 1000 * 1000
+
+MAX_SINGLE_UPLOAD_SIZE = 5 * 1000 * MEGABYTE
+"""B2 won't take a bigger file in one request"""
+
+
+class PartPlanner(object):
+    """
+    Picks a part size and number of parallel part uploads for each file from
+    its size, how many files are being uploaded alongside it and the
+    throughput measured during earlier drops. Either choice can be fixed by
+    the user instead.
+
+    This class is thread safe.
+    """
+
+    SINGLE_PART_FACTOR = 2
+    """
+    Files up to this many times the recommended part size are sent in one
+    request to avoid paying for starting and finishing a large file.
+    """
+
+    MAX_STREAMS = 16
+    """Most parts of one file that are uploaded at the same time"""
+
+    TARGET_PART_SECONDS = 15
+    """How long we would like each part upload to take"""
+
+    MIN_MEASURED_BYTES = 20 * MEGABYTE
+    """Uploading less than this says too little about the connection"""
+
+    MEASUREMENT_WEIGHT = 0.5
+    """How much a new throughput measurement counts against the old one"""
+
+    def __init__(self, recommended_part_size, minimum_part_size,
+                 upload_workers, throughput=None, part_size=None,
+                 part_streams=None):
+        """
+        :param recommended_part_size: what B2 recommended at authorization
+        :type recommended_part_size: int
+        :param minimum_part_size: the smallest part size B2 will accept
+        :type minimum_part_size: int
+        :param upload_workers: size of the b2sdk upload thread pool
+        :type upload_workers: int
+        :param throughput: bytes/second measured during earlier drops
+        :type throughput: int|None
+        :param part_size: a part size in bytes chosen by the user
+        :type part_size: int|None
+        :param part_streams: parallel parts per file chosen by the user
+        :type part_streams: int|None
+        """
+        self.recommended_part_size = recommended_part_size
+        self.minimum_part_size = minimum_part_size
+        self.upload_workers = upload_workers
+        self.throughput = throughput
+        self.fixed_part_size = part_size
+        self.fixed_part_streams = part_streams
+        self._active_files = 0
+        self._bytes_uploaded = 0
+        self._first_start = None
+        self._last_end = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def uploading(self, file_size):
+        """
+        Plan the upload of one file. Use as a context manager around the
+        upload so the planner knows how many files are in flight.
+
+        :param file_size: size of the file about to be uploaded
+        :type file_size: int
+        :return: (part size or None for b2sdk's default, parallel parts)
+        :rtype: tuple[int|None, int]
+        """
+        with self._lock:
+            self._active_files += 1
+            active_files = self._active_files
+            if self._first_start is None:
+                self._first_start = time.time()
+        try:
+            streams = self.part_streams(active_files)
+            yield self.part_size(file_size, streams), streams
+            with self._lock:
+                self._bytes_uploaded += file_size
+                self._last_end = time.time()
+        finally:
+            with self._lock:
+                self._active_files -= 1
+
+    def measured_throughput(self):
+        """
+        The throughput seen by the uploads planned so far, blended with the
+        one measured during earlier drops.
+
+        :return: bytes per second or None if too little was uploaded to tell
+        :rtype: int|None
+        """
+        with self._lock:
+            if self._bytes_uploaded < self.MIN_MEASURED_BYTES:
+                return None
+            elapsed = self._last_end - self._first_start
+            measured = self._bytes_uploaded / max(elapsed, 0.001)
+        if self.throughput:
+            measured = (self.MEASUREMENT_WEIGHT * measured +
+                        (1 - self.MEASUREMENT_WEIGHT) * self.throughput)
+        return int(measured)
+
+    @property
+    def large_file_size(self):
+        """
+        :return: files bigger than this are uploaded in parts
+        :rtype: int
+        """
+        if self.fixed_part_size:
+            return max(self.fixed_part_size, self.minimum_part_size)
+        return min(self.recommended_part_size * self.SINGLE_PART_FACTOR,
+                   MAX_SINGLE_UPLOAD_SIZE)
+
+    def part_streams(self, active_files):
+        """
+        Split the upload thread pool between the files being uploaded.
+
+        :param active_files: how many files are being uploaded right now
+        :type active_files: int
+        :rtype: int
+        """
+        if self.fixed_part_streams:
+            return self.fixed_part_streams
+        streams = self.upload_workers // max(1, active_files)
+        return max(1, min(self.MAX_STREAMS, streams))
+
+    def part_size(self, file_size, streams):
+        """
+        :param file_size: size of the file about to be uploaded
+        :type file_size: int
+        :param streams: how many of its parts will be uploaded at once
+        :type streams: int
+        :return: the part size to use or None to let b2sdk decide
+        :rtype: int|None
+        """
+        if self.fixed_part_size:
+            return max(self.fixed_part_size, self.minimum_part_size)
+        if file_size <= self.recommended_part_size:
+            return None  # a small file, b2sdk sends it in one go anyway
+        if file_size <= min(self.recommended_part_size * self.SINGLE_PART_FACTOR,
+                            MAX_SINGLE_UPLOAD_SIZE):
+            return file_size
+
+        part_size = self.recommended_part_size
+        if self.throughput:
+            # big enough that each part takes about TARGET_PART_SECONDS
+            per_stream = self.throughput / max(1, self.upload_workers)
+            part_size = int(per_stream * self.TARGET_PART_SECONDS)
+        # enough parts to keep every stream busy at least twice over
+        part_size = min(part_size, file_size // (streams * 2))
+        return int(min(max(part_size, self.minimum_part_size),
+                       MAX_SINGLE_UPLOAD_SIZE))
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Transfer profiles: named sets of upload settings that are picked by holding
+a modifier key while dropping, i.e. holding Control to upload in the
+background with a bandwidth cap.
+"""
+import logging
+import re
+
+from .dzschedule import ORDERS
+
+
+logger = logging.getLogger(__name__)
+
+
+MODIFIERS = ("Command", "Option", "Control", "Shift")
+"""The modifier keys Dropzone tells us about"""
+
+ENCODINGS = ("gzip", "zstd")
+"""Content encodings a ``b2dz.dzcompress.Compressor`` can produce"""
+
+COMPARE_MODES = ("modtime", "size", "none", "blind")
+"""How a profile's drops decide that a file is already in B2, "blind" doesn't
+even list the destination"""
+
+DEFAULT_PROFILES = (
+    "max throughput: workers=16 part_size=200 part_streams=8 order=largest; "
+    "background: workers=2 part_streams=1 rate_limit=500; "
+    "archive: pack compress=gzip; "
+    "skip compare: compare=blind"
+)
+"""Profiles every user starts with"""
+
+DEFAULT_MODIFIER_PROFILES = {
+    "Command": "max throughput",
+    "Option": "archive",
+    "Control": "background",
+    "Shift": "skip compare",
+}
+"""Which profile each modifier key picks until the user says otherwise"""
+
+
+class TransferProfile(object):
+    """
+    Settings that override the configuration for one drop. A setting that is
+    None keeps the configured value.
+    """
+
+    NUMBERS = ("workers", "part_size", "part_streams", "rate_limit")
+    """Settings that are whole numbers, sizes in MB and limits in KB/s"""
+
+    def __init__(self, name, workers=None, part_size=None, part_streams=None,
+                 rate_limit=None, compress=None, compare=None, order=None,
+                 pack=False):
+        """
+        :param name: what the user calls the profile
+        :type name: str
+        :param workers: files at once
+        :type workers: int|None
+        :param part_size: large file part size in MB
+        :type part_size: int|None
+        :param part_streams: parallel parts per file
+        :type part_streams: int|None
+        :param rate_limit: upload limit in KB/s
+        :type rate_limit: int|None
+        :param compress: "gzip", "zstd" or "none" to turn compression off
+        :type compress: str|None
+        :param compare: one of ``COMPARE_MODES``
+        :type compare: str|None
+        :param order: which files go first, one of ``ORDERS``
+        :type order: str|None
+        :param pack: True to upload the drop as one archive
+        :type pack: bool
+        """
+        self.name = name
+        self.workers = workers
+        self.part_size = part_size
+        self.part_streams = part_streams
+        self.rate_limit = rate_limit
+        self.compress = compress
+        self.compare = compare
+        self.order = order
+        self.pack = pack
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, str(self))
+
+    def __str__(self):
+        settings = ["pack"] if self.pack else []
+        for setting in self.NUMBERS + ("compress", "compare", "order"):
+            value = getattr(self, setting)
+            if value is not None:
+                settings.append("%s=%s" % (setting, value))
+        return "%s: %s" % (self.name, " ".join(settings))
+
+    def __eq__(self, other):
+        return isinstance(other, TransferProfile) and str(self) == str(other)
+
+    def __hash__(self):
+        return hash(str(self))
+
+    @classmethod
+    def parse(cls, text):
+        """
+        :param text: a name, a colon and space or comma separated settings,
+                     i.e. ``background: workers=2 rate_limit=500``
+        :type text: str
+        :rtype: TransferProfile
+        :raises ValueError: if the profile can't be understood
+        """
+        name, colon, settings = text.partition(":")
+        name = " ".join(name.split())
+        if not colon or not name:
+            raise ValueError("Can't understand the profile '%s'. Use "
+                             "something like background: workers=2."
+                             % text.strip())
+        profile = cls(name)
+        for setting in re.split(r"[\s,]+", settings.strip()):
+            if setting:
+                profile._set(setting)
+        return profile
+
+    def _set(self, setting):
+        key, equals, value = setting.partition("=")
+        key = key.strip().lower()
+        value = value.strip().lower()
+        if key == "pack":
+            if equals and value not in ("yes", "no"):
+                raise ValueError("pack should be yes or no.")
+            self.pack = value != "no"
+        elif key in self.NUMBERS and value.isdigit() and int(value) > 0:
+            setattr(self, key, int(value))
+        elif key == "compress" and value in ENCODINGS + ("none",):
+            self.compress = value
+        elif key == "compare" and value in COMPARE_MODES:
+            self.compare = value
+        elif key == "order" and value in ORDERS:
+            self.order = value
+        else:
+            raise ValueError("Can't understand '%s' in the profile '%s'."
+                             % (setting, self.name))
+
+
+class TransferProfiles(object):
+    """
+    All of the user's profiles, written like
+    ``background: workers=2 rate_limit=500; archive: pack compress=gzip``.
+    """
+
+    def __init__(self, profiles=()):
+        """
+        :type profiles: list[TransferProfile]
+        """
+        self._profiles = {}
+        for profile in profiles:
+            self._profiles[profile.name] = profile
+
+    def __str__(self):
+        return "; ".join(str(p) for p in self._profiles.values())
+
+    def __iter__(self):
+        return iter(self._profiles.values())
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def __contains__(self, name):
+        return name in self._profiles
+
+    @classmethod
+    def parse(cls, text):
+        """
+        :param text: semicolon separated profiles, may be empty
+        :type text: str|None
+        :rtype: TransferProfiles
+        :raises ValueError: if a profile can't be understood
+        """
+        return cls(TransferProfile.parse(part)
+                   for part in (text or "").split(";") if part.strip())
+
+    @property
+    def names(self):
+        """
+        :rtype: list[str]
+        """
+        return list(self._profiles)
+
+    def get(self, name):
+        """
+        :return: the profile called ``name`` or None if there isn't one
+        :rtype: TransferProfile|None
+        """
+        return self._profiles.get(name)
@@ -1,61 +1,416 @@
 # -*- coding: utf-8 -*-
 """
 A b2sdk SyncReport implementation that adds Dropzone error notifications and
-progress percentage.
+progress percentage. One report can cover several folders being synced at
+once. Single uploads outside of a sync report through a progress listener.
 """
+import collections
+import logging
 import sys
+import threading
 import time
 
 import dropzone as dz
 from b2sdk.sync.report import SyncReport
+from b2sdk.utils import format_and_scale_number
+from b2sdk.v2 import AbstractProgressListener
+from .dzfuncs import humanize_duration
+
+
+logger = logging.getLogger(__name__)
+
+
+class ThreadCounters(object):
+    """
+    Counters that every thread adds to without taking a lock. Each thread
+    gets a slot of its own, the only one it writes to, and ``totals`` adds
+    the slots up. A total may miss an addition made while it was being read,
+    the next one includes it.
+    """
+
+    def __init__(self, size):
+        """
+        :param size: how many counters there are
+        :type size: int
+        """
+        self.size = size
+        self._local = threading.local()
+        self._slots = []
+        self._lock = threading.Lock()  # only when a thread first counts
+
+    def add(self, index, delta):
+        """
+        :param index: which counter
+        :type index: int
+        :type delta: int
+        """
+        try:
+            slot = self._local.slot
+        except AttributeError:
+            slot = self._local.slot = [0] * self.size
+            with self._lock:
+                self._slots.append(slot)
+        slot[index] += delta
+
+    def totals(self):
+        """
+        :rtype: list[int]
+        """
+        with self._lock:
+            slots = list(self._slots)
+        return [sum(slot[i] for slot in slots) for i in range(self.size)]
+
+
+class ThroughputEstimator(object):
+    """
+    Upload speed and time left. The speed over the last ``window`` seconds
+    is smoothed with an exponentially weighted moving average whose weight
+    follows the time between samples, so it doesn't matter how often it is
+    updated.
+    """
+
+    WINDOW = 30
+    """Seconds of samples the raw speed is measured over"""
+
+    HALF_LIFE = 10
+    """Seconds after which an old speed counts half as much"""
+
+    STALL_TIME = 30
+    """Seconds without progress after which a transfer counts as stalled"""
+
+    def __init__(self, window=WINDOW, half_life=HALF_LIFE, clock=time.monotonic):
+        """
+        :param window: seconds to measure the raw speed over
+        :type window: int|float
+        :param half_life: seconds for the average to forget half of a speed
+        :type half_life: int|float
+        :param clock: returns seconds, only differences are used
+        :type clock: callable
+        """
+        self.window = window
+        self.half_life = half_life
+        self.total_bytes = 0
+        self._clock = clock
+        self._start = clock()
+        self._last_progress = self._start
+        self._samples = collections.deque()  # (time, total bytes)
+        self._rate = None
+
+    def update(self, total_bytes):
+        """
+        :param total_bytes: bytes sent so far
+        :type total_bytes: int
+        """
+        now = self._clock()
+        if total_bytes > self.total_bytes:
+            self._last_progress = now
+        self.total_bytes = total_bytes
+        samples = self._samples
+        if samples and now <= samples[-1][0]:
+            return
+        samples.append((now, total_bytes))
+        while len(samples) > 2 and samples[1][0] <= now - self.window:
+            samples.popleft()
+        if len(samples) < 2:
+            return
+        (first_time, first_bytes), (previous_time, _) = samples[0], samples[-2]
+        windowed = (total_bytes - first_bytes) / (now - first_time)
+        if self._rate is None:
+            self._rate = windowed
+        else:
+            weight = 1 - 0.5 ** ((now - previous_time) / self.half_life)
+            self._rate += weight * (windowed - self._rate)
+
+    @property
+    def rate(self):
+        """
+        :return: bytes per second, None until there are two samples
+        :rtype: float|None
+        """
+        return self._rate
+
+    @property
+    def elapsed(self):
+        """
+        :rtype: float
+        """
+        return self._clock() - self._start
+
+    @property
+    def stalled_for(self):
+        """
+        :return: seconds without progress, 0 if that isn't ``STALL_TIME``
+                 yet
+        :rtype: float
+        """
+        idle = self._clock() - self._last_progress
+        return idle if idle >= self.STALL_TIME else 0
+
+    def eta(self, remaining_bytes):
+        """
+        :param remaining_bytes: bytes still to send
+        :type remaining_bytes: int
+        :return: seconds left at the current speed or None if unknown
+        :rtype: float|None
+        """
+        if not self._rate or self._rate <= 0:
+            return None
+        return max(0, remaining_bytes) / self._rate
+
+    def label(self, remaining_bytes=None):
+        """
+        :param remaining_bytes: bytes still to send, None if not known yet
+        :type remaining_bytes: int|None
+        :return: the speed and time left for people, or None if too little
+                 is known yet
+        :rtype: str|None
+        """
+        if not self.total_bytes or self._rate is None:
+            return None  # still scanning and comparing
+        if self.stalled_for:
+            return "Uploading... nothing sent for %s" % \
+                humanize_duration(self.stalled_for)
+        label = "Uploading at %s" % format_and_scale_number(self._rate, "B/s")
+        eta = self.eta(remaining_bytes) if remaining_bytes is not None else None
+        if eta is None:
+            return label + "..."
+        if eta < 10:
+            return label + ", almost done"
+        return label + ", about %s left" % humanize_duration(eta)
+
+    def summary(self):
+        """
+        :return: what was sent, how long it took and how fast, for people
+        :rtype: str
+        """
+        elapsed = self.elapsed
+        if not self.total_bytes:
+            return "Nothing new to upload."
+        summary = "Uploaded %s" % format_and_scale_number(self.total_bytes,
+                                                         "B")
+        if elapsed < 10:
+            return summary + " instantly."
+        return summary + " in %s at %s." % (
+            humanize_duration(elapsed),
+            format_and_scale_number(self.total_bytes / elapsed, "B/s"))
 
 
 class DropzoneSyncReport(SyncReport):
+    """
+    Transfer threads only add to ``ThreadCounters`` and queue their
+    messages. A reporter thread of its own samples the counters every
+    ``SAMPLE_INTERVAL`` (and as soon as counting ends), prints the queued
+    messages and the status line and tells Dropzone the percentage when its
+    whole number changes, so no transfer thread waits on a lock or on
+    stdout. The speed and time left go in Dropzone's label.
+    """
+
     UPDATE_INTERVAL = 1
     """Minimum time between progress updates"""
 
-    def __init__(self, stdout=sys.stdout, no_progress=False):
+    SAMPLE_INTERVAL = 0.25
+    """Seconds between looks at the counters"""
+
+    LABEL_INTERVAL = 5
+    """Minimum time between changes of Dropzone's label"""
+
+    # what ThreadCounters count
+    _TOTAL, _COMPARE, _TRANSFER_FILES, _TRANSFER_BYTES = range(4)
+
+    def __init__(self, stdout=sys.stdout, no_progress=False, sources=1,
+                 telemetry=None, estimator=None, bytes_listener=None):
+        """
+        :param sources: how many source folders will report into this object.
+                        Counting and comparing are only done once every
+                        source has finished them.
+        :type sources: int
+        :param telemetry: told when scanning, comparing and transferring end
+        :type telemetry: b2dz.dztelemetry.DropTelemetry|None
+        :param estimator: fed the bytes transferred, a new one by default
+        :type estimator: ThroughputEstimator|None
+        :param bytes_listener: called from the reporter thread with the bytes
+                               transferred since it was last called, while
+                               the transfers are still running
+        :type bytes_listener: callable|None
+        """
         self._determinate = False
+        self._percent = None
+        self.estimator = estimator or ThroughputEstimator()
+        self._label = None
+        self._label_time = None
+        self.sources = sources
+        self.telemetry = telemetry
+        self.bytes_listener = bytes_listener
+        self._listened_bytes = 0
+        self._sources_totaled = 0
+        self._sources_compared = 0
+        self._compare_transfer_files = 0
+        self._compare_transfer_bytes = 0
+        self._counters = ThreadCounters(4)
+        self._messages = collections.deque()
+        self._stopped = threading.Event()
+        self._wake = threading.Event()
         super(DropzoneSyncReport, self).__init__(stdout, no_progress)
+        self._reporter = threading.Thread(target=self._run,
+                                          name="sync-report", daemon=True)
+        self._reporter.start()
 
     def close(self):
+        self._stopped.set()
+        self._wake.set()
+        self._reporter.join()
+        self._sample()  # the final numbers
         super(DropzoneSyncReport, self).close()
+        if self.telemetry is not None:
+            self.telemetry.end_phase("transfer")
         if self.warnings:
             dz.alert("Transferred with Warnings:", "\n".join(self.warnings))
 
+    def update_total(self, delta):
+        self._counters.add(self._TOTAL, delta)
+
+    def end_total(self):
+        with self.lock:
+            self._sources_totaled += 1
+            if self._sources_totaled < self.sources:
+                return
+        if self.telemetry is not None:
+            self.telemetry.end_phase("scan")
+        with self.lock:
+            # the total has to be in before total_done is set
+            self.total_count = self._counters.totals()[self._TOTAL]
+        super(DropzoneSyncReport, self).end_total()
+        self._wake.set()  # show the percentage without waiting
+
+    def update_compare(self, delta):
+        self._counters.add(self._COMPARE, delta)
+
+    def end_compare(self, total_transfer_files, total_transfer_bytes):
+        with self.lock:
+            self._sources_compared += 1
+            self._compare_transfer_files += total_transfer_files
+            self._compare_transfer_bytes += total_transfer_bytes
+            if self._sources_compared < self.sources:
+                return
+            total_transfer_files = self._compare_transfer_files
+            total_transfer_bytes = self._compare_transfer_bytes
+        if self.telemetry is not None:
+            self.telemetry.end_phase("compare")
+        super(DropzoneSyncReport, self).end_compare(total_transfer_files,
+                                                    total_transfer_bytes)
+
+    def update_transfer(self, file_delta, byte_delta):
+        self._counters.add(self._TRANSFER_FILES, file_delta)
+        self._counters.add(self._TRANSFER_BYTES, byte_delta)
+
+    def print_completion(self, message):
+        self._messages.append(message)  # the reporter thread prints it
+
     def error(self, message):
         super(DropzoneSyncReport, self).error(message)
         dz.alert("Upload Error", message)
 
     def _update_progress(self):
-        if self.closed or self.no_progress:
-            return
-
-        # don't bother updating more frequently than UPDATE_INTERVAL
-        now = time.time()
-        interval = now - self._last_update_time
+        pass  # only the reporter thread updates progress, in _sample
 
-        if self.UPDATE_INTERVAL > interval:
-            return
-
-        super(DropzoneSyncReport, self)._update_progress()
+    def _run(self):
+        while True:
+            self._wake.wait(self.SAMPLE_INTERVAL)
+            self._wake.clear()
+            if self._stopped.is_set():
+                return
+            try:
+                self._sample()
+            except Exception:
+                logger.exception("Could not report progress")
 
-        try:
+    def _sample(self):
+        with self.lock:
+            # taken under the lock, end_total may be setting the total
+            total, compared, files, transferred = self._counters.totals()
+            self.total_count = total
+            self.compare_count = compared
+            self.transfer_files = files
+            self.transfer_bytes = transferred
+            new_bytes = transferred - self._listened_bytes
+            self._listened_bytes = transferred
+            if self.bytes_listener is not None and new_bytes > 0:
+                self.bytes_listener(new_bytes)
+            if self.closed or self.no_progress:
+                return
+            while self._messages:
+                self._print_line(self._messages.popleft(), True)
+                self._last_update_time = 0
+            super(DropzoneSyncReport, self)._update_progress()
+            self.estimator.update(transferred)
+            remaining = None
+            if self.compare_done:
+                remaining = self.total_transfer_bytes - transferred
+            label = self.estimator.label(remaining)
             if not self.total_done:
-                if self._determinate:
-                    self._determinate = False
-                    dz.determinate(False)
+                determinate, percent = False, None
             elif not self.compare_done:
-                if not self._determinate:
-                    dz.determinate(True)
-                    self._determinate = True
-                percent = (self.compare_count / self.total_count) * 100
-                dz.percent(percent)
+                determinate = True
+                percent = compared * 100 // total if total else None
             else:
-                if not self._determinate:
-                    dz.determinate(True)
-                    self._determinate = True
-                percent = (self.transfer_bytes / self.total_transfer_bytes) * 100
-                dz.percent(percent)
-        except ZeroDivisionError:
-            pass
+                determinate = True
+                percent = transferred * 100 // self.total_transfer_bytes \
+                    if self.total_transfer_bytes else None
+        if determinate != self._determinate:
+            self._determinate = determinate
+            dz.determinate(determinate)
+        if percent is not None and percent != self._percent:
+            self._percent = percent
+            dz.percent(percent)
+        self._show_label(label)
+
+    def _show_label(self, label):
+        now = time.monotonic()
+        if label is None or label == self._label or (
+                self._label_time is not None and
+                now - self._label_time < self.LABEL_INTERVAL):
+            return
+        self._label = label
+        self._label_time = now
+        dz.begin(label)
+
+
+class DropzoneProgressListener(AbstractProgressListener):
+    """
+    Shows the progress of one upload in Dropzone.
+    """
+
+    UPDATE_INTERVAL = 1
+    """Minimum time between progress updates"""
+
+    LABEL_INTERVAL = 5
+    """Minimum time between changes of Dropzone's label"""
+
+    def __init__(self, estimator=None):
+        """
+        :param estimator: fed the bytes sent, a new one by default
+        :type estimator: ThroughputEstimator|None
+        """
+        super(DropzoneProgressListener, self).__init__()
+        self.estimator = estimator or ThroughputEstimator()
+        self._total_bytes = 0
+        self._last_update_time = 0
+        self._last_label_time = 0
+
+    def set_total_bytes(self, total_byte_count):
+        self._total_bytes = total_byte_count
+        dz.determinate(True)
+
+    def bytes_completed(self, byte_count):
+        now = time.time()
+        if not self._total_bytes or \
+                now - self._last_update_time < self.UPDATE_INTERVAL:
+            return
+        self._last_update_time = now
+        dz.percent(byte_count / self._total_bytes * 100)
+        self.estimator.update(byte_count)
+        label = self.estimator.label(self._total_bytes - byte_count)
+        if label is not None and \
+                now - self._last_label_time >= self.LABEL_INTERVAL:
+            self._last_label_time = now
+            dz.begin(label)
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+A journal of large files that are being uploaded, so that a drop which was
+killed halfway (Dropzone quit, the laptop went to sleep) carries on from the
+parts B2 already has the next time the same file is dropped.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class ResumeJournal(object):
+    """
+    Remembers which B2 large file (and which part size) every unfinished
+    upload of a local file went into. Which of its parts made it is asked of
+    B2 when the upload is resumed.
+
+    Every method that drops an upload that didn't finish returns the IDs of
+    the large files it dropped, so they can be cancelled instead of being
+    left in the bucket.
+
+    This class is thread safe.
+    """
+
+    MAX_AGE = 7 * 24 * 60 * 60
+    """Seconds after which an unfinished upload isn't worth resuming"""
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS uploads (
+        bucket_id TEXT NOT NULL,
+        file_name TEXT NOT NULL,
+        file_id TEXT NOT NULL,
+        dev INTEGER NOT NULL,
+        inode INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        mod_time INTEGER NOT NULL,
+        part_size INTEGER NOT NULL,
+        started_at REAL NOT NULL,
+        PRIMARY KEY (bucket_id, file_name)
+    );
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: path to the SQLite database (created if missing)
+        :type filename: str
+        """
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(filename, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self._SCHEMA)
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.filename)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def clear(self):
+        """
+        Stop resuming every unfinished upload. They are kept until the next
+        ``expire`` so their large files can still be cancelled.
+        """
+        with self._lock:
+            self._conn.execute("UPDATE uploads SET started_at = 0")
+
+    def find(self, bucket_id, file_name, local_path):
+        """
+        The unfinished upload of ``local_path`` to ``file_name``, if there is
+        one and the local file hasn't changed since it was started.
+
+        :return: (large file ID, part size) or None
+        :rtype: tuple[str, int]|None
+        """
+        stat = os.stat(local_path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_id, part_size FROM uploads WHERE bucket_id = ? "
+                "AND file_name = ? AND dev = ? AND inode = ? AND size = ? "
+                "AND mod_time = ? AND started_at >= ?",
+                (bucket_id, file_name) + self._key(stat) +
+                (time.time() - self.MAX_AGE,)).fetchone()
+        return tuple(row) if row else None
+
+    def start(self, bucket_id, file_name, local_path, part_size, file_id):
+        """
+        Remember that ``local_path`` is being uploaded as large file
+        ``file_id``. Replaces any older upload to the same name.
+
+        :return: the IDs of the large files of the uploads it replaced
+        :rtype: list[str]
+        """
+        stat = os.stat(local_path)
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            replaced = self._delete(bucket_id, file_name, keep_file_id=file_id)
+            self._conn.execute(
+                "INSERT OR IGNORE INTO uploads VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (bucket_id, file_name, file_id) + self._key(stat) +
+                (part_size, time.time()))
+        return replaced
+
+    def finish(self, bucket_id, file_name):
+        """
+        Forget the upload to ``file_name``, it finished or B2 no longer has
+        it.
+        """
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._delete(bucket_id, file_name)
+
+    def abandon(self, bucket_id, file_name):
+        """
+        Forget the upload to ``file_name`` because it can't be resumed.
+
+        :return: the IDs of the large files it went into
+        :rtype: list[str]
+        """
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            return self._delete(bucket_id, file_name)
+
+    def expire(self):
+        """
+        Forget the uploads that were started more than ``MAX_AGE`` ago.
+
+        :return: the IDs of their large files
+        :rtype: list[str]
+        """
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            cutoff = time.time() - self.MAX_AGE
+            file_ids = [row[0] for row in self._conn.execute(
+                "SELECT file_id FROM uploads WHERE started_at < ?",
+                (cutoff,))]
+            self._conn.execute("DELETE FROM uploads WHERE started_at < ?",
+                               (cutoff,))
+        return file_ids
+
+    def _delete(self, bucket_id, file_name, keep_file_id=None):
+        """
+        :return: the IDs of the large files of the deleted uploads
+        :rtype: list[str]
+        """
+        where = "bucket_id = ? AND file_name = ? AND file_id != ?"
+        params = (bucket_id, file_name, keep_file_id or "")
+        file_ids = [row[0] for row in self._conn.execute(
+            "SELECT file_id FROM uploads WHERE " + where, params)]
+        self._conn.execute("DELETE FROM uploads WHERE " + where, params)
+        return file_ids
+
+    @staticmethod
+    def _key(stat):
+        return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
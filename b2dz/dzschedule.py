@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Decides which of the transfers waiting in a drop goes next, so a small file
+the user needs right away isn't queued behind gigabytes of video.
+"""
+import heapq
+import itertools
+import logging
+import threading
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+
+ORDERS = {
+    "smallest": lambda size, rank, seq: (size, rank, seq),
+    "largest": lambda size, rank, seq: (-size, rank, seq),
+    "dropped": lambda size, rank, seq: (rank, seq),
+}
+"""
+How each policy sorts the waiting transfers. Smallest first gets the first
+URL ready soonest, largest first keeps the connection busiest and dropped
+keeps the order the items were dropped in.
+"""
+
+DEFAULT_ORDER = "smallest"
+"""The order used unless the config or a profile picks another"""
+
+SMALL_FILE_SHARE = 0.25
+"""Part of the running transfers that is always left to small files"""
+
+
+def large_lane_size(workers):
+    """
+    :param workers: how many transfers may run at the same time
+    :type workers: int
+    :return: how many of them may be large files or their parts
+    :rtype: int
+    """
+    return max(1, workers - max(1, int(workers * SMALL_FILE_SHARE)))
+
+
+class TransferScheduler(object):
+    """
+    A priority queue of the transfers of one drop, in two lanes. Files
+    bigger than ``large_size`` go in the large lane, which may only use
+    ``large_lane_size`` of the running transfers, so small files can always
+    get past a big one.
+
+    Transfers are pushed while the folders are still being compared and are
+    taken when a worker is free, so the order covers everything that is
+    waiting at that moment.
+
+    This class is thread safe.
+    """
+
+    def __init__(self, order=DEFAULT_ORDER, large_size=None, workers=None):
+        """
+        :param order: one of ``ORDERS``
+        :type order: str
+        :param large_size: files bigger than this are uploaded in parts, None
+                           to put every file in one lane
+        :type large_size: int|None
+        :param workers: returns how many transfers may run at the same time,
+                        which may change during the drop
+        :type workers: callable
+        """
+        self.order = order
+        self.large_size = large_size
+        self._key = ORDERS[order]
+        self._workers = workers
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._small = []
+        self._large = []
+        self._large_running = 0
+
+    def __repr__(self):
+        return "<%s %s small=%d large=%d>" % (
+            self.__class__.__name__, self.order, len(self._small),
+            len(self._large))
+
+    def push(self, size, rank, item):
+        """
+        :param size: bytes the transfer moves
+        :type size: int
+        :param rank: position of the dropped item it belongs to
+        :type rank: int
+        :param item: what ``take`` hands out
+        """
+        seq = next(self._seq)
+        large = self.large_size is not None and size > self.large_size
+        with self._cond:
+            heapq.heappush(self._large if large else self._small,
+                           (self._key(size, rank, seq), seq, item))
+            self._cond.notify()
+
+    @contextmanager
+    def take(self):
+        """
+        Wait for the transfer that should go next and keep its lane busy for
+        the duration of the ``with`` block. Call once for every ``push``.
+        """
+        with self._cond:
+            while True:
+                large = self._next_lane()
+                if large is not None:
+                    break
+                self._cond.wait()
+            _, _, item = heapq.heappop(self._large if large else self._small)
+            if large:
+                self._large_running += 1
+        try:
+            yield item
+        finally:
+            if large:
+                with self._cond:
+                    self._large_running -= 1
+                    self._cond.notify_all()
+
+    def _next_lane(self):
+        """
+        :return: True for the large lane, False for the small one, None if
+                 nothing can go right now
+        :rtype: bool|None
+        """
+        large_open = self._large and (
+            self._workers is None or
+            self._large_running < large_lane_size(self._workers()))
+        if not large_open:
+            return False if self._small else None
+        if not self._small:
+            return True
+        return self._large[0] < self._small[0]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+Locations on disk where b2dz can keep state between drops.
+"""
+import os
+
+
+FALLBACK_SUPPORT_FOLDER = os.path.join("~", ".b2dz")
+"""Used when we are not being run by Dropzone (i.e. from a terminal)"""
+
+
+def support_folder():
+    """
+    The folder Dropzone gives each action for storing its own files. The
+    folder is created if it does not exist yet.
+
+    :return: an absolute path to a folder we can write to
+    :rtype: str
+    """
+    folder = os.environ.get("support_folder")
+    if not folder:
+        folder = os.path.expanduser(FALLBACK_SUPPORT_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def support_path(filename):
+    """
+    :param filename: the name of a file to keep in the support folder
+    :type filename: str
+    :return: the absolute path to ``filename`` inside the support folder
+    :rtype: str
+    """
+    return os.path.join(support_folder(), filename)
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+A b2sdk Synchronizer that can sync several source/destination folder pairs
+at once through a single pool of transfer threads.
+"""
+import concurrent.futures as futures
+import logging
+
+from b2sdk.bounded_queue_executor import BoundedQueueExecutor
+from b2sdk.sync.action import B2UploadAction
+from b2sdk.sync.encryption_provider import \
+    SERVER_DEFAULT_SYNC_ENCRYPTION_SETTINGS_PROVIDER
+from b2sdk.sync.exception import IncompleteSync
+from b2sdk.sync.sync import Synchronizer, count_files
+
+
+logger = logging.getLogger(__name__)
+
+
+class DropzoneSynchronizer(Synchronizer):
+    """
+    Adds ``sync_many`` which lists every folder pair at the same time and
+    feeds all of their transfers into one shared executor, so dropping many
+    small folders doesn't drain and refill the thread pool once per folder.
+
+    If a ``ConcurrencyController`` is given, ``max_workers`` only sizes the
+    thread pool and the controller decides how many transfers actually run.
+    The controller has to be fed the bytes transferred, see the
+    ``bytes_listener`` of ``b2dz.dzprogress.DropzoneSyncReport``.
+    If a ``TransferScheduler`` is given, it decides which transfer runs next
+    instead of the order the folders were listed in. If an
+    ``AsyncUploadEngine`` is given, the small file uploads it accepts go
+    through it instead of the thread pool. If a ``HashAhead`` is given, the
+    files that will be checked for copies already in the bucket start
+    hashing as soon as their uploads are scheduled.
+    """
+
+    def __init__(self, max_workers, controller=None, scheduler=None,
+                 async_engine=None, hash_ahead=None, **kwargs):
+        """
+        :param max_workers: size of the transfer thread pool
+        :type max_workers: int
+        :param controller: limits how many transfers run at the same time
+        :type controller: b2dz.dzconcurrency.ConcurrencyController|None
+        :param scheduler: orders the transfers waiting for a worker
+        :type scheduler: b2dz.dzschedule.TransferScheduler|None
+        :param async_engine: uploads small files without a thread each
+        :type async_engine: b2dz.dzasync.AsyncUploadEngine|None
+        :param hash_ahead: hashes upload sources before their uploads need
+                           it, closed when ``sync_many`` is done
+        :type hash_ahead: b2dz.dzhash.HashAhead|None
+        """
+        super(DropzoneSynchronizer, self).__init__(max_workers, **kwargs)
+        self.controller = controller
+        self.scheduler = scheduler
+        self.async_engine = async_engine
+        self.hash_ahead = hash_ahead
+
+    def sync_many(self, folder_pairs, now_millis, reporter,
+                  encryption_settings_provider=
+                  SERVER_DEFAULT_SYNC_ENCRYPTION_SETTINGS_PROVIDER):
+        """
+        Sync several (source, destination) folder pairs as one job.
+
+        :param folder_pairs: the folders to sync
+        :type folder_pairs: list[tuple[b2sdk.sync.folder.AbstractFolder,b2sdk.sync.folder.AbstractFolder]]
+        :param now_millis: current time in milliseconds
+        :type now_millis: int
+        :param reporter: a progress reporter expecting ``len(folder_pairs)``
+                         sources
+        :type reporter: b2dz.dzprogress.DropzoneSyncReport
+        """
+        if not folder_pairs:
+            return
+
+        for source_folder, dest_folder in folder_pairs:
+            self._check_folder_pair(source_folder, dest_folder)
+
+        # same layout as Synchronizer.sync_folders, but shared by every pair
+        unbounded_executor = futures.ThreadPoolExecutor(
+            max_workers=self.max_workers)
+        queue_limit = self.max_workers + 1000
+        sync_executor = BoundedQueueExecutor(unbounded_executor,
+                                             queue_limit=queue_limit)
+
+        for source_folder, _ in folder_pairs:
+            if source_folder.folder_type() == "local" and reporter is not None:
+                sync_executor.submit(count_files, source_folder, reporter,
+                                     self.policies_manager)
+
+        if self.async_engine is not None:
+            self.async_engine.start()
+        try:
+            # One thread per pair to do the listing and comparing. These only
+            # schedule work, so they must not share a pool with the transfers.
+            with futures.ThreadPoolExecutor(
+                    max_workers=len(folder_pairs)) as listers:
+                scheduling = [
+                    listers.submit(self._schedule_folder_actions,
+                                   sync_executor, source_folder, dest_folder,
+                                   now_millis, reporter,
+                                   encryption_settings_provider, rank)
+                    for rank, (source_folder, dest_folder)
+                    in enumerate(folder_pairs)
+                ]
+            listing_errors = [f.exception() for f in scheduling
+                              if f.exception()]
+            sync_executor.shutdown()
+        finally:
+            if self.hash_ahead is not None:
+                self.hash_ahead.close()
+            async_failures = 0
+            if self.async_engine is not None:
+                async_failures = self.async_engine.close()
+
+        if listing_errors:
+            raise listing_errors[0]
+        if sync_executor.get_num_exceptions() != 0 or async_failures:
+            raise IncompleteSync("sync is incomplete")
+
+    def _check_folder_pair(self, source_folder, dest_folder):
+        source_type = source_folder.folder_type()
+        dest_type = dest_folder.folder_type()
+        if source_type != "b2" and dest_type != "b2":
+            raise ValueError("Sync between two local folders is not supported!")
+        if dest_type == "local" and not self.dry_run:
+            dest_folder.ensure_present()
+        if source_type == "local" and not self.allow_empty_source:
+            source_folder.ensure_non_empty()
+
+    def _schedule_folder_actions(self, sync_executor, source_folder,
+                                 dest_folder, now_millis, reporter,
+                                 encryption_settings_provider, rank=0):
+        if dest_folder.folder_type() == "b2":
+            action_bucket = dest_folder.bucket
+        else:
+            action_bucket = source_folder.bucket
+
+        for action in self._make_folder_sync_actions(
+                source_folder, dest_folder, now_millis, reporter,
+                self.policies_manager, encryption_settings_provider):
+            logger.debug("scheduling action %s on bucket %s", action,
+                         action_bucket)
+            if self.async_engine is not None and not self.dry_run and \
+                    self.async_engine.accepts(action, action_bucket):
+                self.async_engine.submit(action, action_bucket, reporter)
+                continue
+            if self.hash_ahead is not None and not self.dry_run and \
+                    isinstance(action, B2UploadAction) and \
+                    action_bucket.may_have_duplicate(action.size):
+                self.hash_ahead.submit(action.local_full_path)
+            if self.scheduler is None:
+                sync_executor.submit(self._run_action, action, action_bucket,
+                                     reporter)
+                continue
+            # the worker picks whatever should go next once it gets a slot
+            self.scheduler.push(action.get_bytes(), rank,
+                                (action, action_bucket))
+            sync_executor.submit(self._run_next, reporter)
+
+    def _run_next(self, reporter):
+        # the scheduler may keep us waiting for the large lane, which must
+        # not hold a slot the controller counts as a running transfer
+        with self.scheduler.take() as (action, bucket):
+            return self._run_action(action, bucket, reporter)
+
+    def _run_action(self, action, bucket, reporter):
+        if self.controller is None:
+            return action.run(bucket, reporter, self.dry_run)
+        with self.controller.slot():
+            return action.run(bucket, reporter, self.dry_run)
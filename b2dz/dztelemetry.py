@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Per-drop performance records. Every drop appends one JSON line to a file in
+the support folder with how long scanning, comparing and transferring took,
+what was sent, how fast every file went, what failed and which settings were
+in effect, so settings can be tuned from real drops.
+"""
+import collections
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from b2sdk.v2 import HttpCallback
+
+
+logger = logging.getLogger(__name__)
+
+
+class DropTelemetry(object):
+    """
+    Collects the numbers of one drop. Filled in by the sync report, the
+    bucket and the HTTP layer from many threads.
+
+    This class is thread safe.
+    """
+
+    MAX_FILES = 1000
+    """Files listed one by one in a record, the rest are only summarized"""
+
+    MAX_LOG_SIZE = 10 * 1024 * 1024
+    """The log is moved aside to ``<name>.1`` when it grows past this"""
+
+    def __init__(self, clock=time.monotonic, **settings):
+        """
+        :param clock: returns seconds, only differences are used
+        :type clock: callable
+        :param settings: worker count, part size and the like, recorded as
+                         they are
+        """
+        self.settings = settings
+        self.started = datetime.now()
+        self.outcome = None
+        self.retries = 0
+        self.http_errors = collections.Counter()
+        self._clock = clock
+        self._start = clock()
+        self._seconds = None
+        self._lock = threading.Lock()
+        self._phases = {}  # phase -> seconds into the drop it ended
+        self._files = []  # details of the first MAX_FILES files
+        self._latencies = []
+        self._counts = collections.Counter()
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__,
+                            self.started.isoformat(timespec="seconds"))
+
+    @property
+    def elapsed(self):
+        """
+        :return: seconds since the drop started, or how long it took
+        :rtype: float
+        """
+        if self._seconds is not None:
+            return self._seconds
+        return self._clock() - self._start
+
+    def end_phase(self, phase):
+        """
+        :param phase: "scan", "compare" or "transfer"
+        :type phase: str
+        """
+        with self._lock:
+            self._phases.setdefault(phase, round(self.elapsed, 3))
+
+    def file_done(self, file_name, size, seconds, part_size=None,
+                  copied=False):
+        """
+        :param file_name: the file's name in B2
+        :type file_name: str
+        :param size: bytes stored in B2
+        :type size: int
+        :param seconds: how long the upload or copy took
+        :type seconds: float
+        :param part_size: the part size if it was a large file
+        :type part_size: int|None
+        :param copied: True if B2 copied it from a file with the same SHA1
+        :type copied: bool
+        """
+        with self._lock:
+            self._latencies.append(seconds)
+            self._counts["copied_files" if copied else "files"] += 1
+            self._counts["copied_bytes" if copied else "bytes"] += size
+            if len(self._files) < self.MAX_FILES:
+                self._files.append({
+                    "name": file_name,
+                    "size": size,
+                    "seconds": round(seconds, 3),
+                    "bytes_per_second": int(size / seconds) if seconds else None,
+                    "part_size": part_size,
+                    "copied": copied,
+                })
+
+    def retry(self):
+        """
+        Count an upload attempt that failed and will be tried again.
+        """
+        with self._lock:
+            self.retries += 1
+
+    def http_error(self, status):
+        """
+        :param status: an HTTP status code B2 answered with
+        :type status: int
+        """
+        with self._lock:
+            self.http_errors[status] += 1
+
+    def finish(self, error=None):
+        """
+        :param error: what ended the drop if it failed
+        :type error: Exception|None
+        """
+        with self._lock:
+            self._seconds = self._clock() - self._start
+            self.outcome = "ok" if error is None else type(error).__name__
+
+    def to_record(self):
+        """
+        :rtype: dict
+        """
+        with self._lock:
+            seconds = self.elapsed
+            latencies = sorted(self._latencies)
+            counts = self._counts
+            return {
+                "time": self.started.isoformat(timespec="seconds"),
+                "seconds": round(seconds, 3),
+                "outcome": self.outcome,
+                "settings": self.settings,
+                "phases": dict(self._phases),
+                "files": counts["files"],
+                "bytes": counts["bytes"],
+                "copied_files": counts["copied_files"],
+                "copied_bytes": counts["copied_bytes"],
+                "bytes_per_second": int(counts["bytes"] / seconds)
+                if seconds else None,
+                "latency": _summary(latencies),
+                "retries": self.retries,
+                "http_errors": {str(status): count for status, count
+                                in sorted(self.http_errors.items())},
+                "file_details": list(self._files),
+            }
+
+    def write(self, path):
+        """
+        Append the record to a JSON lines file. Never raises, a drop must not
+        fail because its numbers couldn't be saved.
+
+        :param path: the log file
+        :type path: str
+        """
+        line = json.dumps(self.to_record(), separators=(",", ":")) + "\n"
+        try:
+            try:
+                if os.path.getsize(path) > self.MAX_LOG_SIZE:
+                    os.replace(path, path + ".1")
+            except FileNotFoundError:
+                pass
+            # one write per record keeps concurrent drops' lines apart
+            with open(path, "a") as f:
+                f.write(line)
+        except OSError:
+            logger.warning("Could not write the drop record to %s", path,
+                           exc_info=True)
+
+
+class TelemetryHttpCallback(HttpCallback):
+    """
+    Counts the error responses B2 sends into the API's current
+    ``DropTelemetry``.
+    """
+
+    def __init__(self, api):
+        """
+        :type api: b2dz.dzapi.DropzoneB2Api
+        """
+        self.api = api
+
+    def post_request(self, method, url, headers, response):
+        telemetry = self.api.telemetry
+        if telemetry is not None and response.status_code >= 400:
+            telemetry.http_error(response.status_code)
+
+
+def _summary(latencies):
+    """
+    :param latencies: sorted seconds
+    :type latencies: list[float]
+    :rtype: dict|None
+    """
+    if not latencies:
+        return None
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1,
+                                   int(len(latencies) * p))], 3)
+
+    return {
+        "p50": percentile(0.5),
+        "p90": percentile(0.9),
+        "p99": percentile(0.99),
+        "max": round(latencies[-1], 3),
+    }
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+A bandwidth cap for uploads. Every upload stream draws from one shared
+token bucket, so the cap holds no matter how many threads are uploading.
+The cap can change with the time of day and while a transfer is running.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+
+logger = logging.getLogger(__name__)
+
+
+KILOBYTE = 1000
+
+
+class TokenBucket(object):
+    """
+    Hands out bytes at ``rate`` per second with bursts of up to ``burst``.
+    Callers that take more than is available go into debt and sleep until
+    it is paid off, so big reads are shaped as well as small ones.
+
+    This class is thread safe.
+    """
+
+    MIN_BURST = 64 * 1024
+    """Smallest burst allowed, so a low cap still sends decent chunks"""
+
+    def __init__(self, rate=None, clock=time.monotonic, sleep=time.sleep):
+        """
+        :param rate: bytes per second or None for no limit
+        :type rate: int|None
+        :param clock: returns the current time in seconds
+        :type clock: callable
+        :param sleep: sleeps for a number of seconds
+        :type sleep: callable
+        """
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._updated = clock()
+        self.rate = None
+        self.burst = 0
+        self._tokens = 0
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        """
+        Change the limit, also while other threads are consuming.
+
+        :param rate: bytes per second or None for no limit
+        :type rate: int|None
+        """
+        with self._lock:
+            self._refill()
+            self.rate = rate or None
+            self.burst = max(self.MIN_BURST, (rate or 0) // 4)
+            # whatever debt was run up at the old rate is forgiven
+            self._tokens = max(0, min(self._tokens, self.burst))
+
+    def consume(self, amount):
+        """
+        Take ``amount`` bytes, sleeping first if they aren't available yet.
+
+        :type amount: int
+        """
+        with self._lock:
+            if not self.rate:
+                return
+            self._refill()
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            self._sleep(wait)
+
+    def _refill(self):
+        now = self._clock()
+        if self.rate:
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class RateSchedule(object):
+    """
+    Upload limits that apply during certain hours, written like
+    ``09:00-17:30=500, 22:00-06:00=2000`` (KB/s). A window may wrap past
+    midnight.
+    """
+
+    _WINDOW = re.compile(
+        r"^\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*=\s*(\d+)\s*$")
+
+    def __init__(self, windows=()):
+        """
+        :param windows: (start minute, end minute, bytes per second) tuples
+        :type windows: list[tuple[int, int, int]]
+        """
+        self.windows = list(windows)
+
+    def __str__(self):
+        return ", ".join(
+            "%02d:%02d-%02d:%02d=%d" % (start // 60, start % 60, end // 60,
+                                        end % 60, rate // KILOBYTE)
+            for start, end, rate in self.windows)
+
+    @classmethod
+    def parse(cls, text):
+        """
+        :param text: comma or semicolon separated windows, may be empty
+        :type text: str|None
+        :rtype: RateSchedule
+        :raises ValueError: if a window can't be understood
+        """
+        windows = []
+        for part in re.split(r"[,;]", text or ""):
+            if not part.strip():
+                continue
+            match = cls._WINDOW.match(part)
+            if match is None:
+                raise ValueError("Can't understand the limit schedule '%s'. "
+                                 "Use something like 09:00-17:00=500."
+                                 % part.strip())
+            start_h, start_m, end_h, end_m, rate = map(int, match.groups())
+            if start_h > 23 or end_h > 24 or start_m > 59 or end_m > 59:
+                raise ValueError("'%s' is not a time of day." % part.strip())
+            windows.append((start_h * 60 + start_m, end_h * 60 + end_m,
+                            rate * KILOBYTE))
+        return cls(windows)
+
+    def rate_at(self, when):
+        """
+        :type when: datetime
+        :return: the limit in bytes per second at ``when`` or None if no
+                 window covers it
+        :rtype: int|None
+        """
+        minute = when.hour * 60 + when.minute
+        for start, end, rate in self.windows:
+            if start <= end:
+                if start <= minute < end:
+                    return rate
+            elif minute >= start or minute < end:
+                return rate
+        return None
+
+
+class UploadThrottle(object):
+    """
+    Keeps a ``TokenBucket`` set to the right limit: the schedule's limit
+    during its windows, the plain cap the rest of the time. Every
+    ``CHECK_INTERVAL`` it looks at the clock and at the settings file, which
+    another b2dz process writes when the user saves new limits, so a running
+    transfer follows both.
+
+    This class is thread safe.
+    """
+
+    CHECK_INTERVAL = 5
+    """Seconds between checks of the schedule and the settings file"""
+
+    def __init__(self, rate_limit=None, schedule=None, settings_path=None,
+                 clock=time.monotonic, now=datetime.now, sleep=time.sleep):
+        """
+        :param rate_limit: bytes per second outside scheduled windows
+        :type rate_limit: int|None
+        :param schedule: limits for certain times of the day
+        :type schedule: RateSchedule|None
+        :param settings_path: a file written by ``save_settings``
+        :type settings_path: str|None
+        """
+        self.rate_limit = rate_limit
+        self.schedule = schedule or RateSchedule()
+        self.settings_path = settings_path
+        self.bucket = TokenBucket(clock=clock, sleep=sleep)
+        self._clock = clock
+        self._now = now
+        self._lock = threading.Lock()
+        self._next_check = clock()
+        self._settings_mtime = None
+        self._check()
+
+    @property
+    def rate(self):
+        """
+        :return: the limit in effect right now in bytes per second
+        :rtype: int|None
+        """
+        return self.bucket.rate
+
+    def set_limits(self, rate_limit, schedule=None):
+        """
+        Change the cap and schedule for transfers that are already running.
+
+        :type rate_limit: int|None
+        :type schedule: RateSchedule|None
+        """
+        with self._lock:
+            self.rate_limit = rate_limit
+            self.schedule = schedule or RateSchedule()
+            self._next_check = self._clock()
+        self._check()
+
+    def consume(self, amount):
+        """
+        :param amount: bytes about to be sent
+        :type amount: int
+        """
+        if self._clock() >= self._next_check:
+            self._check()
+        self.bucket.consume(amount)
+
+    def _check(self):
+        with self._lock:
+            if self._clock() < self._next_check:
+                return  # another thread just did it
+            self._next_check = self._clock() + self.CHECK_INTERVAL
+            self._load_settings()
+            rate = self.schedule.rate_at(self._now())
+            if rate is None:
+                rate = self.rate_limit
+        if rate != self.bucket.rate:
+            logger.info("Upload limit is now %s bytes/s", rate or "no")
+            self.bucket.set_rate(rate)
+
+    def _load_settings(self):
+        if not self.settings_path:
+            return
+        try:
+            mtime = os.stat(self.settings_path).st_mtime_ns
+            if mtime == self._settings_mtime:
+                return
+            with open(self.settings_path) as f:
+                settings = json.load(f)
+            self.rate_limit = settings.get("rate_limit")
+            self.schedule = RateSchedule.parse(settings.get("schedule"))
+            self._settings_mtime = mtime
+        except (OSError, ValueError):
+            logger.debug("Could not read %s", self.settings_path,
+                         exc_info=True)
+
+    @staticmethod
+    def save_settings(settings_path, rate_limit, schedule):
+        """
+        Publish new limits to every running ``UploadThrottle`` that watches
+        ``settings_path``.
+
+        :type settings_path: str
+        :param rate_limit: bytes per second outside scheduled windows
+        :type rate_limit: int|None
+        :type schedule: RateSchedule|None
+        """
+        temp_path = settings_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"rate_limit": rate_limit,
+                       "schedule": str(schedule or "")}, f)
+        os.replace(temp_path, settings_path)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for b2dz, too slow or too noisy for the tests. Run them from the
+action's folder, i.e. ``python -m benchmarks.bench_scandir``. They need
+b2sdk but no B2 account, Dropzone or network.
+"""
+import os
+import sys
+import time
+import types
+from contextlib import contextmanager
+
+
+def install_dropzone():
+    """
+    Dropzone hands actions its ``dropzone`` module, outside of Dropzone the
+    benchmarks use one that does nothing.
+
+    :return: the stand-in, or Dropzone's module if there is one
+    :rtype: module
+    """
+    module = types.ModuleType("dropzone")
+    for name in ("add_dropbar", "alert", "begin", "determinate", "error",
+                 "fail", "finish", "percent", "remove_value", "save_value",
+                 "text", "url"):
+        setattr(module, name, lambda *args: None)
+    module.pashua = lambda config: {"cancelled": "1"}
+    return sys.modules.setdefault("dropzone", module)
+
+
+# b2dz imports it as soon as it is imported itself
+install_dropzone()
+
+
+@contextmanager
+def timed(label, results=None):
+    """
+    Print how long the ``with`` block took.
+
+    :param results: if given, the seconds are stored under ``label``
+    :type results: dict|None
+    """
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+    if results is not None:
+        results[label] = seconds
+    print("%-40s %8.3f s" % (label, seconds))
+
+
+def argument(index, default):
+    """
+    :return: the ``index``th command line argument as an int, or ``default``
+    :rtype: int
+    """
+    try:
+        return int(sys.argv[index])
+    except (IndexError, ValueError):
+        return default
+
+
+def scratch_folder(name):
+    """
+    :return: a folder for the benchmark's files that is kept between runs,
+             since making them can take longer than the benchmark
+    :rtype: str
+    """
+    path = os.path.join(os.environ.get("TMPDIR", "/tmp"), "b2dz-bench", name)
+    os.makedirs(path, exist_ok=True)
+    return path
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Bytes sent to B2 with and without compression,
+``python -m benchmarks.bench_compress [megabytes]``. A folder of each kind
+of file, 50 MB each by default, is uploaded to a stand-in B2 server on
+localhost, which counts the bytes it receives. Needs aiohttp.
+"""
+import json
+import os
+import random
+import time
+
+from . import argument, scratch_folder
+from b2dz.b2dz_account_info import DropzoneB2AccountInfo
+from b2dz.dzapi import DropzoneB2Api
+from b2dz.dzcompress import Compressor
+from b2dz.dzplanner import MEGABYTE
+from tests.b2server import StandInB2
+
+
+FILE_SIZE = 5 * MEGABYTE
+"""Size of the files each kind is made of"""
+
+
+def write_log(f, size):
+    levels = ("DEBUG", "INFO", "WARNING")
+    while f.tell() < size:
+        f.write(json.dumps({
+            "time": 1600000000 + f.tell(), "level": random.choice(levels),
+            "message": "uploaded part %d of %d" % (random.randrange(100),
+                                                   random.randrange(100)),
+        }).encode("utf-8") + b"\n")
+
+
+def write_csv(f, size):
+    while f.tell() < size:
+        f.write(("%d,%s,%.4f,%d\n" % (
+            f.tell(), random.choice(("red", "green", "blue")),
+            random.random(), random.randrange(10 ** 6))).encode("ascii"))
+
+
+def write_random(f, size):
+    f.write(os.urandom(size))
+
+
+KINDS = {"log": write_log, "csv": write_csv, "random": write_random}
+"""How each kind of file is made, random files don't compress"""
+
+
+def make_files(kind, megabytes):
+    """
+    :return: the folder of ``megabytes`` of files of ``kind``
+    :rtype: str
+    """
+    folder = scratch_folder("compress-%s-%d" % (kind, megabytes))
+    count = max(1, megabytes * MEGABYTE // FILE_SIZE)
+    random.seed(kind)
+    for i in range(count):
+        path = os.path.join(folder, "%s%d" % (kind, i))
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                KINDS[kind](f, FILE_SIZE)
+                f.truncate(FILE_SIZE)
+    return folder
+
+
+def upload(server, folder, compressor):
+    """
+    :return: bytes the server received and the seconds it took
+    :rtype: tuple[int,float]
+    """
+    api = DropzoneB2Api(DropzoneB2AccountInfo(), compressor=compressor)
+    api.authorize_account(server.realm, "key id", "key")
+    bucket = api.get_bucket_by_name(StandInB2.BUCKET_NAME)
+    server.files.clear()
+    start = time.perf_counter()
+    for name in sorted(os.listdir(folder)):
+        bucket.upload_local_file(os.path.join(folder, name), name)
+    seconds = time.perf_counter() - start
+    return sum(size for size, _ in server.files.values()), seconds
+
+
+def main():
+    megabytes = argument(1, 50)
+    server = StandInB2().start()
+    try:
+        print("%-8s %10s %10s %7s %9s %9s" % (
+            "kind", "plain", "gzip", "saved", "plain s", "gzip s"))
+        for kind in KINDS:
+            folder = make_files(kind, megabytes)
+            plain, plain_seconds = upload(server, folder, None)
+            sent, seconds = upload(server, folder, Compressor("gzip"))
+            print("%-8s %10d %10d %6.0f%% %9.2f %9.2f" % (
+                kind, plain, sent, (1 - sent / plain) * 100, plain_seconds,
+                seconds))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+How many calls to Dropzone saving the settings takes per drop,
+``python -m benchmarks.bench_config [drops]``. Each drop loads the settings,
+authorizes if it has to, looks its bucket up and saves the throughput it
+measured, against b2sdk's simulator. Before values were staged, every value
+``save_config`` looked at was a ``dz.save_value`` or ``dz.remove_value``
+round trip to Dropzone.
+"""
+import os
+import sys
+
+from b2sdk.v2 import B2HttpApiConfig, RawSimulator
+from . import argument
+from b2dz.b2dz_account_info import DropzoneB2AccountInfo
+from b2dz.dzapi import DropzoneB2Api
+from b2dz.dzconfig import DropzoneConfig
+
+
+class CallCounter(object):
+    """Counts the values looked at by ``save_config`` and sent by ``flush``"""
+
+    def __init__(self, dropzone):
+        self.looked_at = 0
+        self.sent = 0
+        save_value = DropzoneConfig._save_value
+
+        def counting_save_value(config, key, value):
+            self.looked_at += 1
+            return save_value(config, key, value)
+
+        def send(key, value=None):
+            # Dropzone hands saved values to the next run in its environment
+            self.sent += 1
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+        DropzoneConfig._save_value = counting_save_value
+        dropzone.save_value = send
+        dropzone.remove_value = send
+
+
+def drop(simulator, keys, throughput):
+    """
+    :return: the simulator, made on the first drop
+    :rtype: RawSimulator
+    """
+    config = DropzoneB2AccountInfo()
+    config.load_config()
+    api = DropzoneB2Api(config, api_config=B2HttpApiConfig(
+        _raw_api_class=RawSimulator))
+    if simulator is None:
+        simulator = api.session.raw_api
+        keys.extend(simulator.create_account())
+        api.authorize_account("production", *keys)
+        api.create_bucket("bucket", "allPrivate")
+        config.bucket_name = "bucket"
+    api.session.raw_api = simulator
+    if config.needs_authorization:
+        api.authorize_account("production", *keys)
+    bucket = api.get_bucket_by_name(config.bucket_name)
+    bucket.upload_bytes(b"x" * 1000, "file.txt")
+    config.throughput = throughput
+    config.save_config()
+    config.flush()
+    return simulator
+
+
+def main():
+    drops = argument(1, 20)
+    for key in [key for key in os.environ if key.startswith("B2DZ_")]:
+        del os.environ[key]  # start from an action that was just installed
+    counter = CallCounter(sys.modules["dropzone"])
+    simulator = None
+    keys = []
+    for i in range(drops):
+        before = counter.looked_at, counter.sent
+        simulator = drop(simulator, keys, 1000 * 1000 + i)
+        print("drop %2d: %3d calls before, %3d now" % (
+            i + 1, counter.looked_at - before[0], counter.sent - before[1]))
+    print("%d calls to Dropzone instead of %d, %.1f saved per drop" % (
+        counter.sent, counter.looked_at,
+        (counter.looked_at - counter.sent) / drops))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Hashing a big file the way a large file upload does, with an empty memo and
+again with the memo the first run left, ``python -m benchmarks.bench_hash
+[megabytes]``. The default file is 4 GB, hashed whole and as 100 MB parts.
+Both runs read from the page cache once the file has been made, so the cold
+run shows what hashing costs, not what the disk does.
+"""
+import hashlib
+import os
+import time
+
+from . import argument, scratch_folder, timed
+from b2dz.dzhash import FileHasher
+from b2dz.dzplanner import MEGABYTE
+
+
+PART_SIZE = 100 * MEGABYTE
+"""What the file is hashed in besides as a whole"""
+
+
+def make_file(megabytes):
+    """
+    :return: the path of a file of ``megabytes`` random-ish megabytes
+    :rtype: str
+    """
+    path = os.path.join(scratch_folder("hash"), "%d.bin" % megabytes)
+    if os.path.exists(path) and os.path.getsize(path) == megabytes * MEGABYTE:
+        return path
+    block = os.urandom(MEGABYTE)
+    with open(path, "wb") as f:
+        for _ in range(megabytes):
+            f.write(block)
+    return path
+
+
+def hash_like_an_upload(hasher, path):
+    """
+    :return: the file's SHA1 and the SHA1s of its parts
+    :rtype: tuple[str,list[str]]
+    """
+    size = os.path.getsize(path)
+    parts = [hasher.sha1_of_range(path, offset, min(PART_SIZE, size - offset))
+             for offset in range(0, size, PART_SIZE)]
+    return hasher.sha1_of_file(path), parts
+
+
+def main():
+    megabytes = argument(1, 4000)
+    with timed("making a %d MB file (first run only)" % megabytes):
+        path = make_file(megabytes)
+    with timed("reading it into the page cache"):
+        with open(path, "rb") as f:
+            while f.read(8 * MEGABYTE):
+                pass
+    memo = os.path.join(scratch_folder("hash"), "memo-%d.db" % time.time())
+    results = {}
+    try:
+        for run in ("cold", "warm"):
+            # a new hasher, as every drop opens the memo again
+            hasher = FileHasher(memo)
+            with timed(run, results):
+                hashes = hash_like_an_upload(hasher, path)
+            hasher.close()
+            print("    hit rate %.0f%%, %d MB hashed" %
+                  (hasher.hit_rate * 100, hasher.bytes_hashed // MEGABYTE))
+            if run == "cold":
+                expected, hashed = hashes, hasher.bytes_hashed
+            assert hashes == expected
+    finally:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(memo + suffix):
+                os.remove(memo + suffix)
+    with open(path, "rb") as f:
+        assert hashlib.sha1(f.read(PART_SIZE)).hexdigest() == expected[1][0]
+    print("%.0f MB/s hashed cold, warm took %.2f%% of that" % (
+        hashed / MEGABYTE / results["cold"],
+        results["warm"] / results["cold"] * 100))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Peak memory and CPU time of uploading a large file to a stand-in B2 server
+on localhost, ``python -m benchmarks.bench_mmap [megabytes]``. The default
+file is 2 GB, sent in 25 MB parts 16 at a time, once from memory mappings
+and once copied through b2sdk's file range streams as it was before. Each
+way runs in a process of its own and the server in yet another one, so
+neither counts towards the other. Part hashes are remembered beforehand, as
+on a repeat drop, so only sending them is measured. Needs aiohttp.
+"""
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from . import argument
+from .bench_hash import make_file
+from b2dz.b2dz_account_info import DropzoneB2AccountInfo
+from b2dz.dzapi import DropzoneB2Api
+from b2dz.dzhash import FileHasher, HashedUploadEmergePartDefinition
+from b2dz.dzplanner import MEGABYTE
+
+
+PART_SIZE = 25 * MEGABYTE
+"""Size of the parts the file is sent in"""
+
+PART_STREAMS = 16
+"""Parts sent at the same time"""
+
+WAYS = ("mapped", "copied")
+"""How parts are read, ``copied`` is b2sdk's own stream"""
+
+
+def max_rss():
+    """
+    :return: the largest this process has been, in MB
+    :rtype: float
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def reset_max_rss():
+    """
+    Start the peak over from what is resident now where Linux allows it,
+    so the upload's peak isn't hidden by the hashing before it.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def serve():
+    """
+    Run a stand-in server until stdin is closed, printing its realm first.
+    """
+    from tests.b2server import StandInB2
+    server = StandInB2().start()
+    print(server.realm, flush=True)
+    sys.stdin.read()
+    server.stop()
+
+
+def upload(path, way, realm):
+    """
+    Upload ``path`` and print what it took.
+    """
+    if way == "copied":
+        # b2sdk reads the part from a file object into new bytes objects
+        del HashedUploadEmergePartDefinition._get_stream
+    size = os.path.getsize(path)
+    hasher = FileHasher()
+    for offset in range(0, size, PART_SIZE):
+        hasher.sha1_of_range(path, offset, min(PART_SIZE, size - offset))
+    api = DropzoneB2Api(DropzoneB2AccountInfo(), hasher=hasher,
+                        max_upload_workers=PART_STREAMS)
+    api.authorize_account(realm, "key id", "key")
+    bucket = api.get_bucket_by_name("bucket")
+    reset_max_rss()
+    rss_before, cpu_before = max_rss(), cpu_time()
+    start = time.perf_counter()
+    bucket.upload_local_file(path, "%s.bin" % way, min_part_size=PART_SIZE)
+    seconds = time.perf_counter() - start
+    gigabytes = size / (1000 * MEGABYTE)
+    print("%-8s %6.1f s, %5.2f s CPU per GB, peak RSS %4.0f MB "
+          "(%.0f MB before the upload)" % (
+              way, seconds, (cpu_time() - cpu_before) / gigabytes, max_rss(),
+              rss_before))
+
+
+def main():
+    if sys.argv[1:2] == ["serve"]:
+        return serve()
+    if len(sys.argv) > 3:
+        return upload(*sys.argv[1:4])
+    megabytes = argument(1, 2000)
+    path = make_file(megabytes)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.bench_mmap", "serve"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        realm = server.stdout.readline().strip()
+        print("%d MB in %d MB parts, %d at a time" % (
+            megabytes, PART_SIZE // MEGABYTE, PART_STREAMS))
+        for way in WAYS:
+            subprocess.run([sys.executable, "-m", "benchmarks.bench_mmap",
+                            path, way, realm], check=True)
+    finally:
+        server.stdin.close()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
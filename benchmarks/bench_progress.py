@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+What reporting progress costs every file of a sync,
+``python -m benchmarks.bench_progress [files]``. Transfer threads report
+10k files by default to ``DropzoneSyncReport``, to b2sdk's ``SyncReport``
+(which takes a lock and may print on every call) and to a report that does
+nothing.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from b2sdk.sync.report import SyncReport
+from . import argument
+from b2dz.dzprogress import DropzoneSyncReport
+
+
+THREADS = 16
+"""Transfer threads reporting at the same time"""
+
+RUNS = 5
+"""The best of this many runs is shown"""
+
+CHUNKS = 4
+"""Progress updates while each file is being sent"""
+
+
+class NullReport(object):
+    """Takes every call and does nothing"""
+
+    def __init__(self, stdout, no_progress):
+        pass
+
+    def __getattr__(self, name):
+        return lambda *args: None
+
+
+def per_file_overhead(report_class, files):
+    """
+    :return: microseconds each file spent reporting, from the threads'
+             point of view
+    :rtype: float
+    """
+    with open(os.devnull, "w") as out:
+        report = report_class(out, False)
+        report.update_total(files)
+        report.end_total()
+        report.end_compare(files, files * 1000)
+
+        def transfer(i):
+            report.update_compare(1)
+            for _ in range(CHUNKS):
+                report.update_transfer(0, 1000 // CHUNKS)
+            report.update_transfer(1, 0)
+            report.print_completion("upload f%05d" % i)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(THREADS) as executor:
+            list(executor.map(transfer, range(files)))
+        seconds = time.perf_counter() - start
+        report.close()
+    return seconds / files * 1000 * 1000
+
+
+def main():
+    files = argument(1, 10 * 1000)
+    for report_class in (NullReport, SyncReport, DropzoneSyncReport):
+        overhead = min(per_file_overhead(report_class, files)
+                       for _ in range(RUNS))
+        print("%-20s %8.1f us per file" % (report_class.__name__, overhead))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Walking a synthetic tree with b2sdk's ``LocalFolder`` and with
+``ScandirFolder``, ``python -m benchmarks.bench_scandir [files]``. The
+default tree has a million files in 100 files per folder.
+"""
+import os
+
+from b2sdk.sync.folder import LocalFolder
+from . import argument, scratch_folder, timed
+from b2dz.dzfolder import ScandirFolder
+
+
+FILES_PER_FOLDER = 100
+FOLDERS_PER_FOLDER = 100
+
+
+def make_tree(files):
+    """
+    :return: the root of a tree of ``files`` empty files
+    :rtype: str
+    """
+    root = scratch_folder("scandir-%d" % files)
+    if os.listdir(root):
+        return root
+    for i in range(-(-files // FILES_PER_FOLDER)):
+        folder = os.path.join(root, "d%d" % (i // FOLDERS_PER_FOLDER),
+                              "s%d" % (i % FOLDERS_PER_FOLDER))
+        os.makedirs(folder)
+        for j in range(min(FILES_PER_FOLDER, files - i * FILES_PER_FOLDER)):
+            open(os.path.join(folder, "f%d.txt" % j), "w").close()
+    return root
+
+
+def main():
+    files = argument(1, 1000 * 1000)
+    with timed("making %d files (first run only)" % files):
+        root = make_tree(files)
+    listings = {}
+    for folder_class in (LocalFolder, ScandirFolder):
+        with timed(folder_class.__name__):
+            listings[folder_class] = [
+                (p.relative_path, p.size, p.mod_time)
+                for p in folder_class(root).all_files(None)]
+    assert listings[LocalFolder] == listings[ScandirFolder]
+    print("both listed %d files in the same order" % len(listings[LocalFolder]))
+
+
+if __name__ == "__main__":
+    main()
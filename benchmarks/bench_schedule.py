@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+How soon the first file of a drop is done and how long the whole drop
+takes with each of ``dzschedule.ORDERS``,
+``python -m benchmarks.bench_schedule [scale]``. The drop is a folder of 2
+big videos, one of 6 photos and one of 40 small documents, in that order,
+uploaded by 4 workers to b2sdk's simulator, which is slowed down to send
+each connection's bytes at 10 MB/s after a 20 ms round trip. ``scale``
+multiplies every file size.
+"""
+import io
+import os
+import time
+
+from b2sdk.sync.report import SyncReport
+from b2sdk.v2 import B2HttpApiConfig, RawSimulator, parse_sync_folder
+from . import argument, scratch_folder
+from b2dz.b2dz_account_info import DropzoneB2AccountInfo
+from b2dz.dzapi import DropzoneB2Api
+from b2dz.dzplanner import MEGABYTE
+from b2dz.dzschedule import ORDERS, TransferScheduler
+from b2dz.dzsync import DropzoneSynchronizer
+
+
+DROP = (("videos", 2, 20 * MEGABYTE), ("photos", 6, 2 * MEGABYTE),
+        ("documents", 40, 50 * 1000))
+"""The dropped folders, how many files they have and how big"""
+
+WORKERS = 4
+"""Transfers running at the same time"""
+
+PART_SIZE = 5 * MEGABYTE
+"""Bigger files go in the large lane and are sent in parts this big"""
+
+LINK_SPEED = 10 * MEGABYTE
+"""Bytes per second a single connection sends"""
+
+ROUND_TRIP = 0.02
+"""Seconds every upload call takes on top of sending its bytes"""
+
+
+class SlowLink(object):
+    """
+    Makes the simulator's uploads take as long as ``LINK_SPEED`` and
+    ``ROUND_TRIP`` say, and notes when each file is done.
+    """
+
+    def __init__(self):
+        self.done = []
+        self._originals = {}
+
+    def __enter__(self):
+        for name in ("upload_file", "upload_part", "finish_large_file"):
+            self._originals[name] = call = getattr(RawSimulator, name)
+            setattr(RawSimulator, name, self._slowed(name, call))
+        return self
+
+    def __exit__(self, *exc_info):
+        for name, call in self._originals.items():
+            setattr(RawSimulator, name, call)
+
+    def _slowed(self, name, call):
+        def slowed(simulator, *args, **kwargs):
+            if name != "finish_large_file":
+                # both take the content length as their fourth argument
+                time.sleep(ROUND_TRIP + args[3] / LINK_SPEED)
+            result = call(simulator, *args, **kwargs)
+            if name != "upload_part":
+                self.done.append(time.monotonic())
+            return result
+        return slowed
+
+
+def make_drop(scale):
+    """
+    :return: the dropped folders
+    :rtype: list[str]
+    """
+    folders = []
+    for name, count, size in DROP:
+        size = int(size * scale)
+        folder = scratch_folder("schedule-%s-%d" % (name, size))
+        for i in range(count):
+            path = os.path.join(folder, "%s%02d" % (name, i))
+            if not os.path.exists(path) or os.path.getsize(path) != size:
+                with open(path, "wb") as f:
+                    f.write(os.urandom(size))
+        folders.append(folder)
+    return folders
+
+
+def upload(order, folders):
+    """
+    :return: seconds until the first file was done and until all were
+    :rtype: tuple[float,float]
+    """
+    api = DropzoneB2Api(DropzoneB2AccountInfo(), api_config=B2HttpApiConfig(
+        _raw_api_class=RawSimulator), max_upload_workers=WORKERS)
+    simulator = api.session.raw_api
+    api.authorize_account("production", *simulator.create_account())
+    api.account_info.recommended_part_size = PART_SIZE
+    api.create_bucket("bucket", "allPrivate")
+    scheduler = TransferScheduler(order, PART_SIZE, workers=lambda: WORKERS)
+    sync = DropzoneSynchronizer(max_workers=WORKERS, scheduler=scheduler)
+    folder_pairs = [
+        (parse_sync_folder(folder, api),
+         parse_sync_folder("b2://bucket/" + os.path.basename(folder), api))
+        for folder in folders]
+    with SlowLink() as link, SyncReport(io.StringIO(), True) as reporter:
+        start = time.monotonic()
+        sync.sync_many(folder_pairs, int(time.time() * 1000), reporter)
+        makespan = time.monotonic() - start
+    assert len(link.done) == sum(count for _, count, _ in DROP)
+    return min(link.done) - start, makespan
+
+
+def main():
+    scale = argument(1, 1)
+    folders = make_drop(scale)
+    print("%-10s %15s %10s" % ("order", "first file s", "all s"))
+    for order in ORDERS:
+        first, makespan = upload(order, folders)
+        print("%-10s %15.2f %10.2f" % (order, first, makespan))
+
+
+if __name__ == "__main__":
+    main()
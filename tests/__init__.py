@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for b2dz. Run ``python -m pytest`` from the action's folder.
+"""
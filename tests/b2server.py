@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+A stand-in B2 server on localhost, with just enough of the API for b2sdk and
+``b2dz.dzasync`` to authorize, upload small and large files and have calls
+fail on request. Needs aiohttp.
+"""
+import asyncio
+import collections
+import hashlib
+import itertools
+import threading
+import time
+from urllib.parse import unquote_plus
+
+from aiohttp import web
+
+
+class StandInB2(object):
+    """
+    Keeps everything in memory and serves it from a thread of its own, one
+    account with one bucket. ``start`` it, authorize with ``realm`` as the
+    realm and any key.
+
+    Uploaded files are kept as their sizes and SHA1s, so big benchmarks
+    don't hold every byte they send.
+    """
+
+    BUCKET_ID = "bucket-id"
+    BUCKET_NAME = "bucket"
+
+    def __init__(self, latency=0):
+        """
+        :param latency: seconds every upload takes on top of receiving it
+        :type latency: float
+        """
+        self.latency = latency
+        self.port = None
+        self.files = {}  # name -> (size, sha1)
+        self.calls = collections.Counter()
+        self._failures = collections.defaultdict(collections.deque)
+        self._large_files = {}
+        self._ids = itertools.count()
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    @property
+    def realm(self):
+        return "http://127.0.0.1:%d" % self.port
+
+    def fail(self, call, status, code, times=1):
+        """
+        Make the next ``times`` calls of ``call`` (i.e. "b2_get_upload_url"
+        or "upload") fail with an error response.
+        """
+        self._failures[call].extend([(status, code)] * times)
+
+    def start(self):
+        ready = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self._start())
+            ready.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self._runner.cleanup())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=serve, name="stand-in-b2",
+                                        daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    async def _start(self):
+        app = web.Application(client_max_size=1 << 31)
+        for call in ("b2_authorize_account", "b2_list_buckets",
+                     "b2_get_upload_url", "b2_start_large_file",
+                     "b2_get_upload_part_url", "b2_finish_large_file",
+                     "b2_list_unfinished_large_files", "b2_list_parts",
+                     "b2_cancel_large_file"):
+            app.router.add_route("*", "/b2api/v2/" + call,
+                                 self._handler(call))
+        app.router.add_post("/upload", self._handler("upload"))
+        app.router.add_post("/upload_part/{file_id}",
+                            self._handler("upload_part"))
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def _handler(self, call):
+        method = getattr(self, "_" + call)
+
+        async def handle(request):
+            self.calls[call] += 1
+            failures = self._failures[call]
+            if failures:
+                status, code = failures.popleft()
+                return web.json_response(
+                    {"status": status, "code": code, "message": code},
+                    status=status)
+            return web.json_response(await method(request))
+
+        return handle
+
+    async def _b2_authorize_account(self, request):
+        return {
+            "accountId": "account", "authorizationToken": "account-token",
+            "apiUrl": self.realm, "downloadUrl": self.realm,
+            "s3ApiUrl": self.realm, "recommendedPartSize": 100 * 1000 * 1000,
+            "absoluteMinimumPartSize": 5 * 1000 * 1000,
+            "allowed": {"capabilities": ["listBuckets", "writeFiles",
+                                         "listFiles", "readFiles"],
+                        "bucketId": None, "bucketName": None,
+                        "namePrefix": None},
+        }
+
+    async def _b2_list_buckets(self, request):
+        return {"buckets": [{
+            "accountId": "account", "bucketId": self.BUCKET_ID,
+            "bucketName": self.BUCKET_NAME, "bucketType": "allPrivate",
+            "bucketInfo": {}, "corsRules": [], "lifecycleRules": [],
+            "revision": 1, "options": [],
+            "defaultServerSideEncryption": {"isClientAuthorizedToRead": True,
+                                            "value": {"mode": None}},
+            "fileLockConfiguration": {
+                "isClientAuthorizedToRead": True,
+                "value": {"defaultRetention": {"mode": None,
+                                               "period": None},
+                          "isFileLockEnabled": False}},
+        }]}
+
+    async def _b2_get_upload_url(self, request):
+        return {"bucketId": self.BUCKET_ID,
+                "uploadUrl": self.realm + "/upload",
+                "authorizationToken": "upload-token"}
+
+    async def _upload(self, request):
+        data = await request.read()
+        await asyncio.sleep(self.latency)
+        sha1 = request.headers["X-Bz-Content-Sha1"]
+        if sha1 == "hex_digits_at_end":
+            data, sha1 = data[:-40], data[-40:].decode("ascii")
+        assert hashlib.sha1(data).hexdigest() == sha1
+        name = unquote_plus(request.headers["X-Bz-File-Name"])
+        info = {key[len("X-Bz-Info-"):]: unquote_plus(value)
+                for key, value in request.headers.items()
+                if key.startswith("X-Bz-Info-")}
+        self.files[name] = (len(data), sha1)
+        return self._file_version("upload", name, len(data), sha1, info)
+
+    async def _b2_start_large_file(self, request):
+        body = await request.json()
+        file_id = "large-%d" % next(self._ids)
+        info = body.get("fileInfo") or {}
+        self._large_files[file_id] = (body["fileName"], info, {})
+        return self._file_version("start", body["fileName"], 0, "none", info,
+                                  file_id)
+
+    async def _b2_get_upload_part_url(self, request):
+        body = await request.json()
+        return {"fileId": body["fileId"],
+                "uploadUrl": self.realm + "/upload_part/" + body["fileId"],
+                "authorizationToken": "part-token"}
+
+    async def _upload_part(self, request):
+        file_id = request.match_info["file_id"]
+        number = int(request.headers["X-Bz-Part-Number"])
+        digest = hashlib.sha1()
+        size = 0
+        async for chunk in request.content.iter_chunked(1 << 20):
+            digest.update(chunk)
+            size += len(chunk)
+        await asyncio.sleep(self.latency)
+        sha1 = digest.hexdigest()
+        assert sha1 == request.headers["X-Bz-Content-Sha1"]
+        self._large_files[file_id][2][number] = (size, sha1)
+        return {"fileId": file_id, "partNumber": number,
+                "contentLength": size, "contentSha1": sha1,
+                "uploadTimestamp": int(time.time() * 1000)}
+
+    async def _b2_finish_large_file(self, request):
+        body = await request.json()
+        name, info, parts = self._large_files.pop(body["fileId"])
+        size = sum(size for size, _ in parts.values())
+        self.files[name] = (size, "none")
+        return self._file_version("upload", name, size, "none", info,
+                                  body["fileId"])
+
+    async def _b2_list_unfinished_large_files(self, request):
+        return {"files": [], "nextFileId": None}
+
+    async def _b2_list_parts(self, request):
+        return {"parts": [], "nextPartNumber": None}
+
+    async def _b2_cancel_large_file(self, request):
+        body = await request.json()
+        name, _, _ = self._large_files.pop(body["fileId"])
+        return {"fileId": body["fileId"], "fileName": name,
+                "accountId": "account", "bucketId": self.BUCKET_ID}
+
+    def _file_version(self, action, name, size, sha1, info, file_id=None):
+        return {
+            "accountId": "account", "action": action,
+            "bucketId": self.BUCKET_ID, "contentLength": size,
+            "contentSha1": sha1, "contentMd5": None,
+            "contentType": "application/octet-stream",
+            "fileId": file_id or "file-%d" % next(self._ids),
+            "fileInfo": info, "fileName": name,
+            "uploadTimestamp": int(time.time() * 1000),
+            "serverSideEncryption": {"mode": None},
+            "legalHold": {"isClientAuthorizedToRead": True, "value": None},
+            "fileRetention": {"isClientAuthorizedToRead": True,
+                              "value": {"mode": None}},
+        }
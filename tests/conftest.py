@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Dropzone hands actions its ``dropzone`` module when it runs them. Outside of
+Dropzone the tests use a stand-in that records every call instead of
+talking to Dropzone. B2 is b2sdk's simulator.
+"""
+import os
+import sys
+import types
+
+import pytest
+
+
+DZ_FUNCTIONS = ("add_dropbar", "alert", "begin", "determinate", "error",
+                "fail", "finish", "percent", "remove_value", "save_value",
+                "text", "url")
+"""The calls of Dropzone's API that the stand-in records"""
+
+
+def _make_dropzone():
+    module = types.ModuleType("dropzone")
+    module.calls = []
+
+    def recorder(name):
+        def record(*args):
+            module.calls.append((name,) + args)
+        return record
+
+    for name in DZ_FUNCTIONS:
+        setattr(module, name, recorder(name))
+    module.pashua = lambda config: {"cancelled": "1"}
+    return module
+
+
+sys.modules.setdefault("dropzone", _make_dropzone())
+
+
+@pytest.fixture(autouse=True)
+def environ(tmp_path):
+    """
+    Dropzone passes saved values to actions as environment variables, and
+    the account info writes them back there. Every test starts from the
+    same environment, with a support folder of its own.
+    """
+    saved = dict(os.environ)
+    os.environ["support_folder"] = str(tmp_path)
+    yield os.environ
+    os.environ.clear()
+    os.environ.update(saved)
+
+
+@pytest.fixture
+def dz():
+    """
+    The stand-in ``dropzone`` module, with no calls recorded yet.
+    """
+    module = sys.modules["dropzone"]
+    del module.calls[:]
+    return module
+
+
+@pytest.fixture
+def make_api(tmp_path):
+    """
+    A factory of authorized ``DropzoneB2Api`` objects that talk to b2sdk's
+    simulator and have a bucket called "bucket". Keyword arguments go to
+    ``DropzoneB2Api``.
+
+    :return: a callable returning the API and the bucket
+    """
+    from b2sdk.v2 import B2HttpApiConfig, RawSimulator
+    from b2dz.b2dz_account_info import DropzoneB2AccountInfo
+    from b2dz.dzapi import DropzoneB2Api
+
+    def make(**kwargs):
+        api = DropzoneB2Api(
+            DropzoneB2AccountInfo(),
+            api_config=B2HttpApiConfig(_raw_api_class=RawSimulator),
+            **kwargs)
+        simulator = api.session.raw_api
+        application_key_id, application_key = simulator.create_account()
+        api.authorize_account("production", application_key_id,
+                              application_key)
+        return api, api.create_bucket("bucket", "allPrivate")
+
+    return make
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for ``b2dz.dzasync``, uploading to a stand-in B2 server on localhost.
+"""
+import hashlib
+import os
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from b2sdk.sync.action import B2UploadAction
+from b2sdk.sync.encryption_provider import \
+    SERVER_DEFAULT_SYNC_ENCRYPTION_SETTINGS_PROVIDER
+
+from b2dz.b2dz_account_info import DropzoneB2AccountInfo
+from b2dz.dzapi import DropzoneB2Api
+from b2dz.dzasync import AsyncUploadEngine
+from tests.b2server import StandInB2
+
+
+@pytest.fixture
+def server():
+    server = StandInB2().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def api(server, monkeypatch):
+    # no need to wait between attempts here
+    async def back_off(attempt, error):
+        pass
+
+    monkeypatch.setattr(AsyncUploadEngine, "_back_off",
+                        staticmethod(back_off))
+    api = DropzoneB2Api(DropzoneB2AccountInfo())
+    api.authorize_account(server.realm, "key id", "key")
+    return api
+
+
+def upload(api, tmp_path, count=3):
+    """
+    Upload ``count`` small files through the engine.
+
+    :return: how many uploads failed and the files' SHA1s by name
+    :rtype: tuple[int,dict]
+    """
+    bucket = api.get_bucket_by_name(StandInB2.BUCKET_NAME)
+    engine = AsyncUploadEngine(api, concurrency=2)
+    engine.start()
+    sha1s = {}
+    for i in range(count):
+        path = tmp_path / ("file%d.txt" % i)
+        data = os.urandom(1000 + i)
+        path.write_bytes(data)
+        name = "folder/" + path.name
+        sha1s[name] = (len(data), hashlib.sha1(data).hexdigest())
+        engine.submit(B2UploadAction(
+            str(path), path.name, name, 1000, len(data),
+            SERVER_DEFAULT_SYNC_ENCRYPTION_SETTINGS_PROVIDER), bucket, None)
+    return engine.close(), sha1s
+
+
+def test_uploads_small_files(api, server, tmp_path):
+    failures, sha1s = upload(api, tmp_path)
+    assert failures == 0
+    assert server.files == sha1s
+    # the upload URL is handed from one file to the next
+    assert server.calls["b2_get_upload_url"] <= 2
+
+
+@pytest.mark.parametrize("status, code", [
+    (503, "service_unavailable"),
+    (429, "too_many_requests"),
+    (500, "internal_error"),
+])
+def test_retries_getting_an_upload_url(api, server, tmp_path, status, code):
+    server.fail("b2_get_upload_url", status, code, times=2)
+    failures, sha1s = upload(api, tmp_path, count=1)
+    assert failures == 0
+    assert server.files == sha1s
+    assert server.calls["b2_get_upload_url"] == 3
+
+
+def test_retries_failed_uploads_with_a_new_url(api, server, tmp_path):
+    server.fail("upload", 503, "service_unavailable")
+    failures, sha1s = upload(api, tmp_path, count=1)
+    assert failures == 0
+    assert server.files == sha1s
+    assert server.calls["b2_get_upload_url"] == 2
+
+
+def test_gives_up_after_too_many_attempts(api, server, tmp_path):
+    server.fail("b2_get_upload_url", 503, "service_unavailable",
+                times=AsyncUploadEngine.MAX_ATTEMPTS)
+    failures, _ = upload(api, tmp_path, count=1)
+    assert failures == 1
+    assert server.files == {}
+
+
+def test_does_not_retry_what_cannot_work(api, server, tmp_path):
+    server.fail("b2_get_upload_url", 400, "bad_request")
+    failures, _ = upload(api, tmp_path, count=1)
+    assert failures == 1
+    assert server.calls["b2_get_upload_url"] == 1
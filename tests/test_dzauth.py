@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for ``b2dz.dzauth``.
+"""
+import os
+import stat
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from b2sdk.v2 import B2HttpApiConfig, RawSimulator
+
+from b2dz.b2api import B2Dropzone
+from b2dz.b2dz_account_info import DropzoneB2AccountInfo
+from b2dz.dzapi import DropzoneB2Api
+from b2dz.dzauth import SharedAuthorization
+
+
+@pytest.fixture
+def shared_auth(tmp_path):
+    return SharedAuthorization(str(tmp_path / "auth.json"))
+
+
+@pytest.fixture
+def authorized(monkeypatch):
+    """
+    :return: the application key IDs every authorization was made with,
+             each taking long enough for another drop to come along
+    """
+    key_ids = []
+    authorize_account = RawSimulator.authorize_account
+
+    def slow(simulator, realm_url, application_key_id, application_key):
+        key_ids.append(application_key_id)
+        time.sleep(0.2)
+        return authorize_account(simulator, realm_url, application_key_id,
+                                 application_key)
+
+    monkeypatch.setattr(RawSimulator, "authorize_account", slow)
+    return key_ids
+
+
+def drop(shared_auth, accounts=1):
+    """
+    :return: the part of a ``B2Dropzone`` that authorizes, with settings and
+             a simulator of its own like a separate process would have. Its
+             keys are those of the last of ``accounts`` simulator accounts.
+    """
+    api = DropzoneB2Api(DropzoneB2AccountInfo(), api_config=B2HttpApiConfig(
+        _raw_api_class=RawSimulator))
+    for _ in range(accounts):
+        keys = api.session.raw_api.create_account()
+    api.account_info.application_key_id, api.account_info.application_key = \
+        keys
+    return SimpleNamespace(config=api.account_info, api=api,
+                           shared_auth=shared_auth)
+
+
+def test_drops_at_once_authorize_once(shared_auth, authorized):
+    drops = [drop(shared_auth) for _ in range(2)]
+    threads = [threading.Thread(target=B2Dropzone.ensure_authorized,
+                                args=(each,)) for each in drops]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)  # the first one is authorizing by now
+    for thread in threads:
+        thread.join()
+    assert len(authorized) == 1
+    assert drops[1].config.auth_token == drops[0].config.auth_token
+    assert not drops[1].config.needs_authorization
+    assert shared_auth.load()["auth_token"] == drops[0].config.auth_token
+
+
+def test_later_drop_reuses_the_token(shared_auth, authorized):
+    first, second = drop(shared_auth), drop(shared_auth)
+    B2Dropzone.ensure_authorized(first)
+    B2Dropzone.ensure_authorized(second)
+    assert len(authorized) == 1
+    assert second.config.export_auth_data() == first.config.export_auth_data()
+
+
+def test_other_key_authorizes_again(shared_auth, authorized):
+    first, second = drop(shared_auth), drop(shared_auth, accounts=2)
+    B2Dropzone.ensure_authorized(first)
+    B2Dropzone.ensure_authorized(second)
+    assert authorized == [first.config.application_key_id,
+                          second.config.application_key_id]
+    assert second.config.account_id != first.config.account_id
+    assert shared_auth.load()["application_key_id"] == \
+        second.config.application_key_id
+
+
+def test_expiring_token_is_not_reused(shared_auth, authorized):
+    first, second = drop(shared_auth), drop(shared_auth)
+    B2Dropzone.ensure_authorized(first)
+    auth_data = shared_auth.load()
+    auth_data["auth_time"] -= first.config.TOKEN_LIFETIME
+    shared_auth.save(auth_data)
+    B2Dropzone.ensure_authorized(second)
+    assert len(authorized) == 2
+    assert not second.config.needs_authorization
+
+
+def test_saved_only_for_the_user(shared_auth):
+    shared_auth.save({"auth_token": "secret"})
+    assert shared_auth.load() == {"auth_token": "secret"}
+    assert stat.S_IMODE(os.stat(shared_auth.filename).st_mode) == 0o600
+    assert not os.path.exists(shared_auth.filename + ".tmp")
+
+
+def test_unreadable_or_cleared_is_nothing(shared_auth):
+    assert shared_auth.load() is None
+    with open(shared_auth.filename, "w") as f:
+        f.write("{not json")
+    assert shared_auth.load() is None
+    shared_auth.clear()
+    shared_auth.clear()
+    assert not os.path.exists(shared_auth.filename)
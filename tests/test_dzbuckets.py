@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for ``b2dz.dzbuckets.BucketIndex``, and for how the account info keeps
+it between drops.
+"""
+from b2dz.b2dz_account_info import DropzoneB2AccountInfo
+from b2dz.dzbuckets import BucketIndex
+
+
+class Clock(object):
+    """A clock that only moves when told to"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_hit_and_miss():
+    index = BucketIndex(clock=Clock())
+    index.add("photos", "id-1")
+    assert index.get_id("photos") == "id-1"
+    assert index.get_name("id-1") == "photos"
+    assert "photos" in index
+    assert index.get_id("videos") is None
+    assert index.get_name("id-2") is None
+    assert "videos" not in index
+
+
+def test_entries_expire():
+    clock = Clock()
+    index = BucketIndex(ttl=60, clock=clock)
+    index.add("photos", "id-1")
+    clock.now += 59
+    index.add("videos", "id-2")
+    assert len(index) == 2
+    clock.now += 1
+    assert index.get_id("photos") is None
+    assert index.get_name("id-1") is None
+    assert index.items() == [("videos", "id-2")]
+    # B2 confirming it again renews it
+    index.add("photos", "id-1")
+    clock.now += 59
+    assert index.get_id("photos") == "id-1"
+    assert index.get_id("videos") is None
+
+
+def test_renamed_and_recreated_buckets():
+    index = BucketIndex(clock=Clock())
+    index.add("photos", "id-1")
+    # the bucket was deleted and its name taken by a new one
+    index.add("photos", "id-2")
+    assert index.get_id("photos") == "id-2"
+    assert index.get_name("id-1") is None
+    # a bucket ID only ever has one name
+    index.add("pictures", "id-2")
+    assert index.get_id("photos") is None
+    assert index.get_name("id-2") == "pictures"
+    assert index.remove("pictures")
+    assert not index.remove("pictures")
+    assert len(index) == 0
+
+
+def test_refresh_renews_listed_and_drops_the_rest():
+    clock = Clock()
+    index = BucketIndex(ttl=60, clock=clock)
+    index.add("photos", "id-1")
+    index.add("old", "id-0")
+    clock.now += 30
+    index.refresh([("photos", "id-1"), ("videos", "id-2")])
+    assert sorted(index.items()) == [("photos", "id-1"), ("videos", "id-2")]
+    assert index.get_name("id-0") is None
+    clock.now += 59
+    assert index.get_id("photos") == "id-1"
+
+
+def test_json_round_trip_leaves_out_expired_entries():
+    clock = Clock()
+    index = BucketIndex(ttl=60, clock=clock)
+    index.add("photos", "id-1")
+    clock.now += 30
+    index.add("videos", "id-2")
+    assert index.to_json() == {"photos": ["id-1", 1060],
+                               "videos": ["id-2", 1090]}
+    clock.now += 30
+    assert index.to_json() == {"videos": ["id-2", 1090]}
+    copy = BucketIndex.from_json(index.to_json(), clock=clock)
+    assert copy.get_name("id-2") == "videos"
+    clock.now += 30
+    assert copy.get_id("videos") is None
+
+
+def test_reads_what_older_versions_saved():
+    index = BucketIndex.from_json({"photos": "id-1"}, ttl=60, clock=Clock())
+    assert index.get_id("photos") == "id-1"
+    assert index.to_json() == {"photos": ["id-1", 1060]}
+
+
+def test_account_info_keeps_buckets_between_drops():
+    class Bucket(object):
+        name = "photos"
+        id_ = "id-1"
+
+    info = DropzoneB2AccountInfo()
+    info.save_bucket(Bucket())
+    info.flush()
+    info = DropzoneB2AccountInfo()
+    info.load_config()
+    assert info.get_bucket_id_or_none_from_bucket_name("photos") == "id-1"
+    assert info.get_bucket_name_or_none_from_bucket_id("id-1") == "photos"
+    info.remove_bucket_name("photos")
+    info.flush()
+    info = DropzoneB2AccountInfo()
+    info.load_config()
+    assert info.get_bucket_id_or_none_from_bucket_name("photos") is None
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for ``b2dz.dzcompress``.
+"""
+import gzip
+import hashlib
+import io
+import os
+import zlib
+
+import pytest
+
+from b2dz.dzcompress import CompressedStream, Compressor
+
+
+CHUNK_SIZE = 1000
+"""Small chunks, so a few kilobytes make a file of many of them"""
+
+
+@pytest.fixture
+def compressor(monkeypatch):
+    monkeypatch.setattr(Compressor, "CHUNK_SIZE", CHUNK_SIZE)
+    return Compressor(workers=2)
+
+
+def text(size):
+    line = b"".join(b"%d little bytes\n" % i for i in range(100))
+    return (line * (size // len(line) + 1))[:size]
+
+
+def test_caches_only_compressed_chunks(compressor, tmp_path):
+    path = tmp_path / "file.txt"
+    path.write_bytes(text(5 * CHUNK_SIZE))
+    source = compressor.upload_source(str(path))
+    with source.open() as stream:
+        stream.read()
+    assert len(source._chunks) == 5
+    for index, future in source._chunks.items():
+        assert future.result() == source.compressor.compress_chunk(
+            text(5 * CHUNK_SIZE)[index * CHUNK_SIZE:(index + 1) * CHUNK_SIZE],
+            index == 4)
+
+
+@pytest.mark.parametrize("size", [0, 500, CHUNK_SIZE, 5 * CHUNK_SIZE + 123])
+def test_stream_is_gzip(compressor, size):
+    data = text(size)
+    source = compressor.stream_upload_source(lambda: io.BytesIO(data), size,
+                                             "file.txt")
+    with source.open() as stream:
+        compressed = stream.read()
+    assert len(compressed) == source.get_content_length()
+    assert hashlib.sha1(compressed).hexdigest() == source.get_content_sha1()
+    assert gzip.decompress(compressed) == data
+    assert len(source.chunks) == max(1, -(-size // CHUNK_SIZE))
+
+
+def test_chunks_decompress_on_their_own(compressor):
+    data = text(5 * CHUNK_SIZE + 123)
+    source = compressor.stream_upload_source(lambda: io.BytesIO(data),
+                                             len(data), "file.txt")
+    with source.open() as stream:
+        compressed = stream.read()
+    for offset, length, compressed_offset, compressed_length in \
+            source.chunk_index():
+        chunk = compressed[compressed_offset:
+                           compressed_offset + compressed_length]
+        assert zlib.decompressobj(-zlib.MAX_WBITS).decompress(chunk) == \
+            data[offset:offset + length]
+
+
+def test_seeks_anywhere(compressor):
+    data = text(5 * CHUNK_SIZE + 123)
+    source = compressor.stream_upload_source(lambda: io.BytesIO(data),
+                                             len(data), "file.txt")
+    with source.open() as stream:
+        compressed = stream.read()
+    # from a fresh source as well, so chunks are compressed out of order
+    for source in (source, compressor.stream_upload_source(
+            lambda: io.BytesIO(data), len(data), "file.txt")):
+        for position in (len(compressed) - 1, 3, 10, source.offsets[3] - 1,
+                         source.offsets[3], len(compressed) // 2, 0):
+            stream = CompressedStream(source)
+            assert stream.seek(position) == position
+            buffer = bytearray(700)
+            read = stream.readinto(buffer)
+            assert 0 < read <= 700
+            assert bytes(buffer[:read]) == compressed[position:position + read]
+            stream.seek(-read, io.SEEK_CUR)
+            assert stream.tell() == position
+            with io.BufferedReader(stream) as reader:
+                assert reader.read() == compressed[position:]
+        stream = CompressedStream(source)
+        stream.seek(0, io.SEEK_END)
+        assert stream.readinto(bytearray(10)) == 0
+
+
+def test_notices_files_changing_while_uploading(compressor):
+    data = bytearray(text(3 * CHUNK_SIZE))
+    source = compressor.stream_upload_source(
+        lambda: io.BytesIO(bytes(data)), len(data), "file.txt")
+    data[2 * CHUNK_SIZE:] = b"\0" * CHUNK_SIZE
+    with pytest.raises(ValueError, match="changed"):
+        with source.open() as stream:
+            stream.read()
+
+
+def test_only_compressible_files_are_worth_it(compressor, tmp_path):
+    path = tmp_path / "file"
+    path.write_bytes(text(100 * 1000))
+    assert compressor.is_worth_it(str(path), 100 * 1000)
+    assert not compressor.is_worth_it(str(path), Compressor.MIN_SIZE - 1)
+    path.write_bytes(os.urandom(100 * 1000))
+    assert not compressor.is_worth_it(str(path), 100 * 1000)
+
+
+def test_uploads_compressed(make_api, tmp_path):
+    api, bucket = make_api(compressor=Compressor())
+    path = tmp_path / "file.txt"
+    path.write_bytes(text(100 * 1000))
+    file_version = bucket.upload_local_file(str(path), "file.txt")
+    assert file_version.file_info["b2-content-encoding"] == "gzip"
+    assert file_version.size < 100 * 1000
+    path = tmp_path / "file.bin"
+    path.write_bytes(os.urandom(100 * 1000))
+    file_version = bucket.upload_local_file(str(path), "file.bin")
+    assert "b2-content-encoding" not in file_version.file_info
+    assert file_version.size == 100 * 1000
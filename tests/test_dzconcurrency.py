@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for ``b2dz.dzconcurrency``, driven by a simulated bandwidth-limited
+backend and a simulated clock.
+"""
+import sys
+import time
+from contextlib import ExitStack
+
+from b2dz.dzconcurrency import ConcurrencyController
+from b2dz.dzprogress import DropzoneSyncReport
+
+
+MEGABYTE = 1000 * 1000
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class SimulatedLink(object):
+    """
+    A connection that gives every transfer up to ``per_transfer`` bytes per
+    second and all of them together up to ``capacity``.
+    """
+
+    def __init__(self, capacity, per_transfer):
+        self.capacity = capacity
+        self.per_transfer = per_transfer
+
+    def rate(self, transfers):
+        return min(self.capacity, transfers * self.per_transfer)
+
+
+def run(controller, clock, link, seconds, tick=0.25):
+    """
+    Keep as many transfers running as the controller allows for ``seconds``
+    and report their bytes every ``tick``, the way the progress reporter
+    does while files are uploading.
+
+    :return: the limit after every tick
+    :rtype: list[int]
+    """
+    limits = []
+    for _ in range(int(seconds / tick)):
+        with ExitStack() as slots:
+            for _ in range(controller.limit):
+                slots.enter_context(controller.slot())
+            clock.now += tick
+            controller.record(int(link.rate(controller.active) * tick))
+        limits.append(controller.limit)
+    return limits
+
+
+def test_ramps_up_to_what_the_link_can_take():
+    clock = FakeClock()
+    link = SimulatedLink(capacity=10 * MEGABYTE, per_transfer=MEGABYTE)
+    controller = ConcurrencyController(initial=2, maximum=16, clock=clock)
+    limits = run(controller, clock, link, seconds=120)
+    assert limits == sorted(limits)
+    # one more than the link needs is tried, then it stops adding
+    assert 10 <= controller.limit <= 11
+
+
+def test_stays_small_on_a_slow_link():
+    clock = FakeClock()
+    link = SimulatedLink(capacity=2 * MEGABYTE, per_transfer=MEGABYTE)
+    controller = ConcurrencyController(initial=1, maximum=16, clock=clock)
+    run(controller, clock, link, seconds=120)
+    assert controller.limit <= 3
+
+
+def test_one_long_transfer_gives_samples():
+    # nothing finishes for the whole run, bytes still arrive every tick
+    clock = FakeClock()
+    link = SimulatedLink(capacity=10 * MEGABYTE, per_transfer=MEGABYTE)
+    controller = ConcurrencyController(initial=1, maximum=16, clock=clock)
+    run(controller, clock, link, seconds=10)
+    assert controller.limit > 1
+
+
+def test_backs_off_once_per_burst_of_errors():
+    clock = FakeClock()
+    controller = ConcurrencyController(initial=12, maximum=16, clock=clock)
+    controller.back_off()
+    controller.back_off()
+    assert controller.limit == 6
+    clock.now += ConcurrencyController.SAMPLE_INTERVAL
+    controller.back_off()
+    assert controller.limit == 3
+    for _ in range(5):
+        clock.now += ConcurrencyController.SAMPLE_INTERVAL
+        controller.back_off()
+    assert controller.limit == controller.minimum
+
+
+def test_fixed_limit_never_changes():
+    clock = FakeClock()
+    link = SimulatedLink(capacity=100 * MEGABYTE, per_transfer=MEGABYTE)
+    controller = ConcurrencyController(fixed=3, clock=clock)
+    run(controller, clock, link, seconds=60)
+    controller.back_off()
+    assert controller.limit == 3
+
+
+def test_report_feeds_bytes_while_transferring(dz):
+    recorded = []
+    report = DropzoneSyncReport(sys.stdout, True,
+                                bytes_listener=recorded.append)
+    try:
+        report.update_transfer(0, 1000)
+        report.update_transfer(0, 500)
+        deadline = time.monotonic() + 5
+        while sum(recorded) < 1500 and time.monotonic() < deadline:
+            time.sleep(report.SAMPLE_INTERVAL)
+        assert sum(recorded) == 1500
+        report.update_transfer(1, 250)
+    finally:
+        report.close()
+    assert sum(recorded) == 1750
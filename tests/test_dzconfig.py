@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for ``b2dz.dzconfig``, and for how little the clicked and dragged paths
+import.
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+
+from b2dz.dzconfig import ConfigDialog, DropzoneConfig, load_config
+
+
+PACKAGE_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+"""The action's folder, where ``b2dz`` can be imported from"""
+
+IMPORT_BUDGET = 0.2
+"""Seconds the clicked path may spend importing b2dz, b2sdk alone takes
+longer than that. Also what b2dz's own modules may take on the dragged
+path."""
+
+_STAND_IN = """
+import sys, types
+dropzone = types.ModuleType("dropzone")
+for name in ("alert", "fail", "remove_value", "save_value", "url"):
+    setattr(dropzone, name, lambda *args: None)
+dropzone.pashua = lambda config: {"cancelled": "1"}
+sys.modules["dropzone"] = dropzone
+"""
+"""Installs a stand-in of Dropzone's module"""
+
+_CLICK = _STAND_IN + """
+import b2dz
+b2dz.clicked()
+print("imported:", *sorted(m for m in sys.modules
+                                  if m.split(".")[0] in ("b2sdk", "aiohttp")))
+"""
+"""Clicks the action and cancels the dialog, then prints what it imported"""
+
+_DRAG = _STAND_IN + """
+from b2dz.b2api import B2Dropzone
+print("imported:", *sorted(m for m in sys.modules if m in (
+    "aiohttp", "asyncio", "tarfile", "zstandard", "b2dz.dzasync",
+    "b2dz.dzcompress", "b2dz.dzpack")))
+"""
+"""Imports what every drop needs, then prints which of the modules only
+some drops use came along"""
+
+_IMPORT_TIME = re.compile(
+    r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+"""A line of ``-X importtime``: own and cumulative microseconds, nesting,
+module"""
+
+
+def import_times(script):
+    """
+    :return: what ``script`` printed last and the ``-X importtime`` lines it
+             caused, as (own, cumulative microseconds, top level, module)
+    :rtype: tuple[str, list[tuple[int, int, bool, str]]]
+    """
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        cwd=PACKAGE_FOLDER, env=env, capture_output=True, text=True,
+        check=True)
+    times = []
+    for line in process.stderr.splitlines():
+        match = _IMPORT_TIME.match(line)
+        if match:
+            times.append((int(match.group(1)), int(match.group(2)),
+                          not match.group(3), match.group(4)))
+    return process.stdout.splitlines()[-1], times
+
+
+def test_clicking_does_not_import_b2sdk():
+    imported, times = import_times(_CLICK)
+    assert imported == "imported:"
+    # only what b2dz imports itself, not the stand-in's imports
+    micros = sum(cumulative for _, cumulative, top_level, module in times
+                 if top_level and module.split(".")[0] == "b2dz")
+    assert 0 < micros < IMPORT_BUDGET * 1000 * 1000
+
+
+def test_dragging_imports_only_what_every_drop_needs():
+    imported, times = import_times(_DRAG)
+    assert imported == "imported:"
+    # b2sdk's share is out of our hands, b2dz's own modules aren't
+    micros = sum(own for own, _, _, module in times
+                 if module.split(".")[0] == "b2dz")
+    assert 0 < micros < IMPORT_BUDGET * 1000 * 1000
+
+
+def test_dialog_stages_and_publishes_saved_settings(dz, monkeypatch,
+                                                    tmp_path):
+    monkeypatch.setattr(dz, "pashua", lambda config: {
+        "saved": "1", "cancelled": "0", "clear_cache": "0",
+        "application_key_id": "key id", "application_key": "secret",
+        "rate_limit": "500", "rate_schedule": "09:00-17:00=100",
+    })
+    dialog = ConfigDialog(DropzoneConfig())
+    assert dialog.show()
+    assert dialog.config.flush() > 0
+    assert ("save_value", DropzoneConfig.ACCESS_KEY_KEY, "key id") in dz.calls
+    assert load_config().rate_limit == 500
+    with open(str(tmp_path / "throttle.json")) as f:
+        assert json.load(f)["rate_limit"] == 500 * 1000
+
+
+def test_dialog_asks_again_for_invalid_settings(dz, monkeypatch):
+    answers = iter([
+        {"saved": "1", "cancelled": "0", "application_key_id": "key id",
+         "application_key": "secret", "workers": "none"},
+        {"saved": "0", "cancelled": "1"},
+    ])
+    monkeypatch.setattr(dz, "pashua", lambda config: next(answers))
+    dialog = ConfigDialog(DropzoneConfig())
+    assert not dialog.show()
+    assert dz.calls[0][:2] == ("alert", "Invalid Configuration")
+    assert not dialog.config.is_valid
+
+
+def test_clear_cache_clears_the_given_caches(dz, monkeypatch):
+    class Cache(object):
+        cleared = False
+
+        def clear(self):
+            self.cleared = True
+
+    answers = iter([{"clear_cache": "1"}, {"saved": "0", "cancelled": "1"}])
+    monkeypatch.setattr(dz, "pashua", lambda config: next(answers))
+    config = DropzoneConfig()
+    config.throughput = 1000
+    cache = Cache()
+    assert not ConfigDialog(config, caches=[cache]).show()
+    assert cache.cleared
+    assert config.throughput is None
+
+
+def test_flush_sends_changed_values_once(dz):
+    config = DropzoneConfig(application_key_id="key id",
+                            application_key="secret")
+    config.save_config()
+    config.bucket_name = "bucket"
+    config.save_config()
+    config.save_config()
+    sent = config.flush()
+    keys = [call[1] for call in dz.calls]
+    assert len(keys) == sent == len(set(keys))
+    assert {DropzoneConfig.ACCESS_KEY_KEY, DropzoneConfig.SECRET_KEY_KEY,
+            DropzoneConfig.BUCKET_NAME_KEY} <= set(keys)
+    # a value changed back before the flush isn't sent at all
+    config.bucket_name = "other"
+    config.save_config()
+    config.bucket_name = "bucket"
+    config.save_config()
+    assert config.flush() == 0
+    config = load_config()
+    config.save_config()
+    assert config.flush() == 0
+    assert len(dz.calls) == sent
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for ``b2dz.dzdaemon``, with a daemon that pretends to upload.
+"""
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from b2dz.dzdaemon import DaemonClient, DaemonError, DaemonUnavailable, \
+    DropzoneDaemon
+
+
+class Dropzone(object):
+    """Records the calls forwarded to it, ``inputbox`` answers"""
+
+    def __init__(self):
+        self.calls = []
+
+    def text(self, message):
+        self.calls.append(("text", message))
+
+    def inputbox(self, title, prompt):
+        self.calls.append(("inputbox", title, prompt))
+        return "answer"
+
+
+@pytest.fixture
+def path():
+    # socket paths have to be short, pytest's temporary folders may not be
+    folder = tempfile.mkdtemp(prefix="b2dz")
+    yield os.path.join(folder, "b2dz.sock")
+    shutil.rmtree(folder)
+
+
+def serve(daemon, upload=None):
+    """
+    :return: the thread the daemon runs in, once it is listening
+    :rtype: threading.Thread
+    """
+    if upload is not None:
+        daemon._upload = upload
+    daemon.b2dz = SimpleNamespace(finish_message="Done.")
+    thread = threading.Thread(target=daemon.serve_forever)
+    thread.start()
+    for _ in range(500):
+        if os.path.exists(daemon.path) and daemon._is_listening():
+            return thread
+        time.sleep(0.01)
+    raise AssertionError("the daemon didn't start")
+
+
+def test_forwards_calls_both_ways(path):
+    daemon = DropzoneDaemon(path, idle_timeout=0.5)
+    requests = []
+
+    def upload(request):
+        requests.append(request)
+        daemon.call("text", ("Uploading",))
+        return "https://example.com/" + daemon.call("inputbox",
+                                                    ("Title", "Prompt"))
+
+    thread = serve(daemon, upload)
+    dropzone = Dropzone()
+    client = DaemonClient(dropzone, path)
+    assert client.upload(["/a", "/b"], "Shift") == "https://example.com/answer"
+    assert client.finish_message == "Done."
+    assert dropzone.calls == [("text", "Uploading"),
+                              ("inputbox", "Title", "Prompt")]
+    assert requests[0]["items"] == ["/a", "/b"]
+    assert requests[0]["key_modifier"] == "Shift"
+    thread.join(5)
+
+
+def test_failed_drops_raise_daemon_errors(path):
+    def upload(request):
+        raise ValueError("Bucket is gone.")
+
+    thread = serve(DropzoneDaemon(path, idle_timeout=0.5), upload)
+    with pytest.raises(DaemonError, match="Bucket is gone."):
+        DaemonClient(Dropzone(), path).upload(["/a"])
+    thread.join(5)
+
+
+def test_client_makes_only_forwarded_calls(path):
+    daemon = DropzoneDaemon(path, idle_timeout=0.5)
+
+    def upload(request):
+        daemon.call("__init__", ())
+        return "url"
+
+    thread = serve(daemon, upload)
+    with pytest.raises(DaemonError, match="unknown call"):
+        DaemonClient(Dropzone(), path).upload(["/a"])
+    thread.join(5)
+
+
+def test_exits_when_idle(path):
+    thread = serve(DropzoneDaemon(path, idle_timeout=0.2))
+    thread.join(5)
+    assert not thread.is_alive()
+    assert not os.path.exists(path)
+    with pytest.raises(DaemonUnavailable):
+        DaemonClient(Dropzone(), path).upload(["/a"])
+
+
+def test_replaces_a_stale_socket(path):
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()  # as a daemon that crashed leaves it
+    with pytest.raises(DaemonUnavailable):
+        DaemonClient(Dropzone(), path).upload(["/a"])
+    thread = serve(DropzoneDaemon(path, idle_timeout=0.5),
+                   lambda request: "url")
+    assert DaemonClient(Dropzone(), path).upload(["/a"]) == "url"
+    thread.join(5)
+
+
+def test_leaves_a_running_daemon_alone(path):
+    thread = serve(DropzoneDaemon(path, idle_timeout=1),
+                   lambda request: "first")
+    DropzoneDaemon(path).serve_forever()
+    # the second one gave up without removing the first one's socket
+    assert DaemonClient(Dropzone(), path).upload(["/a"]) == "first"
+    thread.join(5)
+
+
+
+def test_losing_the_race_leaves_the_winners_socket(path, monkeypatch):
+    daemons = [DropzoneDaemon(path, idle_timeout=1) for _ in range(2)]
+    for daemon in daemons:
+        daemon._upload = lambda request: "url"
+        daemon.b2dz = SimpleNamespace(finish_message=None)
+    threads = [threading.Thread(target=daemon.serve_forever)
+               for daemon in daemons]
+    bind = socket.socket.bind
+    started = []
+
+    def late_bind(sock, address):
+        if not started:
+            # the other daemon gets going just before this one binds
+            started.append(True)
+            threads[1].start()
+            time.sleep(0.2)
+        return bind(sock, address)
+
+    monkeypatch.setattr(socket.socket, "bind", late_bind)
+    threads[0].start()
+    time.sleep(0.5)
+    assert sum(thread.is_alive() for thread in threads) == 1
+    assert DaemonClient(Dropzone(), path).upload(["/a"]) == "url"
+    for thread in threads:
+        thread.join(5)
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for ``b2dz.dzfolder``.
+"""
+import time
+
+from b2sdk.sync.folder import LocalFolder
+
+from b2dz.dzfolder import ScandirFolder
+
+
+def relative_paths(folder):
+    return [(p.relative_path, p.size) for p in folder.all_files(None)]
+
+
+def test_lists_like_b2sdk(tmp_path):
+    root = tmp_path / "root"
+    root.mkdir()
+    (root / "a-b").write_bytes(b"x")
+    (root / "a.txt").write_bytes(b"xy")
+    for relative_path in ("a/b", "a/c/d", "a0/e", "b/f", "b/g/h", "b/g/i",
+                          "c"):
+        path = root / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(relative_path.encode("utf-8"))
+    expected = relative_paths(LocalFolder(str(root)))
+    assert len(expected) == 9
+    assert relative_paths(ScandirFolder(str(root))) == expected
+
+
+def test_stops_listing_when_the_sync_stops(tmp_path, monkeypatch):
+    root = tmp_path / "root"
+    for i in range(50):
+        folder = root / ("%02d" % i)
+        folder.mkdir(parents=True)
+        (folder / "file").write_bytes(b"x")
+    scanned = []
+    scan = ScandirFolder._scan
+
+    def slow_scan(self, local_dir, *args):
+        scanned.append(local_dir)
+        time.sleep(0.01)
+        return scan(self, local_dir, *args)
+
+    monkeypatch.setattr(ScandirFolder, "_scan", slow_scan)
+    monkeypatch.setattr(ScandirFolder, "SCAN_WORKERS", 1)
+    files = ScandirFolder(str(root)).all_files(None)
+    next(files)
+    files.close()
+    # the root, the first folder and what one thread listed meanwhile
+    assert len(scanned) < 10
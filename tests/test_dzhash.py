@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for ``b2dz.dzhash``.
+"""
+import hashlib
+import io
+import os
+import threading
+import time
+
+from b2dz.dzhash import FileHasher, HashAhead
+
+
+def sha1(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def test_remembers_hashes(tmp_path):
+    path = tmp_path / "file"
+    path.write_bytes(b"x" * 1000)
+    hasher = FileHasher()
+    assert hasher.cached_sha1(str(path)) is None
+    assert hasher.sha1_of_file(str(path)) == sha1(b"x" * 1000)
+    assert hasher.cached_sha1(str(path)) == sha1(b"x" * 1000)
+    assert hasher.sha1_of_file(str(path)) == sha1(b"x" * 1000)
+    assert hasher.bytes_hashed == 1000
+    # peeking with cached_sha1 is neither
+    assert (hasher.hits, hasher.misses) == (1, 1)
+    assert hasher.hit_rate == 0.5
+
+
+def test_hashes_changed_files_again(tmp_path):
+    path = tmp_path / "file"
+    path.write_bytes(b"x" * 1000)
+    hasher = FileHasher()
+    hasher.sha1_of_file(str(path))
+    path.write_bytes(b"y" * 1000)
+    os.utime(str(path), ns=(0, 1))
+    assert hasher.sha1_of_file(str(path)) == sha1(b"y" * 1000)
+    assert hasher.bytes_hashed == 2000
+
+
+def test_memo_outlives_the_hasher(tmp_path):
+    path = tmp_path / "file"
+    path.write_bytes(b"x" * 1000)
+    memo = str(tmp_path / "memo.db")
+    hasher = FileHasher(memo)
+    hasher.sha1_of_file(str(path))
+    hasher.close()
+    hasher = FileHasher(memo)
+    assert hasher.sha1_of_file(str(path)) == sha1(b"x" * 1000)
+    assert hasher.bytes_hashed == 0
+    hasher.clear()
+    assert hasher.cached_sha1(str(path)) is None
+
+
+def test_hashes_ranges_read_and_mapped(tmp_path, monkeypatch):
+    data = os.urandom(10000)
+    path = tmp_path / "file"
+    path.write_bytes(data)
+    monkeypatch.setattr(FileHasher, "BUFFER_SIZE", 300)
+    for mmap_min_size in (len(data) + 1, 0):
+        monkeypatch.setattr(FileHasher, "MMAP_MIN_SIZE", mmap_min_size)
+        hasher = FileHasher()
+        for offset, length in ((0, 1000), (1000, 4096), (9000, 1000)):
+            assert hasher.sha1_of_range(str(path), offset, length) == \
+                sha1(data[offset:offset + length])
+        # a range isn't the whole file
+        assert hasher.cached_sha1(str(path)) is None
+        assert hasher.sha1_of_range(str(path), 9000, None) == \
+            sha1(data[9000:])
+        assert hasher.cached_sha1(str(path), 9000, 1000) == sha1(data[9000:])
+
+
+def test_hashes_a_file_once_for_many_threads(tmp_path, monkeypatch):
+    path = tmp_path / "file"
+    path.write_bytes(b"x" * 1000)
+    hashed = []
+    hash_ = FileHasher._hash
+
+    def slow_hash(self, *args):
+        hashed.append(args)
+        time.sleep(0.1)
+        return hash_(self, *args)
+
+    monkeypatch.setattr(FileHasher, "_hash", slow_hash)
+    hasher = FileHasher()
+    sha1s = []
+    threads = [threading.Thread(
+        target=lambda: sha1s.append(hasher.sha1_of_file(str(path))))
+        for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sha1s == [sha1(b"x" * 1000)] * 4
+    assert len(hashed) == 1
+
+
+class RecordingHasher(object):
+    """Records what it hashes, waiting for ``released`` before each file"""
+
+    def __init__(self):
+        self.hashed = []
+        self.released = threading.Event()
+
+    def sha1_of_file(self, local_path):
+        self.released.wait(5)
+        self.hashed.append(local_path)
+        if local_path == "missing":
+            raise OSError(local_path)
+        return "sha1"
+
+
+def test_hash_ahead_memoizes_the_hashes(tmp_path):
+    path = tmp_path / "file"
+    path.write_bytes(b"x" * 1000)
+    hasher = FileHasher()
+    hash_ahead = HashAhead(hasher, workers=1)
+    hash_ahead.submit(str(path))
+    hash_ahead.close()
+    hash_ahead._threads[0].join(5)
+    assert hasher.cached_sha1(str(path)) == sha1(b"x" * 1000)
+
+
+def test_hash_ahead_hashes_every_file_once():
+    hasher = RecordingHasher()
+    hash_ahead = HashAhead(hasher, workers=2)
+    for path in ("a", "missing", "b", "a", "b", "a"):
+        hash_ahead.submit(path)
+    hasher.released.set()
+    while len(hasher.hashed) < 3:
+        threading.Event().wait(0.01)
+    hash_ahead.close()
+    for thread in hash_ahead._threads:
+        thread.join(5)
+        assert not thread.is_alive()
+    assert sorted(hasher.hashed) == ["a", "b", "missing"]
+
+
+def test_closing_drops_what_is_not_hashed_yet():
+    hasher = RecordingHasher()
+    hash_ahead = HashAhead(hasher, workers=1)
+    for i in range(10):
+        hash_ahead.submit("file%d" % i)
+    hash_ahead.close()
+    hash_ahead.submit("late")
+    hasher.released.set()
+    thread, = hash_ahead._threads
+    assert thread.daemon
+    thread.join(5)
+    # only what the thread had already taken
+    assert hasher.hashed in ([], ["file0"])
+
+
+def test_uploads_mapped_and_empty_files(make_api, tmp_path):
+    api, bucket = make_api(hasher=FileHasher())
+    for size in (0, 1, 5000):
+        data = os.urandom(size)
+        path = tmp_path / ("file%d" % size)
+        path.write_bytes(data)
+        assert bucket.upload_local_file(str(path), path.name).size == size
+        out = io.BytesIO()
+        bucket.download_file_by_name(path.name).save(out)
+        assert out.getvalue() == data
+
+
+def test_upload_probes_are_not_misses(make_api, tmp_path):
+    hasher = FileHasher()
+    api, bucket = make_api(hasher=hasher)
+    path = tmp_path / "file"
+    path.write_bytes(b"x" * 300)
+    bucket.upload_local_file(str(path), "first")
+    assert (hasher.hits, hasher.misses) == (0, 1)
+    # the second upload's hash comes from the memo, and peeking at the
+    # memo to tell B2 the SHA1 up front doesn't count
+    bucket.upload_local_file(str(path), "second")
+    assert (hasher.hits, hasher.misses) == (1, 1)
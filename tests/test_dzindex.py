@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for ``b2dz.dzindex``, against b2sdk's simulator.
+"""
+import io
+import time
+from types import SimpleNamespace
+
+import pytest
+from b2sdk.sync.folder import LocalFolder
+from b2sdk.sync.report import SyncReport
+from b2sdk.v2 import RawSimulator, parse_sync_folder
+
+from b2dz.dzconfig import DropzoneConfig
+from b2dz.dzindex import BlindB2Folder, IndexedB2Folder, UploadIndex
+from b2dz.dzsync import DropzoneSynchronizer
+
+
+LATENCY = 0.1
+"""Seconds the slowed down simulator takes to list a page of files"""
+
+
+class SimulatorCalls(object):
+    """Slows listings down and records when calls were made"""
+
+    LISTINGS = ("list_file_names", "list_file_versions")
+
+    def __init__(self, monkeypatch):
+        self.calls = []
+        for name in self.LISTINGS + ("upload_file",):
+            call = getattr(RawSimulator, name)
+
+            def recorded(simulator, *args, name=name, call=call, **kwargs):
+                self.calls.append((name, time.monotonic()))
+                if name in self.LISTINGS:
+                    time.sleep(LATENCY)
+                return call(simulator, *args, **kwargs)
+
+            monkeypatch.setattr(RawSimulator, name, recorded)
+
+    def listings(self):
+        return [name for name, _ in self.calls if name in self.LISTINGS]
+
+    def first_upload(self):
+        return min(when for name, when in self.calls if name == "upload_file")
+
+
+def file_version(file_name, size=100, sha1="sha1", bucket_id="bucket-id",
+                 upload_timestamp=1, file_info=None):
+    return SimpleNamespace(
+        bucket_id=bucket_id, file_name=file_name, id_="id-" + file_name,
+        size=size, mod_time_millis=1000, content_sha1=sha1,
+        upload_timestamp=upload_timestamp, file_info=file_info or {})
+
+
+def names(rows):
+    return [row[0] for row in rows]
+
+
+def test_index_lists_folders_like_b2():
+    index = UploadIndex(":memory:")
+    for name in ("a/b", "a/c/d", "a-b", "a0", "ab/c", "b"):
+        index.record(file_version(name))
+    index.record(file_version("a/b", bucket_id="other"))
+    assert names(index.files_under("bucket-id", "a")) == ["a/b", "a/c/d"]
+    assert names(index.files_under("bucket-id", "a/c")) == ["a/c/d"]
+    assert names(index.files_under("bucket-id", "")) == \
+        ["a-b", "a/b", "a/c/d", "a0", "ab/c", "b"]
+    index.forget("bucket-id", "a/b")
+    assert names(index.files_under("bucket-id", "a")) == ["a/c/d"]
+
+
+def test_index_replaces_a_listed_folder():
+    index = UploadIndex(":memory:")
+    for name in ("a/old", "a/kept", "b/other"):
+        index.record(file_version(name))
+    assert not index.is_fresh("bucket-id", "a")
+    index.replace_folder("bucket-id", "a", [file_version("a/kept"),
+                                            file_version("a/new")])
+    assert names(index.files_under("bucket-id", "")) == \
+        ["a/kept", "a/new", "b/other"]
+    # a listing of a folder covers the folders in it
+    assert index.is_fresh("bucket-id", "a")
+    assert index.is_fresh("bucket-id", "a/c")
+    assert not index.is_fresh("bucket-id", "b")
+    assert not index.is_fresh("other", "a")
+    assert not index.is_fresh("bucket-id", "a", max_age=-1)
+    index.clear()
+    assert not index.is_fresh("bucket-id", "a")
+    assert index.files_under("bucket-id", "") == []
+
+
+def test_index_keeps_what_was_recorded_while_listing():
+    index = UploadIndex(":memory:")
+    index.record(file_version("a/old"))
+    listed_at = time.time()
+    # uploaded while the listing was read, which may or may not have seen it
+    index.record(file_version("a/new", sha1="new"))
+    index.record(file_version("a/newer", sha1="newer"))
+    index.replace_folder("bucket-id", "a", [file_version("a/newer"),
+                                            file_version("a/listed")],
+                         listed_at)
+    rows = index.files_under("bucket-id", "a")
+    assert names(rows) == ["a/listed", "a/new", "a/newer"]
+    assert [row[4] for row in rows] == ["sha1", "new", "newer"]
+    assert index.is_fresh("bucket-id", "a")
+
+
+def test_index_finds_copies():
+    index = UploadIndex(":memory:")
+    index.record(file_version("old", sha1="abc", upload_timestamp=1))
+    index.record(file_version("new", sha1="abc", upload_timestamp=2))
+    index.record(file_version("large", size=200, sha1="none",
+                              file_info={"large_file_sha1": "def"}))
+    index.record(file_version("compressed", size=300, sha1="ghi",
+                              file_info={"b2-content-encoding": "gzip"}))
+    assert index.has_size("bucket-id", 100)
+    assert index.find_by_sha1("bucket-id", "abc", 100) == ("id-new", "new")
+    assert index.find_by_sha1("bucket-id", "abc", 101) is None
+    assert index.find_by_sha1("other", "abc", 100) is None
+    assert index.find_by_sha1("bucket-id", "def", 200) == ("id-large",
+                                                            "large")
+    # its SHA1 is of what was sent, not of the local file
+    assert not index.has_size("bucket-id", 300)
+    assert index.find_by_sha1("bucket-id", "ghi", 300) is None
+
+
+def test_repeat_drops_are_answered_from_the_index(make_api, monkeypatch,
+                                                  tmp_path):
+    api, bucket = make_api(upload_index=UploadIndex(":memory:"))
+    source = tmp_path / "drop"
+    source.mkdir()
+    (source / "file").write_bytes(b"new")
+    calls = SimulatorCalls(monkeypatch)
+
+    def drop():
+        with SyncReport(io.StringIO(), True) as reporter:
+            DropzoneSynchronizer(max_workers=2).sync_many([(
+                parse_sync_folder(str(source), api),
+                parse_sync_folder("b2://bucket/drops", api,
+                                  b2_folder_class=IndexedB2Folder))],
+                0, reporter)
+
+    drop()
+    assert len(calls.listings()) == 1
+    (source / "other").write_bytes(b"newer")
+    drop()
+    assert len(calls.listings()) == 1
+    assert [name for name, _ in calls.calls].count("upload_file") == 2
+    assert names(api.upload_index.files_under(bucket.id_, "drops")) == \
+        ["drops/file", "drops/other"]
+
+
+def test_uploads_made_while_listing_stay_indexed(make_api, monkeypatch,
+                                                tmp_path):
+    api, bucket = make_api(upload_index=UploadIndex(":memory:"))
+    bucket.upload_bytes(b"old", "drops/zz")
+    source = tmp_path / "drop"
+    source.mkdir()
+    for i in range(5):
+        (source / ("a%d" % i)).write_bytes(b"new")
+    all_files = LocalFolder.all_files
+
+    def slow_files(self, *args, **kwargs):
+        for path in all_files(self, *args, **kwargs):
+            time.sleep(LATENCY)
+            yield path
+
+    monkeypatch.setattr(LocalFolder, "all_files", slow_files)
+    with SyncReport(io.StringIO(), True) as reporter:
+        DropzoneSynchronizer(max_workers=2).sync_many([(
+            LocalFolder(str(source)),
+            parse_sync_folder("b2://bucket/drops", api,
+                              b2_folder_class=IndexedB2Folder))],
+            0, reporter)
+    assert names(api.upload_index.files_under(bucket.id_, "drops")) == \
+        ["drops/a%d" % i for i in range(5)] + ["drops/zz"]
+    assert api.upload_index.is_fresh(bucket.id_, "drops")
+
+
+@pytest.mark.parametrize("prefix, unique", [
+    (None, False), ("drops", False), ("%Y/%m/%d", False),
+    ("%Y/%m/%d/%H%M%S", True), ("%s", True), ("%%S", False), ("%%%S", True),
+])
+def test_prefix_is_unique(prefix, unique):
+    assert DropzoneConfig(prefix=prefix).prefix_is_unique is unique
+
+
+@pytest.mark.parametrize("b2_folder_class", [IndexedB2Folder, BlindB2Folder])
+def test_blind_uploads_list_nothing(make_api, monkeypatch, tmp_path,
+                                    b2_folder_class):
+    api, bucket = make_api(upload_index=UploadIndex(":memory:"))
+    for i in range(10):
+        bucket.upload_bytes(b"old", "other/file%d" % i)
+    source = tmp_path / "drop"
+    source.mkdir()
+    for i in range(3):
+        (source / ("file%d" % i)).write_bytes(b"new")
+    calls = SimulatorCalls(monkeypatch)
+    sync = DropzoneSynchronizer(max_workers=2)
+    start = time.monotonic()
+    with SyncReport(io.StringIO(), True) as reporter:
+        sync.sync_many([(
+            parse_sync_folder(str(source), api),
+            parse_sync_folder("b2://bucket/2020/01/01/120000", api,
+                              b2_folder_class=b2_folder_class))],
+            0, reporter)
+    first_byte = calls.first_upload() - start
+    listings = calls.listings()
+    if b2_folder_class is BlindB2Folder:
+        assert listings == []
+        assert first_byte < LATENCY
+    else:
+        # the index has never seen the folder, so it is listed first
+        assert listings
+        assert first_byte >= LATENCY
+    assert sorted(f.file_name for f, _ in bucket.ls("2020/01/01/120000")) \
+        == ["2020/01/01/120000/file%d" % i for i in range(3)]
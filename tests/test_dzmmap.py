@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for ``b2dz.dzmmap``.
+"""
+import mmap
+import os
+
+import pytest
+
+from b2dz.dzmmap import MappedRange
+
+
+@pytest.fixture
+def data(tmp_path):
+    data = os.urandom(3 * 1024 * 1024 + 123)
+    (tmp_path / "file").write_bytes(data)
+    return data
+
+
+@pytest.mark.parametrize("offset", [0, 1, mmap.ALLOCATIONGRANULARITY + 7])
+def test_reads_the_range(tmp_path, data, offset):
+    length = len(data) - offset - 5
+    with MappedRange(str(tmp_path / "file"), offset, length) as mapped:
+        read = b"".join(bytes(view) for view in iter(
+            lambda: mapped.read(10000), b""))
+        assert read == data[offset:offset + length]
+        mapped.seek(-100, os.SEEK_END)
+        assert bytes(mapped.read()) == data[offset + length - 100:
+                                            offset + length]
+
+
+@pytest.mark.skipif(not hasattr(mmap, "MADV_DONTNEED"),
+                    reason="pages can't be given back here")
+def test_keeps_at_most_a_window_behind(tmp_path, data):
+    with MappedRange(str(tmp_path / "file"), 0, len(data)) as mapped:
+        views = []
+        while True:
+            view = mapped.read(8192)
+            if not view:
+                break
+            views.append(view)
+            assert mapped.tell() - mapped._released <= (
+                MappedRange.WINDOW + 2 * 8192)
+        # views of pages given back still read the file
+        assert b"".join(bytes(view) for view in views) == data
+        mapped.seek(0)
+        assert bytes(mapped.read(100)) == data[:100]
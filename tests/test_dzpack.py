@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for ``b2dz.dzpack``.
+"""
+import io
+import os
+import tarfile
+
+import pytest
+
+from b2dz.dzpack import TarPlan
+
+
+LONG_NAME = "folder/" + "a very long name " * 10 + ".txt"
+"""Longer than the 100 bytes a plain tar header has room for"""
+
+
+@pytest.fixture
+def dropped(tmp_path):
+    """
+    A dropped folder with files of sizes around the tar block size, one with
+    a long and one with a non-ASCII name, and a dropped file.
+    """
+    folder = tmp_path / "folder"
+    folder.mkdir()
+    (folder / "sub").mkdir()
+    contents = {
+        "folder/empty": b"",
+        "folder/one": b"1",
+        "folder/block": b"b" * tarfile.BLOCKSIZE,
+        "folder/sub/more": os.urandom(tarfile.BLOCKSIZE + 1),
+        "folder/été.txt": b"summer",
+        LONG_NAME: os.urandom(3000),
+    }
+    for name, data in contents.items():
+        (tmp_path / name).write_bytes(data)
+    single = tmp_path / "single.bin"
+    single.write_bytes(os.urandom(20000))
+    contents["single.bin"] = single.read_bytes()
+    return [str(folder) + os.sep, str(single)], contents
+
+
+def read(plan):
+    with plan.open() as stream:
+        return stream.read()
+
+
+def test_archive_reads_back(dropped):
+    items, contents = dropped
+    plan = TarPlan.from_items(items)
+    archive = read(plan)
+    assert len(archive) == plan.size
+    assert plan.size % tarfile.RECORDSIZE == 0
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        members = tar.getmembers()
+        assert sorted(member.name for member in members) == sorted(contents)
+        for member in members:
+            assert member.isfile()
+            assert member.mode == TarPlan.FILE_MODE
+            assert tar.extractfile(member).read() == contents[member.name]
+
+
+def test_long_names_get_pax_headers(dropped):
+    items, contents = dropped
+    archive = read(TarPlan.from_items(items))
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        member = tar.getmember(LONG_NAME)
+        assert member.pax_headers["path"] == LONG_NAME
+        assert tar.extractfile(member).read() == contents[LONG_NAME]
+
+
+def test_index_points_at_file_data(dropped):
+    items, contents = dropped
+    plan = TarPlan.from_items(items)
+    archive = read(plan)
+    index = plan.index("drop.tar")
+    assert index["size"] == len(archive)
+    assert len(index["files"]) == len(contents)
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        for entry in index["files"]:
+            member = tar.getmember(entry["name"])
+            assert entry["offset"] == member.offset_data
+            assert entry["size"] == member.size
+            assert entry["mtime"] == member.mtime
+            data = archive[entry["offset"]:entry["offset"] + entry["size"]]
+            assert data == contents[entry["name"]]
+
+
+def test_stream_reads_from_anywhere(dropped):
+    items, contents = dropped
+    plan = TarPlan.from_items(items)
+    archive = read(plan)
+    with plan.open() as stream:
+        for offset in (0, 1, tarfile.BLOCKSIZE - 1, 4321, plan.size - 1,
+                       plan.size):
+            stream.seek(offset)
+            assert stream.read(3000) == archive[offset:offset + 3000]
+
+
+def test_file_getting_shorter_is_an_error(dropped, tmp_path):
+    items, _ = dropped
+    plan = TarPlan.from_items(items)
+    (tmp_path / "single.bin").write_bytes(b"short")
+    with pytest.raises(ValueError, match="got shorter"):
+        read(plan)
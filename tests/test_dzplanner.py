@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for ``b2dz.dzplanner``.
+"""
+import pytest
+from b2sdk.v2 import RawSimulator
+
+from b2dz.dzplanner import MAX_SINGLE_UPLOAD_SIZE, MEGABYTE, PartPlanner
+
+
+RECOMMENDED = 100 * MEGABYTE
+"""What B2 recommends as the part size"""
+
+MINIMUM = 5 * MEGABYTE
+"""The smallest part B2 takes"""
+
+
+def planner(**kwargs):
+    kwargs.setdefault("recommended_part_size", RECOMMENDED)
+    kwargs.setdefault("minimum_part_size", MINIMUM)
+    kwargs.setdefault("upload_workers", 16)
+    return PartPlanner(**kwargs)
+
+
+@pytest.mark.parametrize("workers, active_files, streams", [
+    (16, 0, 16),
+    (16, 1, 16),
+    (16, 3, 5),
+    (16, 16, 1),
+    (16, 17, 1),
+    (40, 1, PartPlanner.MAX_STREAMS),
+    (1, 1, 1),
+])
+def test_streams_split_the_workers(workers, active_files, streams):
+    assert planner(upload_workers=workers).part_streams(active_files) == \
+        streams
+
+
+def test_fixed_streams_are_kept():
+    assert planner(part_streams=3).part_streams(1) == 3
+    assert planner(part_streams=3).part_streams(50) == 3
+
+
+@pytest.mark.parametrize("file_size, streams, part_size", [
+    (0, 16, None),
+    (RECOMMENDED, 16, None),
+    # up to twice the recommended size goes in one request
+    (RECOMMENDED + 1, 16, RECOMMENDED + 1),
+    (2 * RECOMMENDED, 16, 2 * RECOMMENDED),
+    # just over it, small enough parts to keep every stream busy twice
+    (2 * RECOMMENDED + 1, 16, (2 * RECOMMENDED + 1) // 32),
+    (2 * RECOMMENDED + 1, 1, RECOMMENDED),
+    # but never smaller than B2 takes or bigger than recommended
+    (2 * RECOMMENDED + 1, 40, MINIMUM),
+    (10 * 1000 * MEGABYTE, 16, RECOMMENDED),
+])
+def test_part_size_at_the_boundaries(file_size, streams, part_size):
+    assert planner().part_size(file_size, streams) == part_size
+
+
+def test_part_size_follows_the_throughput():
+    # 1 MB/s for each of 16 workers takes 15 s for a 15 MB part
+    fast = planner(throughput=16 * MEGABYTE)
+    assert fast.part_size(10 * 1000 * MEGABYTE, 4) == 15 * MEGABYTE
+    slow = planner(throughput=16 * 1000)
+    assert slow.part_size(10 * 1000 * MEGABYTE, 4) == MINIMUM
+    huge = planner(throughput=10 ** 13)
+    assert huge.part_size(10 ** 13, 1) == MAX_SINGLE_UPLOAD_SIZE
+
+
+@pytest.mark.parametrize("fixed, part_size", [
+    (1, MINIMUM),
+    (MINIMUM, MINIMUM),
+    (MINIMUM + 1, MINIMUM + 1),
+    (3 * RECOMMENDED, 3 * RECOMMENDED),
+])
+def test_fixed_part_size_is_kept_above_the_minimum(fixed, part_size):
+    fixed_planner = planner(part_size=fixed)
+    assert fixed_planner.part_size(1, 16) == part_size
+    assert fixed_planner.part_size(10 * 1000 * MEGABYTE, 16) == part_size
+    assert fixed_planner.large_file_size == part_size
+
+
+def test_large_file_size():
+    assert planner().large_file_size == 2 * RECOMMENDED
+    assert planner(recommended_part_size=4 * 1000 * MEGABYTE) \
+        .large_file_size == MAX_SINGLE_UPLOAD_SIZE
+
+
+def test_files_in_flight_share_the_workers():
+    files_planner = planner()
+    size = 10 * 1000 * MEGABYTE
+    with files_planner.uploading(size) as first:
+        with files_planner.uploading(size) as second:
+            with files_planner.uploading(size) as third:
+                assert (first[1], second[1], third[1]) == (16, 8, 5)
+        with files_planner.uploading(size) as fourth:
+            assert fourth[1] == 8
+    assert files_planner._active_files == 0
+
+
+@pytest.mark.parametrize("extra, parts", [(0, 0), (1, 2)])
+def test_file_just_over_the_threshold_goes_in_parts(make_api, tmp_path,
+                                                    monkeypatch, extra, parts):
+    sizes = []
+    upload_part = RawSimulator.upload_part
+
+    def counting(simulator, *args, **kwargs):
+        sizes.append(args[3])
+        return upload_part(simulator, *args, **kwargs)
+
+    monkeypatch.setattr(RawSimulator, "upload_part", counting)
+    api, bucket = make_api()
+    minimum = RawSimulator.MIN_PART_SIZE
+    api.part_planner = PartPlanner(minimum, minimum, 4)
+    path = tmp_path / "file"
+    path.write_bytes(b"x" * (api.part_planner.large_file_size + extra))
+    bucket.upload_local_file(str(path), "file")
+    assert len(sizes) == parts
+    # parts that would be too small are the minimum, the last takes the rest
+    assert all(size >= minimum for size in sizes)
+    assert sum(sizes) in (0, len(path.read_bytes()))
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for ``b2dz.dzprofiles`` and how a drop picks its profile.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from b2dz.b2api import B2Dropzone
+from b2dz.b2dz_account_info import DropzoneB2AccountInfo
+from b2dz.dzconfig import DropzoneConfig, load_config
+from b2dz.dzplanner import MEGABYTE
+from b2dz.dzprofiles import DEFAULT_MODIFIER_PROFILES, DEFAULT_PROFILES, \
+    TransferProfile, TransferProfiles
+from b2dz.dzthrottle import KILOBYTE
+
+
+def picked(config, modifier, environ):
+    """
+    :return: the profile ``B2Dropzone`` uploads with when ``modifier`` is
+             held while dropping
+    """
+    if modifier is None:
+        environ.pop("KEY_MODIFIERS", None)
+    else:
+        environ["KEY_MODIFIERS"] = modifier
+    drop = SimpleNamespace(config=config, key_modifier=None)
+    drop.key_modifier = B2Dropzone.key_modifier.fget(drop)
+    return B2Dropzone.profile.fget(drop)
+
+
+def test_parses_every_setting():
+    profile = TransferProfile.parse(
+        " fast  lane : workers=8, part_size=50 part_streams=4 rate_limit=900 "
+        "compress=ZSTD compare=size order=dropped pack")
+    assert (profile.name, profile.workers, profile.part_size,
+            profile.part_streams, profile.rate_limit, profile.compress,
+            profile.compare, profile.order, profile.pack) == (
+        "fast lane", 8, 50, 4, 900, "zstd", "size", "dropped", True)
+    assert TransferProfile.parse(str(profile)) == profile
+    assert not TransferProfile.parse("plain:").pack
+    assert not TransferProfile.parse("plain: pack=no").pack
+
+
+@pytest.mark.parametrize("text", [
+    "no colon", ": workers=2", "slow: workers=0", "slow: workers=two",
+    "slow: speed=9", "small: compress=lzma", "quick: compare=hash",
+    "late: order=random", "packed: pack=maybe",
+])
+def test_rejects_what_it_cannot_understand(text):
+    with pytest.raises(ValueError):
+        TransferProfile.parse(text)
+
+
+def test_default_profiles():
+    profiles = TransferProfiles.parse(DEFAULT_PROFILES)
+    assert str(profiles) == DEFAULT_PROFILES
+    assert set(profiles.names) == set(DEFAULT_MODIFIER_PROFILES.values())
+    assert profiles.get("background").rate_limit == 500
+    assert profiles.get("archive").pack
+    assert profiles.get("skip compare").compare == "blind"
+    assert profiles.get("nothing") is None
+    assert len(TransferProfiles.parse("")) == 0
+
+
+@pytest.mark.parametrize("modifier, name", [
+    (None, None),
+    ("Command", "max throughput"),
+    ("Option", "archive"),
+    ("Control", "background"),
+    ("Shift", "skip compare"),
+])
+def test_modifier_picks_its_default_profile(environ, modifier, name):
+    profile = picked(DropzoneConfig(), modifier, environ)
+    assert (profile and profile.name) == name
+
+
+def test_config_overrides_what_modifiers_pick(environ):
+    config = DropzoneConfig(
+        profiles="slow: workers=1; quick: compare=size",
+        command_profile="quick", shift_profile="None")
+    assert picked(config, "Command", environ).compare == "size"
+    assert picked(config, "Shift", environ) is None
+    # the default profiles were replaced, so their keys pick nothing
+    assert picked(config, "Control", environ) is None
+    config.set_modifier_profile("Control", "slow")
+    assert picked(config, "Control", environ).workers == 1
+
+
+def test_overrides_are_saved(dz, environ):
+    config = DropzoneConfig(profiles="slow: workers=1",
+                            option_profile="slow", shift_profile="None")
+    config.save_config()
+    config.flush()
+    config = load_config()
+    assert config.profiles == "slow: workers=1"
+    assert picked(config, "Option", environ).workers == 1
+    assert picked(config, "Shift", environ) is None
+    # profiles left at their defaults aren't saved
+    config = DropzoneConfig(profiles=DEFAULT_PROFILES,
+                            command_profile="max throughput")
+    assert config.profiles is None
+    assert config.get_modifier_profile("Command") == "max throughput"
+
+
+def test_profile_settings_override_the_config():
+    config = DropzoneB2AccountInfo(part_size=50, part_streams=2,
+                                   rate_limit=100, compress="gzip")
+    config.recommended_part_size = 100 * MEGABYTE
+    config.absolute_minimum_part_size = 5 * MEGABYTE
+    drop = SimpleNamespace(config=config)
+    profile = TransferProfile.parse(
+        "custom: part_size=200 part_streams=8 rate_limit=700 compress=none")
+    for used, part_size, streams, rate_limit, encoding in (
+            (None, 50, 2, 100, "gzip"), (profile, 200, 8, 700, None)):
+        planner = B2Dropzone.make_part_planner(drop, used)
+        assert planner.fixed_part_size == part_size * MEGABYTE
+        assert planner.fixed_part_streams == streams
+        throttle = B2Dropzone.make_throttle(drop, used)
+        assert throttle.rate == rate_limit * KILOBYTE
+        compressor = B2Dropzone.make_compressor(drop, used)
+        assert (compressor and compressor.encoding) == encoding
+    # settings the profile leaves out keep the configured ones
+    planner = B2Dropzone.make_part_planner(
+        drop, TransferProfile.parse("some: workers=3"))
+    assert planner.fixed_part_size == 50 * MEGABYTE
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for ``b2dz.dzprogress``.
+"""
+import sys
+import threading
+
+import pytest
+
+from b2dz.dzprogress import DropzoneSyncReport, ThroughputEstimator
+
+
+MEGABYTE = 1000 * 1000
+
+
+class SimulatedClock(object):
+    """A clock that only moves when told to"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def send(estimator, clock, seconds, rate, interval=1.0):
+    """Send at ``rate`` bytes per second, updating every ``interval``"""
+    for _ in range(int(seconds / interval)):
+        clock.now += interval
+        estimator.update(estimator.total_bytes + int(rate * interval))
+
+
+def test_counting_wakes_the_reporter_thread(dz, monkeypatch):
+    threads = []
+    shown = threading.Event()
+    sample = DropzoneSyncReport._sample
+
+    def recorded_sample(self):
+        threads.append(threading.current_thread().name)
+        sample(self)
+
+    def determinate(value):
+        shown.set()
+
+    monkeypatch.setattr(DropzoneSyncReport, "_sample", recorded_sample)
+    monkeypatch.setattr(DropzoneSyncReport, "SAMPLE_INTERVAL", 60)
+    monkeypatch.setattr(dz, "determinate", determinate)
+    report = DropzoneSyncReport(sys.stdout, False)
+    try:
+        report.update_total(10)
+        report.end_total()
+        assert report.total_done
+        assert report.total_count == 10
+        # long before the next sample is due
+        assert shown.wait(5)
+        assert threads == ["sync-report"]
+    finally:
+        report.close()
+
+
+def test_nothing_is_known_before_two_samples():
+    clock = SimulatedClock()
+    estimator = ThroughputEstimator(clock=clock)
+    assert estimator.label() is None
+    estimator.update(0)
+    assert estimator.rate is None
+    assert estimator.eta(1000) is None
+    assert estimator.summary() == "Nothing new to upload."
+
+
+@pytest.mark.parametrize("interval", [0.1, 1, 5])
+def test_steady_speed_whatever_the_update_interval(interval):
+    clock = SimulatedClock()
+    estimator = ThroughputEstimator(clock=clock)
+    estimator.update(0)
+    send(estimator, clock, 60, MEGABYTE, interval)
+    assert estimator.rate == pytest.approx(MEGABYTE)
+    assert estimator.eta(120 * MEGABYTE) == pytest.approx(120)
+    # 1 MB/s, give or take rounding
+    assert estimator.label(120 * MEGABYTE).endswith(", about 2 minutes left")
+    assert estimator.label(5 * MEGABYTE).endswith(", almost done")
+    assert estimator.label().endswith("B/s...")
+
+
+def test_follows_a_change_of_speed_smoothly():
+    clock = SimulatedClock()
+    estimator = ThroughputEstimator(clock=clock)
+    estimator.update(0)
+    send(estimator, clock, 60, MEGABYTE)
+    send(estimator, clock, 5, 3 * MEGABYTE)
+    # on its way, but neither jumping nor stuck
+    assert MEGABYTE * 1.05 < estimator.rate < MEGABYTE * 1.5
+    send(estimator, clock, 120, 3 * MEGABYTE)
+    assert estimator.rate == pytest.approx(3 * MEGABYTE, rel=0.01)
+
+
+def test_ignores_a_single_burst():
+    clock = SimulatedClock()
+    estimator = ThroughputEstimator(clock=clock)
+    estimator.update(0)
+    send(estimator, clock, 60, MEGABYTE)
+    send(estimator, clock, 1, 30 * MEGABYTE)
+    assert estimator.rate < MEGABYTE * 1.2
+
+
+def test_tells_when_nothing_is_sent():
+    clock = SimulatedClock()
+    estimator = ThroughputEstimator(clock=clock)
+    estimator.update(0)
+    send(estimator, clock, 60, MEGABYTE)
+    clock.now += ThroughputEstimator.STALL_TIME - 1
+    estimator.update(estimator.total_bytes)
+    assert not estimator.stalled_for
+    clock.now += 60
+    estimator.update(estimator.total_bytes)
+    assert estimator.stalled_for == ThroughputEstimator.STALL_TIME + 59
+    assert estimator.label(MEGABYTE) == \
+        "Uploading... nothing sent for a minute"
+    estimator.update(estimator.total_bytes + 1)
+    assert not estimator.stalled_for
+
+
+def test_summary():
+    clock = SimulatedClock()
+    estimator = ThroughputEstimator(clock=clock)
+    estimator.update(0)
+    send(estimator, clock, 5, MEGABYTE)
+    assert estimator.summary() == "Uploaded 5.00 MB instantly."
+    send(estimator, clock, 595, MEGABYTE)
+    assert estimator.summary() == \
+        "Uploaded 600 MB in 10 minutes at 1.00 MB/s."
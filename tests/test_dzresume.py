@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for ``b2dz.dzresume`` and resuming large files in
+``b2dz.dzapi.DropzoneBucket``, killing uploads to b2sdk's simulator at
+random points.
+"""
+import hashlib
+import io
+import os
+import random
+import time
+
+import pytest
+from b2sdk.v2 import UploadSourceLocalFile
+
+from b2dz.dzhash import FileHasher
+from b2dz.dzplanner import PartPlanner
+from b2dz.dzresume import ResumeJournal
+
+
+PART_SIZE = 1000
+"""Parts are this big unless a test picks another size"""
+
+
+class Killed(Exception):
+    """Stands in for the action being killed halfway through an upload"""
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = ResumeJournal(str(tmp_path / "resume.sqlite3"))
+    yield journal
+    journal.close()
+
+
+@pytest.fixture
+def local_file(tmp_path):
+    path = tmp_path / "big.bin"
+    path.write_bytes(random.Random(0).randbytes(40 * PART_SIZE))
+    return str(path)
+
+
+class PartCounter(object):
+    """
+    Counts the parts the simulator receives and raises ``Killed`` for
+    every part from the ``kill_at``th on.
+    """
+
+    def __init__(self, simulator):
+        self.sent = 0
+        self.kill_at = None
+        self._upload_part = simulator.upload_part
+        simulator.upload_part = self
+
+    def __call__(self, *args, **kwargs):
+        if self.kill_at is not None and self.sent + 1 >= self.kill_at:
+            raise Killed()
+        result = self._upload_part(*args, **kwargs)
+        self.sent += 1
+        return result
+
+
+@pytest.fixture
+def resumable(make_api, journal, tmp_path):
+    """
+    :return: an API with a resume journal and hasher, its bucket and the
+             counter of the parts it sends
+    """
+    api, bucket = make_api(
+        resume_journal=journal,
+        hasher=FileHasher(str(tmp_path / "hashes.sqlite3")))
+    return api, bucket, PartCounter(api.session.raw_api)
+
+
+def plan(api, part_size=PART_SIZE, part_streams=1):
+    api.part_planner = PartPlanner(200, 200, 4, part_size=part_size,
+                                   part_streams=part_streams)
+
+
+def settle(api):
+    """
+    Wait for the parts b2sdk still had queued when an upload was killed. They
+    keep being killed, as they would be if the action had exited.
+    """
+    upload_manager = api.services.upload_manager
+    if upload_manager.upload_executor is not None:
+        upload_manager.upload_executor.shutdown(wait=True)
+        upload_manager.upload_executor = None
+
+
+def unfinished(api, bucket):
+    return list(api.services.large_file.list_unfinished_large_files(
+        bucket.id_))
+
+
+def downloaded(bucket, file_name):
+    out = io.BytesIO()
+    bucket.download_file_by_name(file_name).save(out)
+    return out.getvalue()
+
+
+def test_journal_finds_only_unchanged_files(journal, local_file):
+    journal.start("bucket", "big.bin", local_file, PART_SIZE, "file1")
+    assert journal.find("bucket", "big.bin", local_file) == ("file1",
+                                                             PART_SIZE)
+    assert journal.find("bucket", "other.bin", local_file) is None
+    with open(local_file, "ab") as f:
+        f.write(b"more")
+    assert journal.find("bucket", "big.bin", local_file) is None
+
+
+def test_journal_returns_what_it_drops(journal, local_file):
+    assert journal.start("bucket", "big.bin", local_file, PART_SIZE,
+                         "file1") == []
+    # the same upload again doesn't drop itself
+    assert journal.start("bucket", "big.bin", local_file, PART_SIZE,
+                         "file1") == []
+    assert journal.start("bucket", "big.bin", local_file, PART_SIZE,
+                         "file2") == ["file1"]
+    assert journal.abandon("bucket", "big.bin") == ["file2"]
+    assert journal.find("bucket", "big.bin", local_file) is None
+
+
+def test_journal_finish_forgets(journal, local_file):
+    journal.start("bucket", "big.bin", local_file, PART_SIZE, "file1")
+    journal.finish("bucket", "big.bin")
+    assert journal.find("bucket", "big.bin", local_file) is None
+    assert journal.expire() == []
+
+
+def test_journal_expires_old_uploads(journal, local_file, monkeypatch):
+    journal.start("bucket", "old.bin", local_file, PART_SIZE, "file1")
+    later = time.time() + ResumeJournal.MAX_AGE + 1
+    monkeypatch.setattr(time, "time", lambda: later)
+    journal.start("bucket", "new.bin", local_file, PART_SIZE, "file2")
+    assert journal.find("bucket", "old.bin", local_file) is None
+    assert journal.expire() == ["file1"]
+    assert journal.find("bucket", "new.bin", local_file) == ("file2",
+                                                             PART_SIZE)
+
+
+def test_journal_clear_leaves_uploads_to_cancel(journal, local_file):
+    journal.start("bucket", "big.bin", local_file, PART_SIZE, "file1")
+    journal.clear()
+    assert journal.find("bucket", "big.bin", local_file) is None
+    assert journal.expire() == ["file1"]
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_resumes_after_being_killed_at_random(resumable, local_file, seed):
+    api, bucket, parts = resumable
+    rng = random.Random(seed)
+    size = os.path.getsize(local_file)
+    total_parts = -(-size // PART_SIZE)
+
+    # one part at a time, so exactly the parts before the kill are sent
+    plan(api)
+    parts.kill_at = rng.randint(2, total_parts - 1)
+    with pytest.raises(Killed):
+        bucket.upload(UploadSourceLocalFile(local_file), "big.bin")
+    settle(api)
+    [large_file] = unfinished(api, bucket)
+    already_sent = len(list(api.services.large_file.list_parts(
+        large_file.file_id)))
+    assert already_sent == parts.kill_at - 1
+
+    # the next drop may plan other part sizes, the journal's are used
+    plan(api, part_size=rng.choice([None, 400, 3000]),
+         part_streams=rng.randint(1, 4))
+    parts.kill_at = None
+    parts.sent = 0
+    file_version = bucket.upload(UploadSourceLocalFile(local_file), "big.bin")
+    assert parts.sent == total_parts - already_sent
+    assert file_version.id_ == large_file.file_id
+    with open(local_file, "rb") as f:
+        expected = f.read()
+    assert hashlib.sha1(downloaded(bucket, "big.bin")).digest() == \
+        hashlib.sha1(expected).digest()
+    assert unfinished(api, bucket) == []
+    assert api.resume_journal.expire() == []
+
+
+def test_cancels_the_upload_of_a_file_that_changed(resumable, local_file):
+    api, bucket, parts = resumable
+    plan(api)
+    parts.kill_at = 5
+    with pytest.raises(Killed):
+        bucket.upload(UploadSourceLocalFile(local_file), "big.bin")
+    settle(api)
+    [old] = unfinished(api, bucket)
+
+    # b2sdk would resume on its own if the parts it has still matched
+    with open(local_file, "r+b") as f:
+        f.write(b"changed")
+    parts.kill_at = None
+    file_version = bucket.upload(UploadSourceLocalFile(local_file), "big.bin")
+    assert file_version.id_ != old.file_id
+    assert unfinished(api, bucket) == []
+
+
+def test_cancels_an_upload_that_cannot_be_resumed(resumable, local_file):
+    api, bucket, parts = resumable
+    plan(api)
+    parts.kill_at = 5
+    with pytest.raises(Killed):
+        bucket.upload(UploadSourceLocalFile(local_file), "big.bin",
+                      file_info={"try": "1"})
+    settle(api)
+    [old] = unfinished(api, bucket)
+
+    # b2sdk refuses to resume a large file with other file info
+    parts.kill_at = None
+    file_version = bucket.upload(UploadSourceLocalFile(local_file),
+                                 "big.bin", file_info={"try": "2"})
+    assert file_version.id_ != old.file_id
+    assert unfinished(api, bucket) == []
+
+
+def test_cancels_expired_uploads(resumable, local_file):
+    api, bucket, parts = resumable
+    plan(api)
+    parts.kill_at = 5
+    with pytest.raises(Killed):
+        bucket.upload(UploadSourceLocalFile(local_file), "big.bin")
+    settle(api)
+    assert len(unfinished(api, bucket)) == 1
+    api.cancel_expired_uploads()
+    assert len(unfinished(api, bucket)) == 1  # still worth resuming
+
+    api.resume_journal.clear()
+    api.cancel_expired_uploads()
+    assert unfinished(api, bucket) == []
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for ``b2dz.dzschedule``.
+"""
+import threading
+
+import pytest
+
+from b2dz.dzschedule import TransferScheduler, large_lane_size
+
+
+def take_all(scheduler):
+    items = []
+    for _ in range(len(scheduler._small) + len(scheduler._large)):
+        with scheduler.take() as item:
+            items.append(item)
+    return items
+
+
+@pytest.mark.parametrize("order, expected", [
+    ("smallest", ["a2", "b1", "a1", "b2"]),
+    ("largest", ["b2", "a1", "b1", "a2"]),
+    ("dropped", ["a1", "a2", "b1", "b2"]),
+])
+def test_orders(order, expected):
+    scheduler = TransferScheduler(order)
+    for size, rank, item in ((300, 0, "a1"), (100, 0, "a2"), (200, 1, "b1"),
+                             (400, 1, "b2")):
+        scheduler.push(size, rank, item)
+    assert take_all(scheduler) == expected
+
+
+def test_equal_keys_keep_the_order_they_were_pushed_in():
+    scheduler = TransferScheduler("smallest")
+    for i in range(10):
+        scheduler.push(100, 0, i)
+    assert take_all(scheduler) == list(range(10))
+
+
+@pytest.mark.parametrize("workers, size", [(1, 1), (2, 1), (3, 2), (4, 3),
+                                           (8, 6), (20, 15)])
+def test_large_lane_size(workers, size):
+    assert large_lane_size(workers) == size
+
+
+def test_small_files_get_past_a_full_large_lane():
+    workers = [4]
+    scheduler = TransferScheduler("largest", large_size=1000,
+                                  workers=lambda: workers[0])
+    for i in range(4):
+        scheduler.push(5000 + i, 0, "large%d" % i)
+    scheduler.push(10, 0, "small")
+    running = [scheduler.take() for _ in range(4)]
+    # three large files, then the large lane is full
+    assert [r.__enter__() for r in running] == \
+        ["large3", "large2", "large1", "small"]
+    running[0].__exit__(None, None, None)
+    with scheduler.take() as item:
+        assert item == "large0"
+    for r in running[1:]:
+        r.__exit__(None, None, None)
+
+
+def test_waits_for_the_large_lane_to_free_up():
+    workers = [2]
+    scheduler = TransferScheduler(large_size=1000, workers=lambda: workers[0])
+    scheduler.push(5000, 0, "first")
+    scheduler.push(5000, 0, "second")
+    taken = []
+    with scheduler.take() as item:
+        taken.append(item)
+        waiting = threading.Thread(
+            target=lambda: taken.append(take_all(scheduler)))
+        waiting.start()
+        waiting.join(0.1)
+        assert waiting.is_alive()
+    waiting.join(5)
+    assert taken == ["first", ["second"]]
+
+
+def test_more_workers_open_the_large_lane():
+    workers = [2]
+    scheduler = TransferScheduler(large_size=1000, workers=lambda: workers[0])
+    scheduler.push(5000, 0, "first")
+    scheduler.push(5000, 0, "second")
+    with scheduler.take():
+        workers[0] = 4
+        with scheduler.take() as item:
+            assert item == "second"
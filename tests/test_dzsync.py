@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for ``b2dz.dzsync.DropzoneSynchronizer``.
+"""
+import io
+import threading
+import time
+
+from b2sdk.sync.action import B2DeleteAction, B2UploadAction
+from b2sdk.sync.report import SyncReport
+from b2sdk.sync.sync import Synchronizer
+from b2sdk.v2 import RawSimulator, parse_sync_folder
+
+from b2dz.dzconcurrency import ConcurrencyController
+from b2dz.dzschedule import TransferScheduler
+from b2dz.dzsync import DropzoneSynchronizer
+
+
+LATENCY = 0.05
+"""Seconds the slowed down simulator takes to list or upload"""
+
+
+class BlockedAction(object):
+    """A transfer that runs until it is released"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.released = threading.Event()
+
+    def run(self, bucket, reporter, dry_run=False):
+        self.started.set()
+        self.released.wait(5)
+
+
+def test_waiting_for_the_large_lane_holds_no_slot():
+    controller = ConcurrencyController(fixed=4)
+    # two workers leave one of them to large files
+    scheduler = TransferScheduler(large_size=10, workers=lambda: 2)
+    sync = DropzoneSynchronizer(max_workers=4, controller=controller,
+                                scheduler=scheduler)
+    actions = [BlockedAction(), BlockedAction()]
+    for action in actions:
+        scheduler.push(100, 0, (action, None))
+    workers = [threading.Thread(target=sync._run_next, args=(None,))
+               for _ in actions]
+    for worker in workers:
+        worker.start()
+    try:
+        assert actions[0].started.wait(5)
+        time.sleep(0.1)  # the other worker is waiting for the large lane
+        assert not actions[1].started.is_set()
+        assert controller.active == 1
+    finally:
+        for action in actions:
+            action.released.set()
+        for worker in workers:
+            worker.join()
+    assert actions[1].started.is_set()
+    assert controller.active == 0
+
+
+def test_hashes_ahead_only_what_may_be_copied(monkeypatch):
+    class Bucket(object):
+        def may_have_duplicate(self, size):
+            return size >= 10
+
+    class Folder(object):
+        bucket = Bucket()
+
+        def folder_type(self):
+            return "b2"
+
+    hashed = []
+    hash_ahead = type("HashAhead", (object,), {"submit": hashed.append})()
+    actions = [
+        B2UploadAction("small", "small", "small", 0, 1, None),
+        B2UploadAction("large", "large", "large", 0, 100, None),
+        B2DeleteAction("gone", "gone", "id", None),
+    ]
+    sync = DropzoneSynchronizer(max_workers=1, hash_ahead=hash_ahead)
+    monkeypatch.setattr(sync, "_make_folder_sync_actions",
+                        lambda *args: iter(actions))
+    executor = type("Executor", (object,), {"submit": lambda *args: None})()
+    sync._schedule_folder_actions(executor, Folder(), Folder(), 0, None,
+                                  None)
+    assert hashed == ["large"]
+
+
+def test_sync_many_is_faster_than_one_folder_at_a_time(make_api, tmp_path,
+                                                       monkeypatch):
+    for name in ("list_file_names", "list_file_versions", "upload_file"):
+        call = getattr(RawSimulator, name)
+
+        def slowed(self, *args, call=call, **kwargs):
+            time.sleep(LATENCY)
+            return call(self, *args, **kwargs)
+
+        monkeypatch.setattr(RawSimulator, name, slowed)
+    api, bucket = make_api()
+    sources = []
+    for i in range(8):
+        source = tmp_path / ("folder%d" % i)
+        source.mkdir()
+        for j in range(2):
+            (source / ("file%d" % j)).write_bytes(b"x" * (i + j))
+        sources.append(source)
+
+    def folder_pairs(run):
+        return [(parse_sync_folder(str(source), api),
+                 parse_sync_folder("b2://bucket/%s/%s" % (run, source.name),
+                                   api))
+                for source in sources]
+
+    start = time.monotonic()
+    for source_folder, dest_folder in folder_pairs("sequential"):
+        with SyncReport(io.StringIO(), True) as reporter:
+            Synchronizer(max_workers=4).sync_folders(
+                source_folder, dest_folder, 0, reporter)
+    sequential = time.monotonic() - start
+
+    start = time.monotonic()
+    with SyncReport(io.StringIO(), True) as reporter:
+        DropzoneSynchronizer(max_workers=4).sync_many(folder_pairs("many"),
+                                                      0, reporter)
+    shared = time.monotonic() - start
+
+    names = [f.file_name for f, _ in bucket.ls(recursive=True)]
+    assert len(names) == 32
+    assert sum(name.startswith("many/") for name in names) == 16
+    # 8 listings one after another, each followed by 2 uploads, against
+    # every listing at once and 16 uploads 4 at a time
+    assert shared < sequential / 2
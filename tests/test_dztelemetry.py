@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for ``b2dz.dztelemetry``.
+"""
+import io
+import json
+import os
+import time
+from types import SimpleNamespace
+
+from b2sdk.v2 import parse_sync_folder
+
+from b2dz.dzapi import DropzoneBucket
+from b2dz.dzhash import FileHasher
+from b2dz.dzindex import UploadIndex
+from b2dz.dzplanner import PartPlanner
+from b2dz.dzprogress import DropzoneSyncReport
+from b2dz.dzsync import DropzoneSynchronizer
+from b2dz.dztelemetry import DropTelemetry, TelemetryHttpCallback
+
+
+PART_SIZE = 2 * DropzoneBucket.DEDUP_MIN_SIZE
+"""Parts of the large file in the simulated drop"""
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_records_a_simulated_drop(make_api, tmp_path):
+    telemetry = DropTelemetry(workers=4, order="smallest")
+    api, bucket = make_api(
+        upload_index=UploadIndex(str(tmp_path / "index.sqlite3")),
+        hasher=FileHasher(str(tmp_path / "hashes.sqlite3")),
+        part_planner=PartPlanner(200, 200, 4, part_size=PART_SIZE),
+        telemetry=telemetry)
+    source = tmp_path / "drop"
+    source.mkdir()
+    sizes = {"empty": 0, "small": 1000,
+             "big": DropzoneBucket.DEDUP_MIN_SIZE, "large": 2 * PART_SIZE + 10}
+    for name, size in sizes.items():
+        (source / name).write_bytes(os.urandom(size))
+    folders = (parse_sync_folder(str(source), api),
+               parse_sync_folder("b2://bucket/drop", api))
+    with DropzoneSyncReport(io.StringIO(), True,
+                            telemetry=telemetry) as reporter:
+        DropzoneSynchronizer(max_workers=4).sync_folders(
+            *folders, int(time.time() * 1000), reporter)
+    # the same bytes again are copied in B2
+    bucket.upload_local_file(str(source / "big"), "drop/copy")
+    telemetry.finish()
+    log = str(tmp_path / "telemetry.jsonl")
+    telemetry.write(log)
+
+    with open(log) as f:
+        record = json.loads(f.read())
+    details = {d["name"]: d for d in record["file_details"]}
+    assert set(details) == {"drop/empty", "drop/small", "drop/big",
+                            "drop/large", "drop/copy"}
+    for name, size in sizes.items():
+        detail = details["drop/" + name]
+        assert detail["size"] == size
+        assert detail["seconds"] >= 0
+        assert not detail["copied"]
+        assert detail["part_size"] == (PART_SIZE if name == "large" else None)
+        if size:
+            # the seconds are rounded to the millisecond, the rate isn't
+            assert abs(size / detail["bytes_per_second"] -
+                       detail["seconds"]) <= 0.0006
+    assert details["drop/copy"]["copied"]
+    assert details["drop/copy"]["size"] == sizes["big"]
+
+    assert record["outcome"] == "ok"
+    assert record["settings"] == {"workers": 4, "order": "smallest"}
+    assert (record["files"], record["bytes"]) == (4, sum(sizes.values()))
+    assert (record["copied_files"], record["copied_bytes"]) == (
+        1, sizes["big"])
+    phases = record["phases"]
+    assert 0 <= phases["scan"] <= phases["compare"] <= phases["transfer"] \
+        <= record["seconds"]
+    latency = record["latency"]
+    assert 0 <= latency["p50"] <= latency["p90"] <= latency["p99"] <= \
+        latency["max"] == max(d["seconds"] for d in details.values())
+    assert record["retries"] == 0 and record["http_errors"] == {}
+
+
+def test_summary_of_known_numbers():
+    clock = Clock()
+    telemetry = DropTelemetry(clock=clock)
+    for i in range(10):
+        telemetry.file_done("file%d" % i, 1000, i + 1.0)
+    telemetry.file_done("large", 5000, 2.0, part_size=2000)
+    telemetry.retry()
+    for status in (503, 503, 429):
+        telemetry.http_error(status)
+    clock.now += 2
+    telemetry.end_phase("transfer")
+    clock.now += 3
+    telemetry.end_phase("transfer")  # only the first end counts
+    telemetry.finish(ValueError("broken"))
+    clock.now += 60  # finished drops stop the clock
+
+    record = telemetry.to_record()
+    assert record["seconds"] == 5
+    assert record["outcome"] == "ValueError"
+    assert record["phases"] == {"transfer": 2}
+    assert (record["files"], record["bytes"]) == (11, 15000)
+    assert record["bytes_per_second"] == 3000
+    assert record["latency"] == {"p50": 5.0, "p90": 9.0, "p99": 10.0,
+                                 "max": 10.0}
+    assert record["retries"] == 1
+    assert record["http_errors"] == {"429": 1, "503": 2}
+    assert record["file_details"][-1] == {
+        "name": "large", "size": 5000, "seconds": 2.0,
+        "bytes_per_second": 2500, "part_size": 2000, "copied": False}
+
+
+def test_lists_only_the_first_files(monkeypatch):
+    monkeypatch.setattr(DropTelemetry, "MAX_FILES", 3)
+    telemetry = DropTelemetry()
+    for i in range(5):
+        telemetry.file_done("file%d" % i, 10, 0)
+    record = telemetry.to_record()
+    assert [d["name"] for d in record["file_details"]] == \
+        ["file0", "file1", "file2"]
+    assert record["file_details"][0]["bytes_per_second"] is None
+    assert record["files"] == 5
+    assert DropTelemetry().to_record()["latency"] is None
+
+
+def test_log_is_appended_and_moved_aside(tmp_path, monkeypatch):
+    log = str(tmp_path / "telemetry.jsonl")
+    for workers in (1, 2):
+        DropTelemetry(workers=workers).write(log)
+    with open(log) as f:
+        assert [json.loads(line)["settings"]["workers"]
+                for line in f] == [1, 2]
+    monkeypatch.setattr(DropTelemetry, "MAX_LOG_SIZE", 1)
+    DropTelemetry(workers=3).write(log)
+    with open(log + ".1") as f:
+        assert len(f.readlines()) == 2
+    with open(log) as f:
+        assert [json.loads(line)["settings"]["workers"]
+                for line in f] == [3]
+    # an unwritable log doesn't fail the drop
+    DropTelemetry().write(str(tmp_path / "missing" / "telemetry.jsonl"))
+
+
+def test_http_errors_are_counted():
+    api = SimpleNamespace(telemetry=None)
+    callback = TelemetryHttpCallback(api)
+    callback.post_request("POST", "url", {}, SimpleNamespace(status_code=500))
+    api.telemetry = DropTelemetry()
+    for status in (200, 401, 500):
+        callback.post_request("POST", "url", {},
+                              SimpleNamespace(status_code=status))
+    assert api.telemetry.http_errors == {401: 1, 500: 1}
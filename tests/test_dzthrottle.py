@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for ``b2dz.dzthrottle``, on a simulated clock.
+"""
+import os
+from datetime import datetime
+
+import pytest
+
+from b2dz.dzthrottle import KILOBYTE, RateSchedule, TokenBucket, \
+    UploadThrottle
+
+
+class SimulatedClock(object):
+    """A clock that only moves when something sleeps or time is skipped"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.slept = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept += seconds
+        self.now += seconds
+
+
+def send(bucket, total, chunk=10 * KILOBYTE):
+    for _ in range(total // chunk):
+        bucket.consume(chunk)
+
+
+def test_no_limit_never_sleeps():
+    clock = SimulatedClock()
+    bucket = TokenBucket(None, clock=clock, sleep=clock.sleep)
+    send(bucket, 10 * 1000 * KILOBYTE)
+    assert clock.slept == 0
+
+
+@pytest.mark.parametrize("chunk", [1000, 10 * KILOBYTE, 1000 * KILOBYTE])
+def test_holds_the_rate_for_any_chunk_size(chunk):
+    clock = SimulatedClock()
+    bucket = TokenBucket(100 * KILOBYTE, clock=clock, sleep=clock.sleep)
+    send(bucket, 2000 * KILOBYTE, chunk)
+    assert clock.now == pytest.approx(20, abs=0.1)
+
+
+def test_bursts_after_being_idle():
+    clock = SimulatedClock()
+    bucket = TokenBucket(100 * KILOBYTE, clock=clock, sleep=clock.sleep)
+    clock.now += 60
+    bucket.consume(bucket.burst)
+    assert clock.slept == 0
+    # but no more than one burst
+    bucket.consume(100 * KILOBYTE)
+    assert clock.slept == pytest.approx(1)
+
+
+def test_rate_changes_while_sending():
+    clock = SimulatedClock()
+    bucket = TokenBucket(100 * KILOBYTE, clock=clock, sleep=clock.sleep)
+    send(bucket, 1000 * KILOBYTE)
+    assert clock.now == pytest.approx(10, abs=0.1)
+    bucket.set_rate(1000 * KILOBYTE)
+    send(bucket, 1000 * KILOBYTE)
+    assert clock.now == pytest.approx(11, abs=0.3)
+    bucket.set_rate(None)
+    send(bucket, 1000 * KILOBYTE)
+    assert clock.now == pytest.approx(11, abs=0.3)
+
+
+def test_parses_schedules():
+    schedule = RateSchedule.parse("09:00-17:30=500; 22:00-06:00=2000,")
+    assert schedule.windows == [(9 * 60, 17 * 60 + 30, 500 * KILOBYTE),
+                                (22 * 60, 6 * 60, 2000 * KILOBYTE)]
+    assert str(schedule) == "09:00-17:30=500, 22:00-06:00=2000"
+    assert RateSchedule.parse(str(schedule)).windows == schedule.windows
+    assert RateSchedule.parse("").windows == []
+
+
+@pytest.mark.parametrize("text", ["9-17=500", "09:00-17:00", "25:00-26:00=1",
+                                  "09:60-10:00=1"])
+def test_rejects_bad_schedules(text):
+    with pytest.raises(ValueError):
+        RateSchedule.parse(text)
+
+
+@pytest.mark.parametrize("hour, minute, rate", [
+    (8, 59, None), (9, 0, 500), (17, 29, 500), (17, 30, None), (23, 0, 2000),
+    (0, 0, 2000), (5, 59, 2000), (6, 0, None),
+])
+def test_schedule_windows(hour, minute, rate):
+    schedule = RateSchedule.parse("09:00-17:30=500, 22:00-06:00=2000")
+    expected = rate and rate * KILOBYTE
+    assert schedule.rate_at(datetime(2020, 1, 1, hour, minute)) == expected
+
+
+def test_throttle_follows_the_schedule():
+    clock = SimulatedClock()
+    now = [datetime(2020, 1, 1, 8, 59, 59)]
+    throttle = UploadThrottle(
+        1000 * KILOBYTE, RateSchedule.parse("09:00-17:00=100"), clock=clock,
+        now=lambda: now[0], sleep=clock.sleep)
+    assert throttle.rate == 1000 * KILOBYTE
+    now[0] = datetime(2020, 1, 1, 9)
+    throttle.consume(1)
+    # not until it looks at the clock again
+    assert throttle.rate == 1000 * KILOBYTE
+    clock.now += UploadThrottle.CHECK_INTERVAL
+    throttle.consume(1)
+    assert throttle.rate == 100 * KILOBYTE
+    throttle.set_limits(None)
+    assert throttle.rate is None
+
+
+def test_throttle_picks_up_saved_settings(tmp_path):
+    clock = SimulatedClock()
+    path = str(tmp_path / "throttle.json")
+    UploadThrottle.save_settings(path, 1000 * KILOBYTE, None)
+    throttle = UploadThrottle(settings_path=path, clock=clock,
+                              now=lambda: datetime(2020, 1, 1, 12),
+                              sleep=clock.sleep)
+    assert throttle.rate == 1000 * KILOBYTE
+    UploadThrottle.save_settings(path, None,
+                                 RateSchedule.parse("12:00-13:00=50"))
+    # as if it was saved later than file systems can tell apart
+    os.utime(path, ns=(0, 1))
+    clock.now += UploadThrottle.CHECK_INTERVAL
+    throttle.consume(1)
+    assert throttle.rate == 50 * KILOBYTE